@@ -0,0 +1,255 @@
+# shared DAQ acquisition helpers for gui.py and gui_thermo.py
+import numpy as np
+
+
+class RunningStats:
+    """Streaming mean/SD (Welford, merged a whole burst at a time with Chan's
+    update) so long averages never have to keep the raw samples."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values):
+        """Merge an array of samples into the running statistics."""
+
+        values = np.asarray(values, dtype=float).ravel()
+        n = len(values)
+        if n == 0:
+            return
+
+        bmean = values.mean()
+        bm2 = np.sum((values - bmean)**2)
+
+        total = self.n + n
+        delta = bmean - self.mean
+        self.mean = self.mean + delta*n/total
+        self.m2 = self.m2 + bm2 + delta**2*self.n*n/total
+        self.n = total
+
+    @property
+    def sd(self):
+        return np.sqrt(self.m2/(self.n - 1)) if self.n > 1 else np.nan
+
+    @property
+    def se(self):
+        return self.sd/np.sqrt(self.n) if self.n > 1 else np.nan
+
+
+class LoopStats:
+    """Per-step statistics across the loops of a scan, updated once per loop
+    (Welford per step), so a multi-loop scan can report its running average
+    and stop once it has converged."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        self.last = None
+        self.drift = np.nan # median step-by-step offset of the last loop from the one before
+        self.change = np.nan # median |shift of the average| from the last loop, in SEs
+        self.quiet = 0 # loops in a row that moved the average less than the tolerance
+
+    def add(self, means, tolerance=0.25):
+        """Merge one loop of step means."""
+
+        means = np.asarray(means, dtype=float).ravel()
+
+        if self.n == 0:
+            self.n = 1
+            self.mean = means.copy()
+            self.m2 = np.zeros_like(means)
+        else:
+            self.drift = np.nanmedian(means - self.last)
+            self.n += 1
+            delta = means - self.mean
+            self.mean = self.mean + delta/self.n
+            self.m2 = self.m2 + delta*(means - self.mean)
+            self.change = np.nanmedian(np.abs(delta/self.n)/self.se)
+            self.quiet = self.quiet + 1 if self.change < tolerance else 0
+
+        self.last = means
+
+    @property
+    def sd(self):
+        return np.sqrt(self.m2/(self.n - 1)) if self.n > 1 else np.full_like(self.mean, np.nan)
+
+    @property
+    def se(self):
+        return self.sd/np.sqrt(self.n)
+
+    @property
+    def median_se(self):
+        return np.nanmedian(self.se) if self.n > 1 else np.nan
+
+    def converged(self, target_se=None, patience=None):
+        """True once the median SE across steps is below target_se, or the
+        last patience loops all left the average where it was."""
+
+        if target_se is not None and self.median_se < target_se:
+            return True
+
+        return patience is not None and self.quiet >= patience
+
+
+def burst(daq, freq, quant, avs, channel=1, out=None):
+    """Fill an (avs, quant) buffer in place with avs bursts of quant samples."""
+
+    if out is None:
+        out = np.empty([avs, quant])
+
+    for avcount in range(avs):
+        out[avcount, :] = np.asarray(daq.aiBurst(1, [channel], freq, quant)['voltages'])[0:quant, 0]
+
+    return out
+
+
+def hardware_channels(channels):
+    """The channel list as the U12 takes it, 1, 2 or 4 channels: three are
+    padded with a repeat of the last, whose column the caller drops. The
+    padding counts against the 8192 samples/s and 4096 samples per burst."""
+
+    channels = list(channels)
+    if len(channels) not in (1, 2, 3, 4):
+        raise ValueError('the U12 reads 1, 2 or 4 channels at once, not %d' % len(channels))
+
+    return channels + channels[-1:] if len(channels) == 3 else channels
+
+
+def burst_channels(daq, freq, quant, avs, channels, out=None):
+    """Fill an (avs, quant, len(channels)) buffer with avs hardware-timed
+    multi-channel bursts. The U12 takes 1, 2 or 4 channels per burst (three
+    are read as four, see hardware_channels), at most 8192 samples/s and
+    4096 samples in total per burst."""
+
+    if out is None:
+        out = np.empty([avs, quant, len(channels)])
+
+    read = hardware_channels(channels)
+    for avcount in range(avs):
+        out[avcount] = np.asarray(daq.aiBurst(len(read), read, freq, quant)['voltages'])[0:quant, 0:len(channels)]
+
+    return out
+
+
+def normalize(voltages, mode=None):
+    """Signal (first channel) per sample, optionally normalized by the
+    reference (second channel): mode None, 'ratio' or 'difference'."""
+
+    if mode == 'ratio':
+        return voltages[..., 0]/voltages[..., 1]
+    if mode == 'difference':
+        return voltages[..., 0] - voltages[..., 1]
+
+    return voltages[..., 0]
+
+
+def multi_stats(daq, freq, quant, avs, channels, mode=None, streaming=False, out=None):
+    """Mean, SD and standard error of the (normalized) signal from one set of
+    multi-channel bursts, plus the mean of every channel (e.g. to read a
+    thermistor on a spare channel in the same pass). With out the bursts are
+    kept there (e.g. a RawArchive slot) instead of being dropped."""
+
+    if streaming and out is None:
+        stats = RunningStats()
+        channelstats = [RunningStats() for c in channels]
+        buffer = np.empty([1, quant, len(channels)])
+        for avcount in range(avs):
+            voltages = burst_channels(daq, freq, quant, 1, channels, out=buffer)
+            stats.add(normalize(voltages, mode))
+            for k in range(len(channels)):
+                channelstats[k].add(voltages[..., k])
+        return (stats.mean, stats.sd, stats.se), np.array([c.mean for c in channelstats])
+
+    voltages = burst_channels(daq, freq, quant, avs, channels, out=out)
+
+    return summarize(normalize(voltages, mode)), voltages.reshape(-1, len(channels)).mean(axis=0)
+
+
+def burst_stats(daq, freq, quant, avs, channel=1, streaming=False, out=None):
+    """Mean, SD and standard error of avs bursts of quant samples.
+
+    With streaming=True each burst is merged into a RunningStats and then
+    dropped, so memory does not grow with the number of averages. An out
+    buffer (avs, quant) keeps the bursts instead."""
+
+    if streaming and out is None:
+        stats = RunningStats()
+        buffer = np.empty([1, quant])
+        for avcount in range(avs):
+            stats.add(burst(daq, freq, quant, 1, channel, out=buffer))
+        return stats.mean, stats.sd, stats.se
+
+    voltages = burst(daq, freq, quant, avs, channel, out=out)
+
+    return summarize(voltages)
+
+
+def stream_stats(stream, n, channel=0, timeout=None, out=None):
+    """Mean, SD and standard error of the next n samples of a running
+    StreamAcquisition, instead of starting a burst. The samples are also
+    copied to out if given."""
+
+    voltages = stream.next(n, timeout)[:, channel]
+    if out is not None:
+        out[...] = voltages.reshape(out.shape)
+
+    return summarize(voltages)
+
+
+def stream_multi_stats(stream, n, mode=None, timeout=None, out=None):
+    """multi_stats() for the next n samples of a multi-channel stream."""
+
+    voltages = stream.next(n, timeout)
+    if out is not None:
+        out[...] = voltages.reshape(out.shape)
+
+    return summarize(normalize(voltages, mode)), voltages.mean(axis=0)
+
+
+def average_until(read, target_se, max_avs, min_avs=4):
+    """Call read(i) for burst i = 0, 1, ... until the standard error of
+    the step mean drops below target_se, or max_avs bursts.
+
+    The standard error is that of the burst means, not sd/sqrt(samples):
+    samples within a burst are correlated and the laser drifts between
+    bursts, which sd/sqrt(samples) ignores. It needs two bursts, and at
+    least min_avs are taken so a lucky small spread of the first few means
+    does not end the step early; it is the quantity autotune.predicted_se
+    models. read returns the samples of one
+    burst (already normalized), or a (samples, extra) pair whose extra
+    values (e.g. channel means) are averaged alongside. Returns ((mean, sd,
+    se), extra mean, bursts) with sd over all samples."""
+
+    if not 1 <= min_avs <= max_avs:
+        raise ValueError('need 1 <= min_avs (%d) <= max_avs (%d)' % (min_avs, max_avs))
+
+    stats = RunningStats()
+    means = RunningStats()
+    extra = None
+
+    for avcount in range(max_avs):
+        values = read(avcount)
+        if isinstance(values, tuple):
+            values, aux = values
+            extra = aux if extra is None else extra + aux
+        stats.add(values)
+        means.add(np.mean(values))
+        if avcount + 1 >= min_avs and means.se < target_se:
+            break
+
+    if extra is not None:
+        extra = extra/(avcount + 1)
+
+    return (stats.mean, stats.sd, means.se), extra, avcount + 1
+
+
+def summarize(voltages):
+    """Mean, SD (ddof=1, like statistics.stdev) and standard error in one pass."""
+
+    n = voltages.size
+    vmean = voltages.mean()
+    sd = np.sqrt(np.sum((voltages - vmean)**2)/(n - 1)) if n > 1 else np.nan
+
+    return vmean, sd, sd/np.sqrt(n)
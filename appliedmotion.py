@@ -0,0 +1,259 @@
+# Applied Motion stepper drive (SCL over RS-232) driving the delay stage
+import serial
+import time
+
+import numpy as np
+
+
+class AppliedMotion:
+    def __init__(self, port):
+        self.serial_port = self.appliedmotion_connect(port)
+        # self.pulses_per_degree = self.get_pulses_per_degree()
+        self.ps_per_cm = 100/3*2 # for a two pass stage
+        self.ps_per_rev = 4*2.54*self.ps_per_cm/10 # 20000 microsteps per revolution
+        
+        # last velocity (rev/s), acceleration and deceleration (rev/s^2) sent to the drive
+        self.ve = 3
+        self.ac = 10
+        self.de = 15
+        
+        # VE range of the drive (rev/s); it takes velocities to 4 decimals
+        self.min_velocity = 0.0042
+        self.max_velocity = 80
+        
+        # commands written whose replies have not been read yet
+        self.pending = 0
+        
+        # position model: last target (ps) and the microsteps commanded for it;
+        # unknown until the first move or zero, so nothing is skipped before that
+        self.target = 0.0
+        self.steps = 0
+        self.known = False
+        self.direction = -1 # sign of the last move
+        self.backlash = 0 # ps of slack taken up whenever the stage reverses
+        
+    def appliedmotion_connect(self, port, read_timeout=0.5, write_timeout=2):
+        """Set port parameters for the Thorlabs Elliptec rotation mount and connect
+        to the specified port. Port specification should be a string, e.g. 'COM6'.""" 
+        
+        ser = serial.Serial()
+        ser.baudrate = 9600
+        ser.bytesize = 8
+        ser.parity = 'N'
+        ser.stopbits = 1
+        ser.port = port #port is a variable that your specify when you run this function
+        ser.xonxoff = False
+        ser.rtscts = False
+        ser.dsrdtr = False
+        ser.timeout = read_timeout
+        ser.write_timeout = write_timeout
+        
+        ser.open()
+        
+        return ser
+    
+    def send(self,command,timeout=0.5):
+        """Send a command and return the drive's reply (None if there was none)."""
+        
+        return self.send_many([command],timeout)[0]
+    
+    def queue(self,command):
+        """Write a command without waiting for its reply; collect() reads it later."""
+        
+        # drop stale bytes before starting a new exchange
+        if self.pending == 0:
+            self.serial_port.reset_input_buffer()
+        
+        self.serial_port.write((command+'\r').encode())
+        self.pending += 1
+        
+    def collect(self,timeout=0.5):
+        """Read the replies of all queued commands. Replies end in a carriage
+        return, so each read returns as soon as the reply is complete and only
+        waits the full timeout when the drive does not answer."""
+        
+        self.serial_port.timeout = timeout
+        
+        replies = []
+        while self.pending > 0:
+            response = self.serial_port.read_until(b'\r').decode().rstrip('\r')
+            replies.append(response if len(response) > 0 else None)
+            self.pending -= 1
+        
+        return replies
+    
+    def send_many(self,commands,timeout=0.5):
+        """Write several commands back to back, then collect their replies."""
+        
+        for command in commands:
+            self.queue(command)
+        
+        return self.collect(timeout)
+    
+    def initialize(self):#want picoseconds per step instead of pulse per degree
+        """Find how many piezo pulses are needed to rotate the Elliptec stage 1 degree."""
+        
+        self.send_many(['MR8', # Sets microstepping to 20,000 steps per revolution
+                        # 'IFD', # Sets the format of drive responses to decimal
+                        'SP0', # Sets the starting position at 0
+                        'AR', # Alarm reset
+                        'AC10', # Acceleration 
+                        'DE15', # Deceleration
+                        'VE3', # Velocity 
+                        'ME']) # Enable Motor
+        
+        self.ac = 10
+        self.de = 15
+        self.ve = 3
+        self.reset_position()
+        
+    def ps_to_steps(self,ps):
+        
+        return int(round(ps*20000*10/4/2.54/self.ps_per_cm))
+    
+    def steps_to_ps(self,steps):
+        
+        return steps/(20000*10/4/2.54/self.ps_per_cm)
+
+    def move(self,steps): #input is ps
+        """Moves the stage to a position (ps).
+        
+        With backlash set, moves in the positive direction overshoot the
+        motor by the backlash, so the stage itself ends up at the same place
+        whichever side it comes from. A move to where the stage already is
+        sends nothing."""
+        
+        direction = np.sign(steps - self.target) if steps != self.target else self.direction
+        motor = self.ps_to_steps(steps + self.backlash*(direction > 0))
+        
+        if self.known and motor == self.steps:
+            self.target = steps
+            return
+        
+        self.send_many(['DI'+str(motor),'FP'])
+        self.target = steps
+        self.steps = motor
+        self.direction = direction
+        self.known = True
+        
+    def reset_position(self):
+        """The drive's origin was just set (SP0) at the current position."""
+        
+        self.target = 0.0
+        self.steps = 0
+        self.direction = -1
+        self.known = True
+        
+    def position(self):
+        """Stage position (ps) read back from the drive (IP), corrected for
+        backlash like move(); None if the drive did not answer."""
+        
+        reply = self.send('IP')
+        try:
+            steps = int(reply.split('=')[1],16) # hex like SC, 32-bit two's complement
+        except (AttributeError, IndexError, ValueError):
+            return None
+        if steps >= 0x80000000:
+            steps -= 0x100000000
+        
+        return self.steps_to_ps(steps) - self.backlash*(self.direction > 0)
+        
+    def status(self):
+        """Drive status code (SC, hex) as an int, or None if it did not answer."""
+        
+        reply = self.send('SC')
+        try:
+            return int(reply.split('=')[1],16)
+        except (AttributeError, IndexError, ValueError):
+            return None
+        
+    def wait_until_stopped(self,settle=0,poll=0.01,timeout=60):
+        """Poll the drive until the current move has finished, then wait an
+        optional extra settle time. Uses the moving bit of the status code and
+        falls back on the immediate position (IP) no longer changing."""
+        
+        start = time.perf_counter()
+        last = None
+        
+        while True:
+            code = self.status()
+            if code is not None:
+                if not code & 0x0010: # 0x0010 = motor moving
+                    break
+            else:
+                position = self.send('IP')
+                if position is not None and position == last:
+                    break
+                last = position
+            
+            if time.perf_counter() - start > timeout:
+                raise TimeoutError('stage still moving after %g s' % timeout)
+            time.sleep(poll)
+        
+        time.sleep(settle)
+        
+    def velocity(self,velocity):
+        """Set velocity."""
+        
+        self.send('VE'+str(velocity))
+        self.ve = float(velocity)
+      
+    def set_backlash(self,backlash):
+        """Backlash (ps) taken up whenever the stage reverses, compensated
+        by move() and position()."""
+        
+        self.backlash = float(backlash)
+        
+    def zero(self):
+        """Zero the stage."""
+        
+        self.send('SP0')
+        self.reset_position()
+        
+    def acceleration(self,acceleration):
+        """Set acceleration."""
+        
+        self.send('AC'+str(acceleration))
+        self.ac = float(acceleration)
+        
+    def deceleration(self,deceleration):
+        """Set deceleration."""
+        
+        self.send('DE'+str(deceleration))
+        self.de = float(deceleration)
+            
+    def disconnect(self):
+        """Disconnects the stage."""
+        
+        self.serial_port.close()
+        
+    def connect(self):
+        """Reconnects the stage (assuming the serial port interface has already
+        been created)."""
+        
+        self.serial_port.open()
+
+
+def move_profile(t, distance, velocity, acceleration, deceleration):
+    """Distance travelled t seconds after a trapezoidal move starts.
+
+    distance is in revolutions (always positive here), velocity in rev/s and
+    acceleration/deceleration in rev/s^2, the units of VE/AC/DE."""
+
+    t = np.asarray(t, dtype=float)
+
+    if distance <= 0:
+        return np.zeros(t.shape), 0.0
+
+    # short moves never reach full speed (triangular profile)
+    vpeak = min(velocity, np.sqrt(2*distance*acceleration*deceleration/(acceleration + deceleration)))
+    tacc = vpeak/acceleration
+    tdec = vpeak/deceleration
+    tconst = (distance - vpeak*tacc/2 - vpeak*tdec/2)/vpeak
+    tend = tacc + tconst + tdec
+
+    pos = np.where(t < tacc, acceleration*t**2/2,
+                   np.where(t < tacc + tconst, vpeak*tacc/2 + vpeak*(t - tacc),
+                            distance - deceleration*np.clip(tend - t, 0, None)**2/2))
+
+    return np.clip(np.where(t < 0, 0, pos), 0, distance), tend
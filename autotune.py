@@ -0,0 +1,178 @@
+# DAQ frequency, samples and averages for the shortest time to a target standard error
+import sys
+import time
+
+import numpy as np
+
+import acquisition
+import device_server
+
+FREQS = (400, 1024, 2048, 4096, 8192)
+MAX_SAMPLES = 4096 # U12 burst buffer, over all channels
+MAX_RATE = 8192 # samples/s over all channels
+
+
+def call_overhead(daq, channels, freq=FREQS[-1], quant=16, calls=5):
+    """Fixed cost (s) of one aiBurst call on top of its sampling time
+    (median of a few short bursts)."""
+
+    times = []
+    for k in range(calls):
+        start = time.perf_counter()
+        acquisition.burst_channels(daq, freq, quant, 1, channels)
+        times.append(time.perf_counter() - start - quant/freq)
+
+    return max(float(np.median(times)), 0.0)
+
+
+def autocorrelation(bursts):
+    """Normalized autocorrelation of the samples within each burst of a
+    (bursts, n) array, from the averaged power spectrum (zero padded, so it
+    is not circular). Returns (autocorrelation, power spectrum)."""
+
+    x = bursts - bursts.mean(axis=1, keepdims=True)
+    n = x.shape[1]
+
+    power = np.mean(np.abs(np.fft.rfft(x, 2*n, axis=1))**2, axis=0)
+    acf = np.fft.irfft(power)[:n]/np.arange(n, 0, -1) # fewer pairs at long lags
+
+    return acf/acf[0], power[:n//2 + 1]
+
+
+def correlation_factor(acf, window=5):
+    """kappa = 1 + 2*sum(rho_k): how much correlated samples inflate the
+    variance of their mean over independent ones. Summed up to the first
+    lag M >= window*kappa/2 (Sokal), past which the sum is only noise."""
+
+    kappa = 1.0
+    for m in range(1, len(acf)):
+        kappa += 2*acf[m]
+        if m >= window*kappa/2:
+            break
+
+    return max(kappa, 0.1)
+
+
+def noise_model(read, freq, quant, bursts=4):
+    """(variance, kappa, excess, power spectrum) of the signal at freq from
+    a few trial bursts. excess is the variance of burst means beyond what the
+    samples within a burst explain (drift, laser fluctuations slower than a
+    burst), which only more bursts average away."""
+
+    samples = np.array([read(freq, quant) for b in range(bursts)])
+
+    variance = samples.var(axis=1, ddof=1).mean()
+    acf, power = autocorrelation(samples)
+    kappa = correlation_factor(acf)
+    excess = 0.0
+    if bursts > 1:
+        excess = max(samples.mean(axis=1).var(ddof=1) - variance*kappa/quant, 0.0)
+
+    return variance, kappa, excess, power
+
+
+def predicted_se(model, quant, avs):
+    """Standard error of the mean of avs bursts of quant samples."""
+
+    variance, kappa, excess = model[0:3]
+
+    return np.sqrt((variance*kappa/quant + excess)/avs)
+
+
+def recommend(models, overhead, target_se, channels=1, max_avs=1000, max_seconds=1):
+    """(freq, quant, avs, seconds, se) reaching target_se in the least wall
+    time per step, or the smallest SE reachable with max_avs bursts. Bursts
+    stay under max_seconds, the aiBurst timeout. channels is the number the
+    U12 reads (see acquisition.hardware_channels)."""
+
+    options = []
+    for freq, model in models.items():
+        top = min(MAX_SAMPLES//channels, int(freq*max_seconds) - 1)
+        for quant in np.unique(np.geomspace(16, top, 40).astype(int)):
+            variance, kappa, excess = model[0:3]
+            avs = int(np.ceil((variance*kappa/quant + excess)/target_se**2))
+            avs = min(max(avs, 1), max_avs)
+            se = predicted_se(model, quant, avs)
+            options.append((freq, int(quant), avs, float(avs*(overhead + quant/freq)), float(se)))
+
+    reached = [option for option in options if option[4] <= target_se]
+    if len(reached) > 0:
+        return min(reached, key=lambda option: option[3])
+
+    return min(options, key=lambda option: (option[4], option[3]))
+
+
+def tune(daq, target_se, channels=[1], mode=None, convert=None, freqs=FREQS, bursts=4, max_avs=1000,
+         progress=None):
+    """Measure the call overhead and the noise at every frequency, then
+    recommend settings for target_se. mode normalizes by the reference
+    channel as in a scan; convert (e.g. Calibration.voltage_to_temperature)
+    makes the target SE in its units. The SE is that of the step mean over
+    its bursts, which is what a scan with a target SE stops on
+    (acquisition.average_until). Returns (recommendation, overhead,
+    {freq: noise model})."""
+
+    def read(freq, quant):
+        signal = acquisition.normalize(acquisition.burst_channels(daq, freq, quant, 1, channels)[0], mode)
+        return signal if convert is None else convert(signal)
+
+    overhead = call_overhead(daq, channels)
+    if progress is not None:
+        progress('call overhead %.1f ms' % (1000*overhead))
+
+    # three channels are read as four, which counts against the limits
+    nread = len(acquisition.hardware_channels(channels))
+
+    models = {}
+    for freq in freqs:
+        if freq*nread > MAX_RATE:
+            continue
+        # half a second of samples is plenty for the correlations
+        quant = min(MAX_SAMPLES//nread, freq//2)
+        models[freq] = noise_model(read, freq, quant, bursts)
+        if progress is not None:
+            variance, kappa, excess = models[freq][0:3]
+            progress('%5d Hz  SD %.3g  kappa %.2f  burst excess SD %.3g' % (freq, np.sqrt(variance), kappa, np.sqrt(excess)))
+
+    return recommend(models, overhead, target_se, nread, max_avs), overhead, models
+
+
+def main(argv=None):
+    """python autotune.py --target-se 1e-4 --channels 1,0 --normalize ratio"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Recommend DAQ settings for a target standard error.')
+    parser.add_argument('--target-se', type=float, required=True, help='standard error wanted per step (V)')
+    parser.add_argument('--channels', default='1', help='DAQ channels (signal, reference)')
+    parser.add_argument('--normalize', choices=['ratio', 'difference'], help='normalize by the reference channel')
+    parser.add_argument('--bursts', type=int, default=4, help='trial bursts per frequency')
+    parser.add_argument('--freq', type=int, help='current DAQ frequency, to compare')
+    parser.add_argument('--samples', type=int, help='current samples per burst, to compare')
+    parser.add_argument('--averages', type=int, help='current bursts per step, to compare')
+    parser.add_argument('--simulate', action='store_true', help='use the simulated DAQ')
+    args = parser.parse_args(argv)
+
+    daq, stage, server = device_server.open_hardware(args, with_stage=False)
+
+    channels = [int(c) for c in args.channels.split(',')]
+    try:
+        best, overhead, models = tune(daq, args.target_se, channels, args.normalize, bursts=args.bursts, progress=print)
+    finally:
+        device_server.close_hardware(stage, server)
+
+    freq, quant, avs, seconds, se = best
+    print('recommended: %d Hz, %d samples, %d averages - SE %.3g in %.2f s per step' % (freq, quant, avs, se, seconds))
+
+    if None not in (args.freq, args.samples, args.averages):
+        # the current frequency if it was measured, else the nearest one
+        model = models[min(models, key=lambda f: abs(f - args.freq))]
+        current = args.averages*(overhead + args.samples/args.freq)
+        print('current: %d Hz, %d samples, %d averages - SE %.3g in %.2f s per step'
+              % (args.freq, args.samples, args.averages, predicted_se(model, args.samples, args.averages), current))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
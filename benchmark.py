@@ -0,0 +1,124 @@
+# benchmarks for the scan and temperature loops against the simulated backends
+import argparse
+import queue
+import time
+import tracemalloc
+
+import numpy as np
+
+import acquisition
+import calibration
+import scan_engine
+from simulated import SimulatedAppliedMotion, SimulatedU12
+
+
+class TimedQueue(queue.Queue):
+    """Queue that remembers when each message was put, to measure delivery latency."""
+
+    def put(self, item, *args, **kwargs):
+        super(TimedQueue, self).put((time.perf_counter(), item), *args, **kwargs)
+
+
+def bench_scan(params, poll=0.1, tick=0.01):
+    """Run one simulated scan the way the GUI does: the main thread polls the
+    results queue every poll seconds and otherwise runs a tick timer.
+
+    Returns points/s, message latency, timer lateness and peak memory."""
+
+    stage = SimulatedAppliedMotion('SIM')
+    stage.initialize()
+    daq = SimulatedU12(stage=stage)
+
+    results = TimedQueue()
+    worker = scan_engine.ScanWorker(stage, daq, params, results=results)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    worker.start()
+
+    latency = []
+    lateness = []
+    steps = 0
+    nextpoll = start + poll
+    nexttick = start + tick
+
+    while True:
+        now = time.perf_counter()
+        if now >= nexttick:
+            lateness.append(now - nexttick)
+            nexttick = now + tick
+        if now >= nextpoll:
+            nextpoll = now + poll
+            try:
+                while True:
+                    sent, message = results.get_nowait()
+                    latency.append(time.perf_counter() - sent)
+                    if message[0] == 'step':
+                        steps += 1
+            except queue.Empty:
+                pass
+            if not worker.is_alive() and results.empty():
+                break
+        time.sleep(max(min(nexttick, nextpoll) - time.perf_counter(), 0))
+
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'points/s': steps/elapsed,
+            'latency median (ms)': 1000*np.median(latency),
+            'latency max (ms)': 1000*np.max(latency),
+            'timer lateness p99 (ms)': 1000*np.percentile(lateness, 99),
+            'peak memory (MB)': peak/1e6}
+
+
+def bench_thermo(freq, quant, steps):
+    """The gui_thermo loop: one burst per reading, every sample converted to temperature."""
+
+    daq = SimulatedU12(signal='thermistor')
+    cal = calibration.load('calibration_20240208.csv')
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    for x in range(steps):
+        np.mean(cal.voltage_to_temperature(acquisition.burst(daq, freq, quant, 1)))
+
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'readings/s': steps/elapsed, 'peak memory (MB)': peak/1e6}
+
+
+def report(name, result):
+    print(name)
+    for key, value in result.items():
+        print('    %-26s %10.3f' % (key, value))
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description='Benchmark the scan pipeline on simulated hardware.')
+    parser.add_argument('--points', type=int, default=50, help='scan points')
+    parser.add_argument('--freq', type=int, default=1200, help='DAQ frequency, at most 1200 Hz for the scans')
+    parser.add_argument('--samples', type=int, default=400)
+    parser.add_argument('--averages', type=int, default=1)
+    parser.add_argument('--wait', type=float, default=0)
+    args = parser.parse_args(argv)
+
+    # fly scans stream at 1200 Hz at most; every scan runs at the same rate
+    # and samples per step, so the modes are compared like for like
+    freq = min(args.freq, 1200)
+    params = {'start': -1.0, 'end': -1.0 + 0.1*(args.points - 1), 'step': 0.1, 'loops': 1,
+              'freq': freq, 'quant': args.samples, 'avs': args.averages, 'wait': args.wait}
+    print('%d points at %d Hz, %d samples x %d averages per point' % (args.points, freq, args.samples, args.averages))
+
+    report('step scan', bench_scan(dict(params, mode='step')))
+    report('step scan, streaming averages', bench_scan(dict(params, mode='step', streaming=True)))
+    report('fly scan', bench_scan(dict(params, mode='fly')))
+    report('temperature loop', bench_thermo(args.freq, args.samples, args.points))
+
+
+if __name__ == '__main__':
+    main()
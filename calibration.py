@@ -0,0 +1,112 @@
+# thermistor calibration - voltage -> resistance -> temperature, vectorized
+import functools
+import glob
+import os
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def resistance(voltage):
+    """Thermistor resistance (ohm) from the divider voltage, with the correction
+    used in gui_thermo. Works on scalars and arrays."""
+
+    voltage = np.asarray(voltage, dtype=float)
+
+    return 5100*(5-voltage)/(voltage+5100*(8.181e-6*voltage-11.67e-6))
+
+
+def pchip_slopes(x, y):
+    """Fritsch-Carlson derivatives for a monotone piecewise cubic through (x, y)."""
+
+    h = np.diff(x)
+    delta = np.diff(y)/h
+
+    if len(x) == 2:
+        return np.array([delta[0], delta[0]])
+
+    m = np.zeros(len(x))
+
+    # interior: weighted harmonic mean, zero at local extrema
+    w1 = 2*h[1:] + h[:-1]
+    w2 = h[1:] + 2*h[:-1]
+    same = delta[:-1]*delta[1:] > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        m[1:-1] = np.where(same, (w1 + w2)/(w1/delta[:-1] + w2/delta[1:]), 0)
+
+    # ends: one-sided three-point estimate, kept shape preserving
+    for end, (h0, h1, d0, d1) in ((0, (h[0], h[1], delta[0], delta[1])),
+                                   (-1, (h[-1], h[-2], delta[-1], delta[-2]))):
+        d = ((2*h0 + h1)*d0 - h0*d1)/(h0 + h1)
+        if np.sign(d) != np.sign(d0):
+            d = 0
+        elif np.sign(d0) != np.sign(d1) and abs(d) > abs(3*d0):
+            d = 3*d0
+        m[end] = d
+
+    return m
+
+
+class Calibration:
+    """Thermistor calibration table (resistance, temperature columns).
+
+    The table is sorted by resistance whatever order the file is in, and a
+    monotone cubic (PCHIP) in log-resistance is precomputed, so whole arrays
+    of voltages convert to temperatures in one call. Outside the table the
+    end temperatures are returned, as np.interp did."""
+
+    def __init__(self, path):
+        self.path = path
+
+        table = np.loadtxt(path, skiprows=1, delimiter=',', usecols=(0, 1), ndmin=2)
+        r, index = np.unique(table[:, 0], return_index=True) # sorts and drops repeats
+        t = table[index, 1]
+
+        self.resistance = r
+        self.temperature_table = t
+        self.x = np.log(r)
+        self.h = np.diff(self.x)
+        self.slopes = pchip_slopes(self.x, t)
+
+    def temperature(self, resistance):
+        """Temperature for resistance(s) in ohm."""
+
+        r = np.clip(np.asarray(resistance, dtype=float), self.resistance[0], self.resistance[-1])
+        x = np.log(r)
+
+        i = np.clip(np.searchsorted(self.x, x, side='right') - 1, 0, len(self.x) - 2)
+        h = self.h[i]
+        s = (x - self.x[i])/h
+
+        y0 = self.temperature_table[i]
+        y1 = self.temperature_table[i + 1]
+
+        # cubic Hermite basis
+        return (y0*(1 + 2*s)*(1 - s)**2 + y1*s**2*(3 - 2*s)
+                + h*(self.slopes[i]*s*(1 - s)**2 - self.slopes[i + 1]*s**2*(1 - s)))
+
+    def voltage_to_temperature(self, voltage):
+        """Temperature for divider voltage(s), e.g. a whole burst at once."""
+
+        return self.temperature(resistance(voltage))
+
+
+@functools.lru_cache(maxsize=None)
+def _load(path, mtime):
+    return Calibration(path)
+
+
+def load(name):
+    """Calibration for a calibration_*.csv file, loaded once and cached until
+    the file changes. Relative names are looked up next to this module."""
+
+    path = name if os.path.isabs(name) else os.path.join(HERE, name)
+
+    return _load(path, os.path.getmtime(path))
+
+
+def available():
+    """Names of the calibration files shipped next to this module, newest last."""
+
+    return sorted(os.path.basename(p) for p in glob.glob(os.path.join(HERE, 'calibration*.csv')))
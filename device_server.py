@@ -0,0 +1,474 @@
+# local server owning the U12 and the stage, shared by several clients
+import sys
+import threading
+import time
+from multiprocessing.connection import Client as Connect, Listener
+
+import numpy as np
+
+import acquisition
+from stream import StreamAcquisition
+
+ADDRESS = ('localhost', 6012)
+AUTHKEY = b'vo2-devices'
+
+
+class DeviceServer:
+    """Holds the only U12 handle and the stage port and serves them to local
+    clients (gui.py, gui_thermo.py, scripts) over multiprocessing.connection.
+
+    A request is (target, name, args, kwargs) with target 'daq', 'stage',
+    'stream' or 'server'; the reply is ('ok', result) or ('error',
+    exception). A lock per device keeps calls from different clients from
+    interleaving on the hardware; ('batch', [request, ...]) runs several
+    calls under the locks at once and answers with the list of results, one
+    round trip for e.g. a move and its status polls.
+
+    The server can keep a StreamAcquisition running (start_stream). Clients
+    read it like a local one through the 'stream' target, and connections
+    that open with ('subscribe',) are sent every new block of samples as
+    ('data', first_index, samples). While it runs, daq calls are refused, so
+    no client's bursts can get between the stream reads. Every start_stream
+    is a use of the stream by that connection, ended by release_stream or by
+    the connection closing; the hardware stream stops with its last user.
+
+    A scan holds the stage exclusively (lease_stage, release_stage): while
+    one connection has the lease, stage calls from every other connection
+    are refused, so nobody moves the stage between a scan's move and its
+    status polls. The lease ends with release_stage or when the connection
+    closes."""
+
+    def __init__(self, daq, stage, address=ADDRESS, authkey=AUTHKEY):
+        self.targets = {'daq': daq, 'stage': stage, 'server': self, 'stream': None}
+        # the stream is thread-safe on its own; RLocks because start_stream
+        # takes the daq lock inside a server call
+        self.locks = {'daq': threading.RLock(), 'stage': threading.RLock(), 'server': threading.RLock()}
+
+        self.listener = Listener(address, authkey=authkey)
+        self.subscribers = []
+        self.running = False
+
+        # the connection a request comes from, one handler thread per connection
+        self.local = threading.local()
+        self.lease = None
+        self.streamusers = {} # connection -> start_stream calls not released yet
+
+    def serve_forever(self):
+        """Accept clients until close(); each gets its own thread."""
+
+        self.running = True
+        while self.running:
+            try:
+                conn = self.listener.accept()
+            except OSError:
+                break # closed
+            except Exception:
+                continue # failed handshake
+            threading.Thread(target=self.handle, args=(conn,), daemon=True).start()
+
+    def close(self):
+        self.running = False
+        self.stop_stream()
+        self.listener.close()
+
+    def handle(self, conn):
+
+        self.local.owner = id(conn)
+
+        while True:
+            try:
+                request = conn.recv()
+            except (EOFError, OSError):
+                with self.locks['server']:
+                    self.release_stage()
+                    self.release_stream(everything=True)
+                conn.close()
+                return
+
+            if request[0] == 'subscribe':
+                self.subscribers.append(conn) # the publisher sends from now on
+                return
+
+            try:
+                if request[0] == 'batch':
+                    reply = ('ok', self.run_batch(request[1]))
+                else:
+                    reply = ('ok', self.run_batch([request])[0])
+            except Exception as e:
+                reply = ('error', e)
+
+            try:
+                conn.send(reply)
+            except (OSError, ValueError):
+                conn.close()
+                return
+            except Exception as e:
+                conn.send(('error', RuntimeError(repr(e)))) # result or exception not picklable
+
+    def run_batch(self, requests):
+
+        # locks always taken in the same order, so batches cannot deadlock
+        names = sorted(set(request[0] for request in requests if request[0] in self.locks))
+        for name in names:
+            self.locks[name].acquire()
+        try:
+            return [self.run(*request) for request in requests]
+        finally:
+            for name in reversed(names):
+                self.locks[name].release()
+
+    def run(self, target, name, args=(), kwargs={}):
+
+        if target not in self.targets:
+            raise KeyError('no device %r' % target)
+        if target == 'daq' and self.targets['stream'] is not None and self.targets['stream'].running:
+            raise RuntimeError('the U12 is streaming; read from the stream instead')
+        if self.targets[target] is None:
+            raise RuntimeError('no stream running')
+        if target == 'stage' and self.lease not in (None, getattr(self.local, 'owner', None)):
+            raise RuntimeError('the stage is in use by a scan in another program')
+
+        obj = self.targets[target]
+
+        # attribute lookup first, so proxies know what is a method
+        if name == '__getattr__':
+            value = getattr(obj, args[0])
+            return ('callable',) if callable(value) else ('value', value)
+        if name == '__setattr__':
+            return setattr(obj, args[0], args[1])
+
+        return getattr(obj, name)(*args, **kwargs)
+
+    def lease_stage(self):
+        """Hold the stage for this connection until release_stage."""
+
+        owner = getattr(self.local, 'owner', None)
+        if self.lease not in (None, owner):
+            raise RuntimeError('the stage is in use by a scan in another program')
+        self.lease = owner
+
+    def release_stage(self):
+
+        if self.lease == getattr(self.local, 'owner', None):
+            self.lease = None
+
+    def start_stream(self, channels=[1], freq=1200, seconds=60):
+        """Start the shared stream; a second client asking for the same
+        configuration just shares it."""
+
+        stream = self.targets['stream']
+        if stream is not None and stream.running:
+            if stream.channels != list(channels) or stream.freq != freq:
+                raise RuntimeError('already streaming channels %s at %s Hz' % (stream.channels, stream.freq))
+        else:
+            # a stream that failed still has to be cleared on the U12
+            if stream is not None:
+                stream.stop()
+
+            with self.locks['daq']:
+                stream = StreamAcquisition(self.targets['daq'], channels, freq, seconds)
+                stream.start()
+            self.targets['stream'] = stream
+            threading.Thread(target=self.publish, args=(stream,), daemon=True).start()
+
+        owner = getattr(self.local, 'owner', None)
+        self.streamusers[owner] = self.streamusers.get(owner, 0) + 1
+
+    def release_stream(self, everything=False):
+        """End one use of the shared stream by this connection (every one
+        with everything=True); the last user's release stops it."""
+
+        owner = getattr(self.local, 'owner', None)
+        if owner not in self.streamusers:
+            return
+
+        self.streamusers[owner] -= 1
+        if everything or self.streamusers[owner] <= 0:
+            del self.streamusers[owner]
+        if len(self.streamusers) == 0:
+            self.stop_stream()
+
+    def streaming(self):
+        """Channels of the running shared stream, or None."""
+
+        stream = self.targets['stream']
+
+        return stream.channels if stream is not None and stream.running else None
+
+    def stop_stream(self):
+
+        stream = self.targets['stream']
+        if stream is not None:
+            stream.stop()
+
+    def publish(self, stream):
+
+        sent = stream.count
+        while stream.running:
+            try:
+                stream.wait_for(sent + stream.chunk, timeout=1)
+            except (TimeoutError, RuntimeError):
+                continue
+
+            # whatever is still in the ring buffer if a subscriber fell behind
+            count = stream.count
+            start = max(sent, count - stream.size)
+            samples = stream.read(start, count - start)
+
+            for conn in list(self.subscribers):
+                try:
+                    conn.send(('data', start, samples))
+                except Exception:
+                    self.subscribers.remove(conn)
+                    conn.close()
+            sent = count
+
+        for conn in list(self.subscribers):
+            conn.close()
+        self.subscribers = []
+
+
+class DeviceClient:
+    """One connection to a DeviceServer; safe to share between threads."""
+
+    def __init__(self, address=ADDRESS, authkey=AUTHKEY):
+        self.conn = Connect(address, authkey=authkey)
+        self.lock = threading.Lock()
+
+    def _request(self, request):
+
+        with self.lock:
+            self.conn.send(request)
+            status, result = self.conn.recv()
+
+        if status == 'error':
+            raise result
+
+        return result
+
+    def call(self, target, name, *args, **kwargs):
+        return self._request((target, name, args, kwargs))
+
+    def batch(self, calls):
+        """Run [(target, name, args, kwargs), ...] in one round trip, under
+        the device locks; returns the list of results."""
+
+        requests = []
+        for call in calls:
+            args = call[2] if len(call) > 2 else ()
+            kwargs = call[3] if len(call) > 3 else {}
+            requests.append((call[0], call[1], tuple(args), kwargs))
+
+        return self._request(('batch', requests))
+
+    def close(self):
+        self.conn.close()
+
+
+class Remote:
+    """Stand-in for a device on the server: methods run there, attributes
+    are read from there every time (e.g. the stage velocity), so existing
+    code like acquisition.burst or the scan engine works unchanged.
+    Setting a public attribute sets it on the server's device."""
+
+    _target = None
+
+    def __init__(self, client):
+        self._client = client
+        self._methods = {}
+
+    def __setattr__(self, name, value):
+
+        # settings like stage.backlash belong on the server's device, not on the proxy
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            self._client.call(self._target, '__setattr__', name, value)
+
+    def __getattr__(self, name):
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name in self._methods:
+            return self._methods[name]
+
+        kind = self._client.call(self._target, '__getattr__', name)
+        if kind[0] == 'value':
+            return kind[1]
+
+        def method(*args, **kwargs):
+            return self._client.call(self._target, name, *args, **kwargs)
+
+        self._methods[name] = method
+
+        return method
+
+
+class RemoteU12(Remote):
+    _target = 'daq'
+
+
+class RemoteStage(Remote):
+    _target = 'stage'
+
+
+class RemoteStream(Remote):
+    """The server's StreamAcquisition, e.g. for ScanWorker(stream=...)."""
+
+    _target = 'stream'
+
+    def stop(self):
+        """Release this client's use of the shared stream; other clients
+        keep reading it, the server stops it after the last one."""
+
+        self._client.call('server', 'release_stream')
+
+
+class RemoteServer(Remote):
+    """The server itself: the shared stream and the stage lease."""
+
+    _target = 'server'
+
+    def open_stream(self, channels=[1], freq=1200, seconds=60):
+        """Start (or join) the server's stream; returns a RemoteStream."""
+
+        self._client.call('server', 'start_stream', list(channels), freq, seconds)
+
+        return RemoteStream(self._client)
+
+    def shared_stream(self):
+        """RemoteStream of the stream another client started, or None if
+        the server is not streaming. Reading it does not count as a use."""
+
+        if self._client.call('server', 'streaming') is None:
+            return None
+
+        return RemoteStream(self._client)
+
+
+def connect(address=ADDRESS, authkey=AUTHKEY):
+    """(RemoteU12, RemoteStage, RemoteServer) if a server is running, else
+    None so the caller can open the hardware itself."""
+
+    try:
+        client = DeviceClient(address, authkey)
+    except OSError:
+        return None
+
+    return RemoteU12(client), RemoteStage(client), RemoteServer(client)
+
+
+def lease(stage):
+    """Hold a stage on a server for this client; nothing to do for a local one."""
+
+    if isinstance(stage, RemoteStage):
+        stage._client.call('server', 'lease_stage')
+
+
+def release(stage):
+
+    if isinstance(stage, RemoteStage):
+        stage._client.call('server', 'release_stage')
+
+
+def open_hardware(args, with_stage=True, shared=True):
+    """(daq, stage, server) for a command line tool: the proxies of a
+    running device server, so the tool works next to the GUIs, else the
+    simulator with args.simulate or the U12 and the stage on args.port.
+    server is the RemoteServer, or None when the hardware was opened here.
+    with_stage=False leaves the stage alone (None)."""
+
+    remote = connect() if shared else None
+    if remote is not None:
+        return remote[0], remote[1] if with_stage else None, remote[2]
+
+    port = getattr(args, 'port', 'COM12')
+    if args.simulate:
+        from simulated import SimulatedAppliedMotion, SimulatedU12
+        stage = SimulatedAppliedMotion(port) if with_stage else None
+        daq = SimulatedU12(stage=stage)
+    else:
+        import u12
+        from appliedmotion import AppliedMotion
+        stage = AppliedMotion(port) if with_stage else None
+        daq = u12.U12()
+
+    return daq, stage, None
+
+
+def close_hardware(stage, server):
+    """Let go of what open_hardware opened: the connection to the server
+    (the devices stay with it) or the stage port."""
+
+    if server is not None:
+        server._client.close()
+    elif stage is not None:
+        stage.disconnect()
+
+
+def read_channel(daq, server, freq, quant, channel=1):
+    """One (1, quant) reading of a DAQ channel like acquisition.burst: a
+    burst, or while the server streams (and refuses bursts) the next quant
+    samples of that channel from the shared stream, at the stream's rate."""
+
+    stream = server.shared_stream() if server is not None else None
+    if stream is None:
+        return acquisition.burst(daq, freq, quant, 1, channel)
+
+    channels = stream.channels
+    if channel not in channels:
+        raise RuntimeError('the U12 is streaming channels %s, not channel %d' % (channels, channel))
+
+    return stream.next(quant, timeout=quant/stream.freq + 10)[:, channels.index(channel)][np.newaxis]
+
+
+def subscribe(address=ADDRESS, authkey=AUTHKEY):
+    """Generator of (first_index, samples) blocks of the shared stream."""
+
+    conn = Connect(address, authkey=authkey)
+    conn.send(('subscribe',))
+
+    try:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+            yield message[1], message[2]
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    """python device_server.py --port COM12 - run until Ctrl-C"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Share the U12 and the stage between local programs.')
+    parser.add_argument('--port', default='COM12', help='serial port of the stage')
+    parser.add_argument('--listen', type=int, default=ADDRESS[1], help='local TCP port to listen on')
+    parser.add_argument('--simulate', action='store_true', help='use the simulated stage and DAQ')
+    args = parser.parse_args(argv)
+
+    # this is the server, so the hardware is opened here whatever else runs
+    daq, stage, remote = open_hardware(args, shared=False)
+
+    server = DeviceServer(daq, stage, ('localhost', args.listen))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print('serving the U12 and stage on localhost:%d' % args.listen)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        stage.disconnect()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,9 +4,11 @@ from tkinter import messagebox
 from tkinter import filedialog
 import pandas as pd
 import numpy as np
-from statistics import mean, stdev
 from datetime import datetime
+import importlib.util
 import os
+import queue
+import threading
 
 # imports for figure imbed
 import matplotlib
@@ -14,102 +16,31 @@ matplotlib.use("TkAgg")
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure, Axes
 
-# imports for figure animation
-import matplotlib.animation as animation
+# imports for incremental live plot
+from live_plot import LivePlot
 
 # imports for stage
-import serial
+from appliedmotion import AppliedMotion
 import time
 
 # imports for daq card
 import u12
+import device_server
+
+# background scan engine
+import acquisition
+import autotune
+import calibration
+import scan_engine
+import scan_planner
+import scan_queue
+import scan_writer
+import timing
+from stream import StreamAcquisition
 
 # labjack = u12.U12()
 # labjack.getCalibrationData()
 
-class AppliedMotion:
-    def __init__(self, port):
-        self.serial_port = self.appliedmotion_connect(port)
-        # self.pulses_per_degree = self.get_pulses_per_degree()
-        self.ps_per_cm = 100/3*2 # for a two pass stage
-        
-    def appliedmotion_connect(self, port, read_timeout=2, write_timeout=2):
-        """Set port parameters for the Thorlabs Elliptec rotation mount and connect
-        to the specified port. Port specification should be a string, e.g. 'COM6'.""" 
-        
-        ser = serial.Serial()
-        ser.baudrate = 9600
-        ser.bytesize = 8
-        ser.parity = 'N'
-        ser.stopbits = 1
-        ser.port = port #port is a variable that your specify when you run this function
-        ser.xonxoff = False
-        ser.rtscts = False
-        ser.dsrdtr = False
-        ser.timeout = 2
-        ser.write_timeout = 2
-        
-        ser.open()
-        
-        return ser
-    
-    def send(self,command):
-        self.serial_port.write((command+'\r').encode())
-        response = self.serial_port.read(15).decode()
-        if len(response) > 0:
-            return response
-            self.serial_port.flushInput()
-    
-    
-    def initialize(self):#want picoseconds per step instead of pulse per degree
-        """Find how many piezo pulses are needed to rotate the Elliptec stage 1 degree."""
-        
-        self.send('MR8') # Sets microstepping to 20,000 steps per revolution
-        # self.send('IFD') # Sets the format of drive responses to decimal
-        self.send('SP0') # Sets the starting position at 0
-        self.send('AR') # Alarm reset
-        self.send('AC10') # Acceleration 
-        self.send('DE15') # Deceleration
-        self.send('VE3') # Velocity 
-        self.send('ME')  # Enable Motor
-
-    def move(self,steps): #input is ps
-        """Moves the stage a given number of steps."""
-        
-        self.send('DI'+str(int(round(steps*20000*10/4/2.54/self.ps_per_cm))))
-        self.send('FP')
-        
-    def velocity(self,velocity):
-        """Set velocity."""
-        
-        self.send('VE'+str(velocity))
-      
-    def zero(self):
-        """Zero the stage."""
-        
-        self.send('SP0')
-        
-    def acceleration(self,acceleration):
-        """Set acceleration."""
-        
-        self.send('AC'+str(acceleration))
-        
-    def deceleration(self,deceleration):
-        """Set deceleration."""
-        
-        self.send('DE'+str(deceleration))        
-            
-    def disconnect(self):
-        """Disconnects the stage."""
-        
-        self.serial_port.close()
-        
-    def connect(self):
-        """Reconnects the stage (assuming the serial port interface has already
-        been created)."""
-        
-        self.serial_port.open()
-
 # define labjack objects
 
 
@@ -138,6 +69,28 @@ class Application(tk.Frame):
         self.scannum = tk.StringVar()
         self.waittime = tk.StringVar()
         self.loopnum = tk.StringVar()
+        self.scanstatus = tk.StringVar()
+        self.streamstatus = tk.StringVar()
+        self.channelvalue = tk.StringVar() # DAQ channels, signal first
+        self.normmode = tk.StringVar() # per-sample normalization by the second channel
+        self.thermchannel = tk.StringVar() # optional thermistor channel read in the same pass
+        self.calfile = tk.StringVar() # thermistor calibration for that channel
+        self.sampletemp = tk.StringVar()
+        self.lockinmode = tk.StringVar() # software lock-in: off, reference channel or known chopper frequency
+        self.chopperfreq = tk.StringVar()
+        self.segments = tk.StringVar() # non-uniform grid, overrides start/end/step when set
+        self.targetse = tk.StringVar() # stop averaging a step below this standard error
+        self.stopse = tk.StringVar() # stop looping once the median SE across loops is below this
+        self.stoploops = tk.StringVar() # ... or after this many loops without significant change
+        self.loopstatus = tk.StringVar()
+        self.throughput = tk.StringVar() # points/s and time left of the running scan
+        self.resumescan = tk.IntVar() # continue an interrupted scan
+        self.keepraw = tk.IntVar() # archive every raw burst in data_NN_raw.npy
+        self.serpentine = tk.IntVar() # every other loop backwards, no return to zero
+        self.backlash = tk.StringVar() # stage slack (ps) compensated on reversals
+        self.logformat = tk.StringVar() # format of the per-step log
+        self.streamavs = tk.IntVar() # running averages instead of holding raw bursts
+        self.scanmode = tk.StringVar() # 'step' (move, settle, burst) or 'fly' (continuous)
         # self.endpos = tk.StringVar()
         # self.startpos = tk.StringVar()
         # self.stepsize = tk.StringVar()
@@ -149,26 +102,63 @@ class Application(tk.Frame):
         self.scannum.set(1)
         self.waittime.set(1)
         self.loopnum.set(1)
+        self.scanstatus.set('Idle')
+        self.resumescan.set(0)
+        self.keepraw.set(0)
+        self.serpentine.set(0)
+        self.backlash.set('0')
+        self.logformat.set('txt')
+        self.streamavs.set(0)
+        self.scanmode.set('step')
+        self.channelvalue.set('1')
+        self.normmode.set('none')
+        self.thermchannel.set('')
+        self.calfile.set('calibration_20240208.csv')
+        self.lockinmode.set('off')
+        self.chopperfreq.set('')
+        self.segments.set('')
+        self.targetse.set('')
+        self.stopse.set('')
+        self.stoploops.set('')
+        self.loopstatus.set('')
+        
+        # scan worker thread, None until the first scan
+        self.worker = None
+        
+        # continuous U12 stream, None while bursts are used
+        self.stream = None
+        
+        # auto-tune runs on its own thread, its recommendation comes back here
+        self.tuner = None
+        self.tuneresults = queue.Queue()
+        
+        # scans waiting to run, kept in scan_queue.json; queuejob is the one running
+        self.scanqueue = scan_queue.ScanQueue()
+        self.queuejob = None
+        self.queuestatus = tk.StringVar()
     
         # define figure
-        self.figdata_x = [1,2,3,4,5]
-        self.figdata_y = [1,2,3,4,5]
         self.figure = Figure(figsize=(10,5), dpi=100)
         self.figsubplot = self.figure.add_subplot(111)
-        self.figsubplot.plot(self.figdata_x,self.figdata_y)
-        self.figsubplot.set_xlabel('Time (ps)')
-        self.figsubplot.set_ylabel('Amp (V)')
         
         # run functions below
         self.plotFigure()
         self.createWidgets()
+        
+        # persistent lines, only redrawn when new points arrive
+        self.liveplot = LivePlot(self.canvas,self.figsubplot,'Time (ps)','Amp (V)')
+        self.after(250,self.animate)
 
-    def animate(self,i,j):
+    def animate(self):
 
-        self.figsubplot.clear()
-        self.figsubplot.plot(self.figdata_x,self.figdata_y)
-        self.figsubplot.set_xlabel('Time (ps)')
-        self.figsubplot.set_ylabel('Amp (V)')
+        t0 = time.perf_counter()
+        self.liveplot.draw()
+        
+        # redraw time and live throughput of the running scan
+        if self.worker is not None and self.worker.is_alive():
+            self.worker.timer.add('ui',time.perf_counter() - t0)
+            self.throughput.set('%.2f points/s, ETA %s' % (self.worker.timer.rate(),timing.format_eta(self.worker.timer.eta())))
+        self.after(250,self.animate)
 
     
     def plotFigure(self):
@@ -217,6 +207,66 @@ class Application(tk.Frame):
         self.davalue = tk.Entry(self,textvariable =  self.davaluedefault)
         self.davalue.grid(row = 4,column = 1)
         
+        # Lock-in mode
+        self.lockin = tk.OptionMenu(self,self.lockinmode,'off','reference','chopper')
+        self.lockin.grid(row = 6,column = 2)
+        
+        # Chopper frequency label
+        self.chopper = tk.Label(self,text = 'Chopper Frequency (Hz)')
+        self.chopper.grid(row = 7,column = 2)
+        
+        # Chopper frequency entry
+        self.choppervalue = tk.Entry(self,textvariable = self.chopperfreq)
+        self.choppervalue.grid(row = 8,column = 2)
+        
+        # Target standard error label
+        self.targeterr = tk.Label(self,text = 'Target SE (V), blank = fixed averages')
+        self.targeterr.grid(row = 2,column = 2)
+        
+        # Target standard error entry
+        self.targetvalue = tk.Entry(self,textvariable = self.targetse)
+        self.targetvalue.grid(row = 3,column = 2)
+        
+        # Delay segments label
+        self.segmentlabel = tk.Label(self,text = 'Delay Segments (start:end:step, ...)')
+        self.segmentlabel.grid(row = 9,column = 2)
+        
+        # Delay segments entry
+        self.segmentvalue = tk.Entry(self,textvariable = self.segments)
+        self.segmentvalue.grid(row = 10,column = 2,sticky = tk.W+tk.E)
+        
+        # Refine the grid from the last scan
+        self.refine = tk.Button(self,text = 'Refine From Last Scan',command = self.refineCallback)
+        self.refine.grid(row = 11,column = 2)
+        
+        # Stop at loop SE label
+        self.stopselabel = tk.Label(self,text = 'Stop At Median Loop SE (V)')
+        self.stopselabel.grid(row = 1,column = 4)
+        
+        # Stop at loop SE entry
+        self.stopsevalue = tk.Entry(self,textvariable = self.stopse)
+        self.stopsevalue.grid(row = 1,column = 5)
+        
+        # Stop after stable loops label
+        self.stoploopslabel = tk.Label(self,text = 'Stop After Stable Loops')
+        self.stoploopslabel.grid(row = 2,column = 4)
+        
+        # Stop after stable loops entry
+        self.stoploopsvalue = tk.Entry(self,textvariable = self.stoploops)
+        self.stoploopsvalue.grid(row = 2,column = 5)
+        
+        # Running cross-loop statistics
+        self.loopstats = tk.Label(self,textvariable = self.loopstatus)
+        self.loopstats.grid(row = 3,column = 4,columnspan = 2)
+        
+        # Throughput and ETA
+        self.throughputlabel = tk.Label(self,textvariable = self.throughput)
+        self.throughputlabel.grid(row = 14,column = 2)
+        
+        # Streaming averages checkbox
+        self.streamingavs = tk.Checkbutton(self,text = 'Streaming averages',variable = self.streamavs)
+        self.streamingavs.grid(row = 4,column = 2)
+        
         # DataSettle Label
         # MANUAL: "Auto" (0) ensures enough settling for any gain and resolution with source impedances less than at least 1 kohms
         #self.datasettle = tk.Label(self,text = 'Settling Factor (recommend 0)')
@@ -281,6 +331,51 @@ class Application(tk.Frame):
         self.startscan = tk.Button(self,text = 'Start Scan',command = self.scanCallback)
         self.startscan.grid(row =5,column = 0)
         
+        # Scan mode
+        self.mode = tk.OptionMenu(self,self.scanmode,'step','fly')
+        self.mode.grid(row =5,column = 1)
+        
+        # Pause/Resume Button
+        self.pausescan = tk.Button(self,text = 'Pause/Resume',command = self.pauseCallback)
+        self.pausescan.grid(row =12,column = 0)
+        
+        # Abort Button
+        self.abortscan = tk.Button(self,text = 'Abort Scan',command = self.abortCallback)
+        self.abortscan.grid(row =12,column = 1)
+        
+        # Resume checkbox
+        self.resume = tk.Checkbutton(self,text = 'Resume interrupted scan',variable = self.resumescan)
+        self.resume.grid(row =12,column = 2)
+        
+        # Raw burst archive checkbox
+        self.raw = tk.Checkbutton(self,text = 'Keep raw bursts',variable = self.keepraw)
+        self.raw.grid(row =5,column = 2)
+        
+        # Serpentine loops checkbox
+        self.serpent = tk.Checkbutton(self,text = 'Serpentine loops',variable = self.serpentine)
+        self.serpent.grid(row =1,column = 2)
+        
+        # Backlash label
+        self.backlashlabel = tk.Label(self,text = 'Stage Backlash (ps)')
+        self.backlashlabel.grid(row = 16,column = 0)
+        
+        # Backlash entry
+        self.backlashvalue = tk.Entry(self,textvariable = self.backlash)
+        self.backlashvalue.grid(row = 16,column = 1)
+        
+        # Auto-tune Button
+        self.autotune = tk.Button(self,text = 'Auto-tune DAQ',command = self.autotuneCallback)
+        self.autotune.grid(row = 16,column = 2)
+        
+        # Step log format
+        # HDF5 step logs need pytables
+        self.logfmt = tk.OptionMenu(self,self.logformat,*(['txt'] + (['hdf5'] if importlib.util.find_spec('tables') else [])))
+        self.logfmt.grid(row =13,column = 2)
+        
+        # Scan status
+        self.status = tk.Label(self,textvariable = self.scanstatus)
+        self.status.grid(row =13,column = 0,columnspan = 2)
+        
         # Scan start position
         self.startpos = tk.Label(self,text="Scan Start Position (ps)")
         self.startpos.grid(row=6, column=0)
@@ -316,13 +411,57 @@ class Application(tk.Frame):
         #set stage end position Label
         
         
+        # Start/Stop Stream Button
+        self.startstream = tk.Button(self,text = 'Start/Stop Stream',command = self.startscanCallback)
+        self.startstream.grid(row = 9,column = 4)
+        
         # Est Freq Label
-        #self.estfreq = tk.Label(self,text = 'Estimated Scan Frequency (Hz)')
-        #self.estfreq.grid(row = 10,column = 0)
+        self.estfreq = tk.Label(self,text = 'Measured Stream Frequency (Hz)')
+        self.estfreq.grid(row = 10,column = 4)
 
         # Est Freq Entry
-        #self.efvalue = tk.Entry(self,textvariable = self.EstFreqValue)
-        #self.efvalue.grid(row = 10,column = 1)
+        self.efvalue = tk.Entry(self,textvariable = self.EstFreqValue)
+        self.efvalue.grid(row = 10,column = 5)
+        
+        # Stream missed/underflow counts
+        self.streamcounts = tk.Label(self,textvariable = self.streamstatus)
+        self.streamcounts.grid(row = 11,column = 4,columnspan = 2)
+        
+        # DAQ channels label
+        self.channels = tk.Label(self,text = 'DAQ Channels (signal, reference)')
+        self.channels.grid(row = 12,column = 4)
+        
+        # DAQ channels entry
+        self.chvalue = tk.Entry(self,textvariable = self.channelvalue)
+        self.chvalue.grid(row = 12,column = 5)
+        
+        # Normalization label
+        self.norm = tk.Label(self,text = 'Normalize by Reference')
+        self.norm.grid(row = 13,column = 4)
+        
+        # Normalization choice
+        self.normvalue = tk.OptionMenu(self,self.normmode,'none','ratio','difference')
+        self.normvalue.grid(row = 13,column = 5)
+        
+        # Thermistor channel label
+        self.therm = tk.Label(self,text = 'Thermistor Channel (optional)')
+        self.therm.grid(row = 14,column = 4)
+        
+        # Thermistor channel entry
+        self.thermvalue = tk.Entry(self,textvariable = self.thermchannel)
+        self.thermvalue.grid(row = 14,column = 5)
+        
+        # Sample temperature
+        self.sampletemperature = tk.Label(self,textvariable = self.sampletemp)
+        self.sampletemperature.grid(row = 15,column = 4,columnspan = 2)
+        
+        # Calibration file label
+        self.cal = tk.Label(self,text = 'Thermistor Calibration')
+        self.cal.grid(row = 16,column = 4)
+        
+        # Calibration file choice
+        self.calvalue = tk.OptionMenu(self,self.calfile,*calibration.available())
+        self.calvalue.grid(row = 16,column = 5)
         
         # Filename Label
        # self.filename = tk.Label(self,text = 'csv filename for scan results')
@@ -344,7 +483,7 @@ class Application(tk.Frame):
         self.browse.grid(row = 14,column = 1)
         
         # Wait time label
-        self.wt = tk.Label(self,text = "Scan Wait Time (s)")
+        self.wt = tk.Label(self,text = "Settle Time After Move (s)")
         self.wt.grid(row = 10,column = 0)
 
         # Wait time entry
@@ -359,6 +498,36 @@ class Application(tk.Frame):
         self.loopvalue = tk.Entry(self,textvariable = self.loopnum)
         self.loopvalue.grid(row = 9,column = 1)
         
+        # Scan queue list
+        self.queuelist = tk.Listbox(self,height = 5)
+        self.queuelist.grid(row = 17,column = 0,rowspan = 3,columnspan = 3,sticky = tk.W+tk.E)
+        
+        # Add to queue button
+        self.addqueue = tk.Button(self,text = 'Add To Queue',command = self.addqueueCallback)
+        self.addqueue.grid(row = 17,column = 4)
+        
+        # Run queue button
+        self.runqueue = tk.Button(self,text = 'Run Queue',command = self.runqueueCallback)
+        self.runqueue.grid(row = 17,column = 5)
+        
+        # Move up button
+        self.queueup = tk.Button(self,text = 'Move Up',command = lambda: self.movejobCallback(-1))
+        self.queueup.grid(row = 18,column = 4)
+        
+        # Move down button
+        self.queuedown = tk.Button(self,text = 'Move Down',command = lambda: self.movejobCallback(1))
+        self.queuedown.grid(row = 18,column = 5)
+        
+        # Cancel job button
+        self.canceljob = tk.Button(self,text = 'Cancel Job',command = self.canceljobCallback)
+        self.canceljob.grid(row = 19,column = 4)
+        
+        # Queue time remaining
+        self.queueeta = tk.Label(self,textvariable = self.queuestatus)
+        self.queueeta.grid(row = 19,column = 5)
+        
+        self.refreshQueue()
+        
         # self.img = tk.PhotoImage(file = "background2.png")
         # self.limg = tk.Label(image = self.img)
         # self.limg.grid(row = 1,column = 3)
@@ -375,6 +544,8 @@ class Application(tk.Frame):
         #                   labjack.getAIN(positiveChannel = 15, resolutionIndex=int(self.drvalue.get()), 
         #                                          gainIndex=0, settlingFactor=int(self.dsvalue.get())))
         #time.sleep(1)
+        if self.busy():
+            return
         self.AINvalue.set(daq.eAnalogIn(1)['voltage'])
         
     def readAINBurstCallback(self):
@@ -385,210 +556,444 @@ class Application(tk.Frame):
         #                   labjack.getAIN(positiveChannel = 15, resolutionIndex=int(self.drvalue.get()), 
         #                                          gainIndex=0, settlingFactor=int(self.dsvalue.get())))
         
+        if self.busy():
+            return
+        
         freq = int(round(float(self.dfvalue.get())))
         quant = int(round(float(self.dqvalue.get())))
         avs = int(round(float(self.davalue.get())))    
-        avcount = 0
         
-        voltages = np.array([])
+        channels, mode, therm = self.channelConfig()
         
-        while avcount < avs:
-            
-            vtemp = np.array(daq.aiBurst(1, [1], freq, quant)['voltages'])
-            vtemp = vtemp[0:quant,0]
-            voltages = np.append(voltages,vtemp)
-            
-            avcount = avcount + 1
+        if self.stream is not None:
+            vmean = acquisition.stream_multi_stats(self.stream, quant*avs, mode, timeout = 10)[0][0]
+        elif len(channels) > 1:
+            vmean = acquisition.multi_stats(daq, freq, quant, avs, channels, mode, bool(self.streamavs.get()))[0][0]
+        else:
+            vmean = acquisition.burst_stats(daq, freq, quant, avs, channels[0], bool(self.streamavs.get()))[0]
         
-        self.AINBurstvalue.set(np.mean(voltages))
+        self.AINBurstvalue.set(vmean)
         
         #return np.mean(voltages[0:quant,0])
         
         # dev.aiBurst(1, [0], 400, 10)
         
+    def channelConfig(self):
+        
+        # signal (and reference) channels, then the thermistor if it is not one of them
+        channels = [int(c) for c in self.channelvalue.get().split(',') if c.strip() != '']
+        mode = None if self.normmode.get() == 'none' else self.normmode.get()
+        therm = None
+        if self.thermchannel.get().strip() != '':
+            therm = int(self.thermchannel.get())
+            if therm not in channels:
+                channels.append(therm)
+            therm = channels.index(therm)
+        
+        return channels, mode, therm
+        
+    def busy(self):
+        
+        # the scan worker owns the stage and the DAQ while it runs
+        return self.worker is not None and self.worker.is_alive()
+        
+    def hardwareButtons(self, state):
+        
+        # buttons that talk to the stage or the DAQ directly
+        for button in (self.readAINBurst,self.readAIN,self.movestage,self.setvel,self.setzero,
+                       self.initstage,self.startscan,self.autotune,self.startstream,self.runqueue):
+            button.configure(state = state)
+        
     def movestageCallback(self):
+        if self.busy():
+            return
         stage.move(float(self.msvalue.get())*(-1))
         
     def initializeCallback(self):
+        if self.busy():
+            return
         stage.initialize()
         
     def setvelocityCallback(self):
+        if self.busy():
+            return
         stage.velocity(float(self.setvelvalue.get()))
         
    # def startposCallback(self):
        # stage.
         
     def zerostageCallback(self):
+        if self.busy():
+            return
         stage.zero()
  
            
-    def scanCallback(self):
-        
-        loops = int(round(float(self.loopvalue.get())))
-              
-        # self.zerostageCallback() # zero before scanning. not needed
-        
-        step = float(self.stepsizevalue.get())
-        start = float(self.startposvalue.get())
-        end = float(self.endposvalue.get())
-        
-        stepnumber = round((end-start)/step) + 1
-        array = float(start) + (step * np.array(range(0,int(stepnumber))))
-        
-        data = np.transpose(array[np.newaxis])
-            
-        freq = int(round(float(self.dfvalue.get())))
-        quant = int(round(float(self.dqvalue.get())))    
-        avs = int(round(float(self.davalue.get())))    
-        avcount = 0
-        
-        self.figdata_x = np.zeros([len(array),loops]) + np.NaN # time
-        self.figdata_y = np.zeros([len(array),loops]) + np.NaN # voltage
-        
-        for l in range(loops):
+    def scanParams(self):
+        
+        params = {'loops': int(round(float(self.loopvalue.get()))),
+                  'freq': int(round(float(self.dfvalue.get()))),
+                  'quant': int(round(float(self.dqvalue.get()))),
+                  'avs': int(round(float(self.davalue.get()))),
+                  'wait': float(self.wtvalue.get()),
+                  'streaming': bool(self.streamavs.get()),
+                  'mode': self.scanmode.get(),
+                  'serpentine': bool(self.serpentine.get())}
+        
+        # segments give a non-uniform grid, otherwise the usual start/end/step
+        if self.segments.get().strip() != '':
+            params['positions'] = scan_planner.parse_segments(self.segments.get())
+        else:
+            params['step'] = float(self.stepsizevalue.get())
+            params['start'] = float(self.startposvalue.get())
+            params['end'] = float(self.endposvalue.get())
+        
+        # DAQ Averages becomes the upper limit
+        if self.targetse.get().strip() != '':
+            params['target_se'] = float(self.targetse.get())
+        
+        # Loops becomes the upper limit
+        if self.stopse.get().strip() != '':
+            params['stop_se'] = float(self.stopse.get())
+        if self.stoploops.get().strip() != '':
+            params['stop_loops'] = int(self.stoploops.get())
+        
+        # the thermistor index is only used here, to show the sample temperature
+        params['channels'], params['normalize'], params['thermindex'] = self.channelConfig()
+        
+        # reference mode demodulates against the second channel
+        if self.lockinmode.get() == 'reference':
+            params['lockin'] = 'reference'
+        elif self.lockinmode.get() == 'chopper':
+            params['lockin'] = float(self.chopperfreq.get())
+        
+        return params
         
-            stage.move(start*(-1))
-            time.sleep(5)
-            
-            
-            # data = np.zeros([stepnumber,quant]) - to save all data
-            data_sd = np.zeros([stepnumber,1])
-            data_mean = np.zeros([stepnumber,1])
-            
-            for x in range(len(array)):
-                
-                stage.move(array[x]*(-1))
-                time.sleep(float(self.wtvalue.get()))
-                
-                voltages = np.array([])
+    def scanCallback(self):
         
-                while avcount < avs:
-            
-                    vtemp = np.array(daq.aiBurst(1, [1], freq, quant)['voltages'])
-                    vtemp = vtemp[0:quant,0]
-                    voltages = np.append(voltages,vtemp)
+        # only one scan at a time
+        if self.worker is not None and self.worker.is_alive():
+            return
+        
+        self.queuejob = None
+        self.startScan(self.scanParams(),int(self.fileendvalue.get()),bool(self.resumescan.get()))
+        
+    def startScan(self, params, scan, resume):
+        
+        self.thermindex = params.get('thermindex')
+        
+        # moves in the positive direction overshoot by this much
+        stage.set_backlash(float(self.backlash.get() or 0))
+        
+        # one trace per loop
+        self.liveplot.reset(params['loops'],len(scan_engine.positions(params)))
+        
+        # every step is written to data_NN_steps as it is measured
+        self.basename = self.flnmvalue.get() + '/data_' + "%02d" % scan
+        try:
+            writer = scan_writer.ScanWriter(self.basename,self.logformat.get(),resume = resume,
+                                            layout = scan_engine.layout(params))
+        except ImportError as error:
+            # HDF5 step logs need pytables
+            self.scanstatus.set('Error: %s' % error)
+            self.finishJob('error',None)
+            return
+        except ValueError as error:
+            # the step log belongs to a scan with other positions, loops or channels
+            self.scanstatus.set('Error')
+            self.finishJob('error',None)
+            messagebox.showerror('Resume scan',str(error))
+            return
+        
+        # raw bursts only exist for step scans
+        archive = None
+        if self.keepraw.get() and params['mode'] == 'step':
+            archive = scan_engine.open_archive(self.basename,params,resume = resume)
+        
+        # the scan runs on a worker thread, results come back through a queue
+        self.worker = scan_engine.ScanWorker(stage, daq, params, writer = writer, resume = resume, stream = self.stream, archive = archive)
+        self.worker.start()
+        self.hardwareButtons(tk.DISABLED)
+        
+        self.scanstatus.set('Running')
+        self.loopstatus.set('')
+        self.after(100, self.pollScan)
+        
+    def pollScan(self):
+        
+        # drain everything the worker has produced since the last poll
+        while True:
+            try:
+                message = self.worker.results.get_nowait()
+            except queue.Empty:
+                break
             
-                    avcount = avcount + 1
+            if message[0] in ('step', 'replay'):
+                l, x, position, vmean = message[1:5]
+                self.liveplot.append(l,position,vmean)
                 
-                avcount = 0
+                # thermistor read in the same burst as the signal
+                if len(message) > 6 and self.thermindex is not None:
+                    temperature = calibration.load(self.calfile.get()).voltage_to_temperature(message[6][self.thermindex])
+                    self.sampletemp.set('Sample T %.1f C' % temperature)
                 
-                # voltages = np.array(daq.aiBurst(1, [1], freq, quant)['voltages'])
-                # voltages = voltages[0:quant,0]
-                # data[x,:] = voltages - to save all data
+            elif message[0] == 'stats':
+                l, median_se, drift, change = message[1:5]
+                self.loopstatus.set('Loops %d: median SE %.3g V, drift %.3g V, change %.2f SE' % (l + 1, median_se, drift, change))
                 
-                data_mean[x] = np.mean(voltages)
-                data_sd[x] = stdev(voltages)
+            elif message[0] == 'converged':
+                self.loopstatus.set(self.loopstatus.get() + ' - converged')
                 
-                self.figdata_x[x,l] = array[x]
-                self.figdata_y[x,l] = data_mean[x]
+            elif message[0] in ('done', 'aborted'):
+                # data = np.concatenate((np.transpose(array[np.newaxis]),data_mean,data_sd),axis = 1) - pre-looping format
+                if scan_engine.save_data(self.basename,message[1]):
+                    self.scannum.set(int(self.scannum.get()) + 1)
                 
-                self.update()
-                
-            stage.move(0)
+                # where the time went, per phase, next to data_NN.txt
+                self.worker.timer.save(self.basename + '_timing.txt')
+                self.scanstatus.set(message[0].capitalize())
+                self.hardwareButtons(tk.NORMAL)
+                self.finishJob(message[0],message[1])
+                return
+            
+            elif message[0] == 'error':
+                self.scanstatus.set('Error')
+                self.hardwareButtons(tk.NORMAL)
+                self.finishJob('error',None)
+                messagebox.showerror('Scan error',str(message[1]))
+                return
             
-            data = np.concatenate((data,data_mean,data_sd),axis = 1)
+        self.after(100, self.pollScan)
         
-        # data = np.concatenate((np.transpose(array[np.newaxis]),data),axis = 1)
-        # np.savetxt(self.flnmvalue.get() + '/data_' + "%02d" % int(self.fileendvalue.get()) + '.txt',data)
+    def addqueueCallback(self):
         
-        # data = np.concatenate((np.transpose(array[np.newaxis]),data_mean,data_sd),axis = 1) - pre-looping format
-        np.savetxt(self.flnmvalue.get() + '/data_' + "%02d" % int(self.fileendvalue.get()) + '.txt',data)
+        self.scanqueue.add(self.scanParams())
+        self.refreshQueue()
         
-        self.scannum.set(int(self.scannum.get()) + 1)
-   
-    def startscanCallback(self):
-                    
-        self.figdata_x = [] # measurement index
-        self.figdata_y = [] # convert to current - goes on figure
-        # errorString = []
-        
-        # labjack.streamConfig(NumChannels=2, ChannelNumbers=[0,15], ChannelOptions=[0,0], 
-                            # SettlingFactor=int(self.dsvalue.get()), ResolutionIndex=int(self.drvalue.get()), 
-                             # ScanFrequency=float(self.dfvalue.get()))
-        
-        # stop stream in case there is one ongoing
-        # if labjack.streamStarted:
-            # labjack.streamStop()
+    def runqueueCallback(self):
+        
+        if self.worker is not None and self.worker.is_alive():
+            return
+        
+        self.nextJob()
+        
+    def nextJob(self):
+        
+        # the queue file may have been edited from the command line
+        self.scanqueue.reload()
+        job = self.scanqueue.next()
+        self.queuejob = job
+        self.refreshQueue()
+        if job is None:
+            return
+        
+        resume = job.get('resume',False)
+        scan = job['scan'] if resume else scan_queue.next_scan_number(self.flnmvalue.get(),int(self.scannum.get()))
+        try:
+            job = self.scanqueue.start(job,scan)
+        except ValueError:
+            # another program started or cancelled it meanwhile
+            self.after(100, self.nextJob)
+            return
+        self.queuejob = job
+        self.scannum.set(scan)
+        self.refreshQueue()
+        
+        self.startScan(job['params'],scan,resume)
+        
+    def finishJob(self, status, data):
+        
+        if self.queuejob is None:
+            return
+        
+        # measured throughput improves the estimates of the jobs still waiting
+        loops = scan_queue.loops_done(data) if status == 'done' and not self.queuejob.get('resume') else None
+        self.scanqueue.finish(self.queuejob,status,loops)
+        self.refreshQueue()
+        
+        # an abort stops the whole queue
+        if status == 'done':
+            self.after(100, self.nextJob)
+        else:
+            self.queuejob = None
+        
+    def selectedJob(self):
+        
+        selection = self.queuelist.curselection()
+        if len(selection) == 0:
+            return None
+        
+        return self.scanqueue.jobs[selection[0]]['id']
+        
+    def movejobCallback(self, offset):
+        
+        jobid = self.selectedJob()
+        if jobid is None or self.scanqueue.job(jobid)['status'] != 'pending':
+            return
+        
+        self.scanqueue.move(jobid,offset)
+        self.refreshQueue()
+        self.queuelist.selection_set([job['id'] for job in self.scanqueue.jobs].index(jobid))
+        
+    def canceljobCallback(self):
+        
+        jobid = self.selectedJob()
+        if jobid is None or self.scanqueue.job(jobid)['status'] != 'pending':
+            return
+        
+        self.scanqueue.cancel(jobid)
+        self.refreshQueue()
+        
+    def refreshQueue(self):
+        
+        self.queuelist.delete(0,tk.END)
+        for job in self.scanqueue.jobs:
+            params = job['params']
+            line = '%d  %s  %d loops x %d steps' % (job['id'],job['status'],params['loops'],len(scan_engine.positions(params)))
+            if 'scan' in job:
+                line += '  data_%02d' % job['scan']
+            if job['status'] == 'pending':
+                line += '  ~%.0f min' % (self.scanqueue.estimate(params)/60)
+            self.queuelist.insert(tk.END,line)
+        
+        self.queuestatus.set('%d queued, ~%.0f min' % (len(self.scanqueue.pending()),self.scanqueue.remaining()/60))
+        
+    def refineCallback(self):
+        
+        # denser grid where the previous scan (averaged over loops) changes quickly
+        path = self.flnmvalue.get() + '/data_' + "%02d" % (int(self.fileendvalue.get()) - 1) + '.txt'
+        try:
+            data = np.loadtxt(path, ndmin = 2)
+        except OSError:
+            messagebox.showerror('Refine grid','No scan at %s' % path)
+            return
+        
+        values = data[:,1::2].mean(axis = 1)
+        self.segments.set(scan_planner.format_segments(scan_planner.refine_grid(data[:,0],values)))
+        
+    def autotuneCallback(self):
+        
+        # the DAQ is busy during a scan or stream, and the target SE is needed
+        if (self.worker is not None and self.worker.is_alive()) or self.stream is not None:
+            return
+        if self.tuner is not None and self.tuner.is_alive():
+            return
+        if self.targetse.get().strip() == '':
+            messagebox.showerror('Auto-tune','Enter a Target SE (V) first')
+            return
+        
+        target = float(self.targetse.get())
+        channels, mode, therm = self.channelConfig()
+        
+        def run():
+            try:
+                self.tuneresults.put(('done',autotune.tune(daq,target,channels,mode)))
+            except Exception as e:
+                self.tuneresults.put(('error',e))
+        
+        self.tuner = threading.Thread(target = run,daemon = True)
+        self.tuner.start()
+        self.scanstatus.set('Auto-tuning')
+        self.after(250,self.pollTune)
+        
+    def pollTune(self):
+        
+        try:
+            message = self.tuneresults.get_nowait()
+        except queue.Empty:
+            self.after(250,self.pollTune)
+            return
+        
+        if message[0] == 'error':
+            self.scanstatus.set('Idle')
+            messagebox.showerror('Auto-tune',str(message[1]))
+            return
+        
+        freq, quant, avs, seconds, se = message[1][0]
+        self.dfvaluedefault.set(freq)
+        self.dqvaluedefault.set(quant)
+        self.davaluedefault.set(avs)
+        self.scanstatus.set('Auto-tune: SE %.3g V in %.2f s per step' % (se,seconds))
+        
+    def pauseCallback(self):
+        
+        if self.worker is None or not self.worker.is_alive():
+            return
+        
+        if self.worker.paused:
+            self.worker.resume()
+            self.scanstatus.set('Running')
+        else:
+            self.worker.pause()
+            self.scanstatus.set('Paused')
             
-        # self.scandata = pd.DataFrame()
+    def abortCallback(self):
+        
+        if self.worker is not None and self.worker.is_alive():
+            self.worker.abort()
+            self.scanstatus.set('Aborting')
    
-        # dataCount = 0
-        # packetCount = 0     
-               
-        # labjack.streamStart()
-        
-        # code here directly from https://github.com/labjack/LabJackPython/blob/master/Examples/streamTest.py
-        # we have 25 samples per packet and 48 packets per data request for a total of 1200 samples per data request
-        # self.starttime = datetime.now()
-        
-        # for r in labjack.streamData():
-            # if r is not None:
-                # Our stop condition
-                # if dataCount >= float(self.dqvalue.get()):
-                    # break
-
-                # if r["errors"] != 0:
-                    # errorString.append("Errors counted: %s ; %s\n" % (r["errors"], datetime.now()))
-
-                # if r["numPackets"] != labjack.packetsPerRequest:
-                    # errorString.append("----- UNDERFLOW : %s ; %s\n" % (r["numPackets"], datetime.now()))
-
-                # if r["missed"] != 0:
-                    # missed += r['missed']
-                    # errorString.append("+++ Missed %s\n" % r["missed"])
-
-                # self.scandata = pd.concat([self.scandata,
-                                        # pd.DataFrame({
-                                        # 'Data Request':dataCount,
-                                        # 'Packets per Request':r['numPackets'],
-                                        # 'AIN Voltage (V)':r['AIN0'],
-                                        # 'GND Voltage (V)':r['AIN15']})])
-                        
-                # dataCount += 1
-                # packetCount += r['numPackets']
-            # else:
-                        # Got no data back from our read.
-                        # This only happens if your stream isn't faster than the USB read
-                        # timeout, ~1 sec.
-                # print("No data ; %s" % datetime.now())
-
-        # self.stoptime = datetime.now()
-        # self.delta = (self.stoptime-self.starttime).seconds + (self.stoptime-self.starttime).microseconds/1000000
-        # self.EstFreqValue.set(600*dataCount/self.delta)        
-        
-        # labjack.streamStop() 
-        
-        # self.figdata_x = list(range(len(self.scandata['Data Request'])))
-        # Emma and I think that the GND is already subtracted out on the AIN0 reading
-        # self.figdata_z = self.scandata['AIN Voltage (V)'] # - self.scandata['GND Voltage (V)']
-        # Keithley 6485 manual: ANALOG OUT provides a scaled, inverting ±2V output
-        # self.figdata_y = (self.figdata_z*(-1) + 2)/4 * float(self.mavalue.get())
-        
-        self.update()
-        
-        # self.scandata['Voltage (V)'] = self.figdata_z                 
-        # self.scandata['Current (A)'] = self.figdata_y
-        # self.scandata.to_csv(self.flnmvalue.get() + '/' + self.fnvalue.get(),index = False)
+    def startscanCallback(self):
+        
+        # toggle the continuous stream; while it runs, scans and bursts read from it
+        if self.stream is not None:
+            self.stream.stop()
+            self.stream = None
+            self.streamstatus.set('Stream stopped')
+            return
+        
+        channels = self.channelConfig()[0]
+        freq = int(round(float(self.dfvalue.get())))
+        
+        # through a device server the stream runs there, so no other program's bursts get in between
+        if server is not None:
+            self.stream = server.open_stream(channels,freq)
+        else:
+            self.stream = StreamAcquisition(daq,channels,freq)
+            self.stream.start()
+        self.after(500,self.pollStream)
+        
+    def pollStream(self):
+        
+        if self.stream is None:
+            return
+        
+        # the stream gives up after repeated read errors
+        if self.stream.failure is not None:
+            self.streamstatus.set('Stream failed: %s' % self.stream.failure)
+            self.stream.stop()
+            self.stream = None
+            return
+        
+        self.EstFreqValue.set(round(self.stream.rate(),1))
+        self.streamstatus.set('Missed %d, underflows %d' % (self.stream.missed,self.stream.underflows))
+        self.after(500,self.pollStream)
 
     
-# Run the GUI
-stage = AppliedMotion('COM12')
-daq = u12.U12()
-
-app = Application()
-app.master.title('DUV Code')
-ani = animation.FuncAnimation(app.figure, app.animate,fargs = ('arg',), interval=1000)
-
-app.configure(bg='lightblue')
-
-
-app.mainloop()
+# Run the GUI (importing this module does not touch the hardware)
+if __name__ == '__main__':
+    
+    # share the hardware through device_server.py if it is running
+    remote = device_server.connect()
+    if remote is not None:
+        daq, stage, server = remote
+    else:
+        stage = AppliedMotion('COM12')
+        daq = u12.U12()
+        server = None
+    
+    app = Application()
+    app.master.title('DUV Code')
+    
+    app.configure(bg='lightblue')
+    
+    
+    app.mainloop()
 
 
 
 
-fit_stitch = np.loadtxt(fitdir + grating + '\\' + tag_stitch + '\\' + fitfiles_stitch[jj],skiprows= 1)
-        fit_stitch[:,0] = np.round(fit_stitch[:,0],0)
-        fit_stitch = pd.DataFrame(fit_stitch)
-        fit_stitch = fit_stitch.rename({0:'time',1:'expAmp',2:'fitAmp'},axis = 1)
-        fit_stitch['grating'] = grating
\ No newline at end of file
+# post-processing: the per-file fit_stitch loading that was here (np.loadtxt of
+# fitdir + grating + '\\' + tag_stitch + ..., renamed to time/expAmp/fitAmp) is
+# scan_loader.load_fits(fitdir); scan_loader.load_scans(directory) gives every
+# data_NN.txt as one long DataFrame (scan, loop, step, delay, mean, sd), cached
+# by file modification time.
@@ -4,9 +4,9 @@ from tkinter import messagebox
 from tkinter import filedialog
 import pandas as pd
 import numpy as np
-from statistics import mean, stdev
 from datetime import datetime
 import os
+import threading
 
 # imports for figure imbed
 import matplotlib
@@ -14,14 +14,22 @@ matplotlib.use("TkAgg")
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 from matplotlib.figure import Figure, Axes
 
-# imports for figure animation
-import matplotlib.animation as animation
+# imports for incremental live plot
+from live_plot import LivePlot
 
 # imports for stage
 import time
 
 # imports for daq card
 import u12
+import device_server
+import acquisition
+import autotune
+import calibration
+import queue
+import timing
+import thermal_fit
+from temperature_log import TemperatureLog, TemperatureLogger
 
 # labjack = u12.U12()
 # labjack.getCalibrationData()     
@@ -45,37 +53,52 @@ class Application(tk.Frame):
         self.davaluedefault = tk.StringVar()
         self.waittime = tk.StringVar()
         self.cwd = tk.StringVar()
+        self.calfile = tk.StringVar()
+        self.throughput = tk.StringVar() # readings/s of the running scan or log
+        self.fitstatus = tk.StringVar() # predicted final temperature and time constant
+        self.stopse = tk.StringVar() # end the scan once the final temperature is known this well (C)
+        self.tunese = tk.StringVar() # SE per reading (C) the auto-tune aims for
+        self.tunestatus = tk.StringVar()
         
         self.cwd.set(os.getcwd())
         self.dfvaluedefault.set(400)
         self.dqvaluedefault.set(400)
         self.davaluedefault.set(1)
         self.waittime.set(1)
+        self.calfile.set('calibration_20240208.csv')
         
-        self.calibration = np.loadtxt('calibration_20240208.csv',skiprows = 1,delimiter = ',')
-        self.calibration_temperature = self.calibration[:,1]
-        self.calibration_resistance = self.calibration[:,0]
+        # open-ended logger thread, None when not logging
+        self.logger = None
+        
+        # a temperature scan runs on this thread, updating the window as it goes
+        self.scanning = False
+        
+        # auto-tune runs on its own thread, its recommendation comes back here
+        self.tuner = None
+        self.tuneresults = queue.Queue()
         
     
         # define figure
-        self.figdata_x = [1,2,3,4,5]
-        self.figdata_y = [1,2,3,4,5]
         self.figure = Figure(figsize=(10,5), dpi=100)
         self.figsubplot = self.figure.add_subplot(111)
-        self.figsubplot.plot(self.figdata_x,self.figdata_y)
-        self.figsubplot.set_xlabel('Time (s)')
-        self.figsubplot.set_ylabel('Temperature (K)')
         
         # run functions below
         self.plotFigure()
         self.createWidgets()
+        
+        # persistent lines, only redrawn when new points arrive
+        self.liveplot = LivePlot(self.canvas,self.figsubplot,'Time (s)','Temperature (K)')
+        self.after(250,self.animate)
 
-    def animate(self,i,j):
+    def animate(self):
 
-        self.figsubplot.clear()
-        self.figsubplot.plot(self.figdata_x,self.figdata_y)
-        self.figsubplot.set_xlabel('Time (s)')
-        self.figsubplot.set_ylabel('Temperature (K)')
+        t0 = time.perf_counter()
+        self.liveplot.draw()
+        
+        # redraw time goes into the logger's timing summary
+        if self.logger is not None and self.logger.is_alive():
+            self.logger.timer.add('ui',time.perf_counter() - t0)
+        self.after(250,self.animate)
 
     
     def plotFigure(self):
@@ -142,88 +165,275 @@ class Application(tk.Frame):
         self.wtvalue = tk.Entry(self,textvariable = self.waittime)
         self.wtvalue.grid(row = 5,column = 1)
         
+        # Calibration file label
+        self.cal = tk.Label(self,text = "Calibration File")
+        self.cal.grid(row = 9,column = 0)
+
+        # Calibration file choice
+        self.calvalue = tk.OptionMenu(self,self.calfile,*calibration.available())
+        self.calvalue.grid(row = 9,column = 1)
+        
+        # Start Logging Button
+        self.startlog = tk.Button(self,text = 'Start Logging',command = self.startlogCallback)
+        self.startlog.grid(row = 10,column = 0)
+        
+        # Stop Logging Button
+        self.stoplog = tk.Button(self,text = 'Stop Logging',command = self.stoplogCallback)
+        self.stoplog.grid(row = 10,column = 1)
+        
+        # Log directory label
+        self.foldername = tk.Label(self,text = "Log Directory")
+        self.foldername.grid(row = 11,column = 0)
+
+        # Log directory entry
+        self.flnmvalue = tk.Entry(self,textvariable = self.cwd)
+        self.flnmvalue.grid(row = 12,column = 0,columnspan = 2,sticky = tk.W+tk.E)
+        
+        # Readings per second
+        self.throughputlabel = tk.Label(self,textvariable = self.throughput)
+        self.throughputlabel.grid(row = 13,column = 0,columnspan = 2)
+        
+        # Early stop label
+        self.stopselabel = tk.Label(self,text = 'Stop at Final T SE (C)')
+        self.stopselabel.grid(row = 14,column = 0)
+        
+        # Early stop entry, blank runs every step
+        self.stopsevalue = tk.Entry(self,textvariable = self.stopse)
+        self.stopsevalue.grid(row = 14,column = 1)
+        
+        # Predicted equilibrium
+        self.fitlabel = tk.Label(self,textvariable = self.fitstatus)
+        self.fitlabel.grid(row = 15,column = 0,columnspan = 2)
+        
+        # Auto-tune target label
+        self.tuneselabel = tk.Label(self,text = 'Target SE per Reading (C)')
+        self.tuneselabel.grid(row = 16,column = 0)
+        
+        # Auto-tune target entry
+        self.tunesevalue = tk.Entry(self,textvariable = self.tunese)
+        self.tunesevalue.grid(row = 16,column = 1)
+        
+        # Auto-tune Button
+        self.autotune = tk.Button(self,text = 'Auto-tune DAQ',command = self.autotuneCallback)
+        self.autotune.grid(row = 17,column = 0)
+        
+        # Auto-tune result
+        self.tunelabel = tk.Label(self,textvariable = self.tunestatus)
+        self.tunelabel.grid(row = 17,column = 1)
+        
     # def readAINCallback(self):
 
     #     voltage = daq.eAnalogIn(1)['voltage']
         # resistance = 5100*5/voltage-5100 # equation for resistance
-    #     resistance = 5100*(5-voltage)/(voltage+5100*(8.181e-6*voltage-11.67e-6)) # equation for resistance w/ correction
-    #     temperature = np.interp(resistance,self.calibration_resistance,self.calibration_temperature) # interpolate to T
+    #     temperature = calibration.load(self.calfile.get()).voltage_to_temperature(voltage) # resistance w/ correction, interpolate to T
     #    self.AINvalue.set(round(temperature,1))
         
+    def busy(self):
+        
+        # only one reader of the U12 at a time: the logger, a scan or the auto-tune
+        return ((self.logger is not None and self.logger.is_alive()) or self.scanning
+                or (self.tuner is not None and self.tuner.is_alive()))
+        
     def readAINBurstCallback(self):
         
+        if self.busy():
+            return
+        
         freq = int(round(float(self.dfvalue.get())))
         quant = int(round(float(self.dqvalue.get())))
         avs = int(round(float(self.davalue.get())))    
-        avcount = 0
-        
-        voltages = np.array([])
         
-        while avcount < avs:
-            
-            vtemp = np.array(daq.aiBurst(1, [1], freq, quant)['voltages'])
-            vtemp = vtemp[0:quant,0]
-            voltages = np.append(voltages,vtemp)
-            
-            avcount = avcount + 1
-        
-        voltage = np.mean(voltages)
-        resistance = 5100*(5-voltage)/(voltage+5100*(8.181e-6*voltage-11.67e-6)) # equation for resistance w/ correction
+        # convert every sample, then average the temperatures; from the shared
+        # stream while gui.py streams through the device server
+        voltages = np.concatenate([device_server.read_channel(daq, server, freq, quant) for a in range(avs)])
         # resistance = 5100*5/np.mean(voltages)-5100 equation for resistance
-        temperature = np.interp(resistance,self.calibration_resistance,self.calibration_temperature,left = None,right = None,period = None) # interpolate to T
+        temperature = np.mean(calibration.load(self.calfile.get()).voltage_to_temperature(voltages))
         
         self.AINBurstvalue.set(round(temperature,1)) 
            
     def scanCallback(self):
-                                      
-
+        
+        if self.busy():
+            return
+        
+        self.scanning = True
+        try:
+            self.temperatureScan()
+        finally:
+            self.scanning = False
+        
+    def temperatureScan(self):
             
         freq = int(round(float(self.dfvalue.get())))
         quant = int(round(float(self.dqvalue.get())))    
         avs = int(round(float(self.davalue.get())))    
         avcount = 0
         
-        data = np.array([])
+        data = np.zeros(avs)
+        cal = calibration.load(self.calfile.get())
+        
+        self.liveplot.reset(1,avs)
         
-        self.figdata_x = np.zeros(avs) + np.NaN # time
-        self.figdata_y = np.zeros(avs) + np.NaN # voltage
+        # time per phase of every reading
+        timer = timing.PhaseTimer(('wait','acquire','convert','fit','ui'),avs)
+        
+        # T(t) = Tinf + A*exp(-t/tau) refitted after every reading
+        fit = thermal_fit.ExponentialFit()
+        target = float(self.stopse.get()) if self.stopse.get().strip() != '' else None
+        self.fitstatus.set('')
         
         while avcount < avs:
             
+            timer.start()
             time.sleep(float(self.wtvalue.get()))
-            vtemp = np.array(daq.aiBurst(1, [1], freq, quant)['voltages'])
-            vtemp = np.mean(vtemp[0:quant,0])
+            timer.lap('wait')
+            vtemp = device_server.read_channel(daq, server, freq, quant)
+            timer.lap('acquire')
             
             # rtemp = 5100*5/vtemp-5100 # equation for resistance
-            rtemp = 5100*(5-vtemp)/(vtemp+5100*(8.181e-6*vtemp-11.67e-6)) # equation for resistance w/ correction
-            ttemp = np.interp(rtemp,self.calibration_resistance,self.calibration_temperature) # interpolate to T
+            ttemp = np.mean(cal.voltage_to_temperature(vtemp)) # every sample converted
+            timer.lap('convert')
+            
+            data[avcount] = ttemp
             
-            data = np.append(data,rtemp)
+            fit.add(time.perf_counter(),ttemp)
+            tinf, tinf_se, tau = fit.solve()
+            timer.lap('fit')
             
-            self.figdata_x[avcount] = avcount*float(self.wtvalue.get())
-            self.figdata_y[avcount] = ttemp
+            self.liveplot.append(0,avcount*float(self.wtvalue.get()),ttemp)
+            self.throughput.set('%.2f readings/s, ETA %s' % (timer.rate(),timing.format_eta(timer.eta())))
+            if np.isfinite(tinf_se):
+                self.fitstatus.set('Final T %.2f +- %.2f C, tau %.0f s (%.0f-%.0f s)' % ((tinf,tinf_se,tau) + fit.tau_range))
             self.update()
+            timer.lap('ui')
+            timer.end_step()
             
             avcount = avcount + 1
+            
+            # the final temperature is known well enough, no need to sit through the rest
+            if target is not None and fit.converged(target):
+                self.fitstatus.set(self.fitstatus.get() + ' - stopped early')
+                data = data[:avcount]
+                break
+        
+        timer.save(os.path.join(self.cwd.get(),'thermoscan_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '_timing.txt'))
 
         self.update()
                 
         avcount = 0
       
         tmean = np.mean(data)
-        tsd = stdev(data)/np.sqrt(len(data))
+        tsd = acquisition.summarize(data)[2]
         self.AINBurstvalue.set(round(tmean,1)) 
         self.AINSDvalue.set(round(tsd,4)) 
         # np.savetxt(self.flnmvalue.get() + '/data_' + "%02d" % int(self.fileendvalue.get()) + '.txt',data)
      
-# Run the GUI
-daq = u12.U12()
-
-app = Application()
-app.master.title('VO2 Heating Code')
-ani = animation.FuncAnimation(app.figure, app.animate,fargs = ('arg',), interval=1000)
-
-app.configure(bg='lightgreen')
-
-
-app.mainloop()
+    def autotuneCallback(self):
+        
+        # the DAQ is busy while logging, scanning or tuning
+        if self.busy():
+            return
+        if self.tunese.get().strip() == '':
+            messagebox.showerror('Auto-tune','Enter a Target SE per Reading (C) first')
+            return
+        
+        target = float(self.tunese.get())
+        cal = calibration.load(self.calfile.get())
+        
+        # one burst per reading, so the target has to be reached without averaging
+        def run():
+            try:
+                self.tuneresults.put(('done',autotune.tune(daq,target,convert = cal.voltage_to_temperature,max_avs = 1)))
+            except Exception as e:
+                self.tuneresults.put(('error',e))
+        
+        self.tuner = threading.Thread(target = run,daemon = True)
+        self.tuner.start()
+        self.tunestatus.set('Auto-tuning')
+        self.after(250,self.pollTune)
+        
+    def pollTune(self):
+        
+        try:
+            message = self.tuneresults.get_nowait()
+        except queue.Empty:
+            self.after(250,self.pollTune)
+            return
+        
+        if message[0] == 'error':
+            self.tunestatus.set('')
+            messagebox.showerror('Auto-tune',str(message[1]))
+            return
+        
+        freq, quant, avs, seconds, se = message[1][0]
+        self.dfvaluedefault.set(freq)
+        self.dqvaluedefault.set(quant)
+        self.tunestatus.set('SE %.3g C in %.2f s per reading' % (se,seconds))
+        
+    def startlogCallback(self):
+        
+        if self.busy():
+            return
+        
+        freq = int(round(float(self.dfvalue.get())))
+        quant = int(round(float(self.dqvalue.get())))
+        
+        # runs until stopped; memory stays bounded, samples go to disk as they come
+        path = os.path.join(self.cwd.get(),'templog_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.txt')
+        log = TemperatureLog(path)
+        self.logger = TemperatureLogger(daq,calibration.load(self.calfile.get()),log,freq,quant,float(self.wtvalue.get()),server = server)
+        
+        self.logstart = None
+        self.liveplot.reset(1,capacity = log.segment*(log.old.maxlen + 1))
+        self.logger.start()
+        self.after(100,self.pollLog)
+        
+    def stoplogCallback(self):
+        
+        if self.logger is not None:
+            self.logger.stop()
+            
+    def pollLog(self):
+        
+        while True:
+            try:
+                message = self.logger.results.get_nowait()
+            except queue.Empty:
+                break
+            
+            if message[0] == 'sample':
+                t, temperature, tmean, tse = message[1:]
+                if self.logstart is None:
+                    self.logstart = t
+                self.liveplot.append(0,t - self.logstart,temperature)
+                self.throughput.set('%.2f readings/s' % self.logger.timer.rate())
+                self.AINBurstvalue.set(round(tmean,1))
+                self.AINSDvalue.set(round(tse,4))
+                
+            elif message[0] == 'error':
+                messagebox.showerror('Logging error',str(message[1]))
+                return
+            
+            else:
+                return
+                
+        self.after(100,self.pollLog)
+     
+# Run the GUI (importing this module does not touch the hardware)
+if __name__ == '__main__':
+    
+    # share the U12 with a running scan through device_server.py if it is up;
+    # while gui.py streams there, readings come from the shared stream
+    remote = device_server.connect()
+    if remote is not None:
+        daq, server = remote[0], remote[2]
+    else:
+        daq, server = u12.U12(), None
+    
+    app = Application()
+    app.master.title('VO2 Heating Code')
+    
+    app.configure(bg='lightgreen')
+    
+    
+    app.mainloop()
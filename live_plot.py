@@ -0,0 +1,151 @@
+# incremental live plot - persistent lines, blitting, redraw only when there is new data
+import numpy as np
+import matplotlib
+
+
+class LivePlot:
+    """Live traces on a matplotlib axes embedded in a Tk canvas.
+
+    Each trace keeps its points in a preallocated array and one persistent
+    Line2D. New points are drawn as short segments on top of the last frame
+    and blitted, so the cost per new point does not depend on how many are
+    already on screen. The full (decimated to max_points) traces are only
+    redrawn when the axes have to rescale or the canvas is redrawn anyway,
+    e.g. by the toolbar."""
+
+    def __init__(self, canvas, axes, xlabel, ylabel, max_points=2000):
+        self.canvas = canvas
+        self.axes = axes
+        self.xlabel = xlabel
+        self.ylabel = ylabel
+        self.max_points = max_points
+
+        self.colors = matplotlib.rcParams['axes.prop_cycle'].by_key()['color']
+        self.shown = False # set once the canvas has been fully drawn
+        self.needs_full = True
+        self.reset(0)
+
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def reset(self, ntraces, npoints=256, capacity=None):
+        """Clear the axes and start ntraces empty traces. With a capacity,
+        the oldest half of a trace is dropped when it fills up, so
+        open-ended traces stay bounded in memory."""
+
+        self.axes.clear()
+        self.axes.set_xlabel(self.xlabel)
+        self.axes.set_ylabel(self.ylabel)
+
+        self.x = [np.zeros(npoints) for i in range(ntraces)]
+        self.y = [np.zeros(npoints) for i in range(ntraces)]
+        self.count = [0]*ntraces
+        self.capacity = capacity
+        self.drawn = [0]*ntraces # points already on screen
+
+        self.lines = [self._line(i) for i in range(ntraces)]
+        self.segment = self.axes.plot([], [], animated=True)[0]
+
+        self.limits = None # data range
+        self.view = None # axes range, with headroom so most points land inside
+        self.needs_full = True
+        self.dirty = True
+
+    def add_trace(self):
+        """Start one more trace (e.g. for open-ended loops) and return its index."""
+
+        self.x.append(np.zeros(256))
+        self.y.append(np.zeros(256))
+        self.count.append(0)
+        self.drawn.append(0)
+        self.lines.append(self._line(len(self.lines)))
+
+        return len(self.lines) - 1
+
+    def _line(self, trace):
+
+        return self.axes.plot([], [], animated=True, color=self.colors[trace % len(self.colors)])[0]
+
+    def append(self, trace, x, y):
+        """Add one point to a trace; drawn on the next draw()."""
+
+        n = self.count[trace]
+        if self.capacity is not None and n >= self.capacity:
+            keep = self.capacity//2
+            self.x[trace][:keep] = self.x[trace][n - keep:n]
+            self.y[trace][:keep] = self.y[trace][n - keep:n]
+            n = keep
+            self.limits = None # rescale to what is left
+            self.view = None
+        elif n == len(self.x[trace]):
+            # double the storage so appends stay amortized constant time
+            self.x[trace] = np.concatenate((self.x[trace], np.zeros(n)))
+            self.y[trace] = np.concatenate((self.y[trace], np.zeros(n)))
+
+        self.x[trace][n] = x
+        self.y[trace][n] = y
+        self.count[trace] = n + 1
+        self.dirty = True
+
+        if np.isfinite(x) and np.isfinite(y):
+            if self.limits is None:
+                self.limits = [x, x, y, y]
+            else:
+                self.limits = [min(x, self.limits[0]), max(x, self.limits[1]),
+                               min(y, self.limits[2]), max(y, self.limits[3])]
+            if self.view is None or not (self.view[0] <= x <= self.view[1] and self.view[2] <= y <= self.view[3]):
+                self.needs_full = True
+
+    def data(self, trace):
+        """Points of a trace so far (views, not copies)."""
+
+        return self.x[trace][:self.count[trace]], self.y[trace][:self.count[trace]]
+
+    def draw(self):
+        """Bring the screen up to date; does nothing if no point was added."""
+
+        if not self.dirty:
+            return
+        self.dirty = False
+
+        if self.needs_full or not self.shown:
+            self._rescale()
+            # _on_draw draws the traces into the new frame; no background is
+            # cached, later segments are drawn on top of this frame as it is
+            self.canvas.draw()
+            return
+
+        for trace in range(len(self.lines)):
+            if self.count[trace] > self.drawn[trace]:
+                start = max(self.drawn[trace] - 1, 0) # join up with the last drawn point
+                self.segment.set_data(self.x[trace][start:self.count[trace]], self.y[trace][start:self.count[trace]])
+                self.segment.set_color(self.lines[trace].get_color())
+                self.axes.draw_artist(self.segment)
+                self.drawn[trace] = self.count[trace]
+
+        self.canvas.blit(self.axes.bbox)
+
+    def _rescale(self):
+
+        self.needs_full = False
+        if self.limits is None:
+            return
+
+        xmin, xmax, ymin, ymax = self.limits
+        xpad = (xmax - xmin)*0.25 or 1
+        ypad = (ymax - ymin)*0.25 or abs(ymax)*0.1 or 1
+        self.view = [xmin - xpad, xmax + xpad, ymin - ypad, ymax + ypad]
+        self.axes.set_xlim(self.view[0], self.view[1])
+        self.axes.set_ylim(self.view[2], self.view[3])
+
+    def _on_draw(self, event):
+        """After any full canvas draw, draw the traces into the frame the
+        canvas is about to show."""
+
+        self.shown = True
+
+        for trace, line in enumerate(self.lines):
+            x, y = self.data(trace)
+            stride = max(len(x)//self.max_points, 1) # decimate long traces
+            line.set_data(x[::stride], y[::stride])
+            self.axes.draw_artist(line)
+            self.drawn[trace] = self.count[trace]
@@ -0,0 +1,72 @@
+# software lock-in demodulation of chopped pump-probe bursts
+import numpy as np
+
+
+def reference_phasor(reference):
+    """Unit phasor exp(i*phase) following a chopper reference, one row per burst.
+
+    Only the band around the strongest line of the reference is kept, so a
+    square-wave chopper signal gives a clean phase for its fundamental."""
+
+    reference = np.atleast_2d(reference)
+    n = reference.shape[-1]
+
+    spectrum = np.fft.fft(reference - reference.mean(axis=-1, keepdims=True), axis=-1)
+    positive = np.abs(spectrum[:, 1:(n + 1)//2]).mean(axis=0)
+    peak = np.argmax(positive) + 1
+
+    # analytic signal of the fundamental only
+    mask = np.zeros(n)
+    mask[max(peak - 3, 1):peak + 4] = 2
+    analytic = np.fft.ifft(spectrum*mask, axis=-1)
+
+    magnitude = np.abs(analytic)
+    magnitude[magnitude == 0] = 1
+
+    return analytic/magnitude
+
+
+def demodulate(signal, freq, chopper=None, reference=None):
+    """Complex amplitude (X + iY) of every burst of an (averages, samples)
+    buffer at the chopper frequency.
+
+    The phase comes either from a reference channel buffer of the same shape
+    or, with only a known chopper frequency (Hz), from the start of each
+    burst. A Hann window is the low-pass filter, which keeps leakage small
+    when a burst does not hold a whole number of chopper periods."""
+
+    signal = np.atleast_2d(signal)
+    n = signal.shape[-1]
+
+    if reference is not None:
+        phasor = reference_phasor(reference)
+    elif chopper is not None:
+        phasor = np.exp(2j*np.pi*chopper*np.arange(n)/freq)
+    else:
+        raise ValueError('need a chopper frequency or a reference channel')
+
+    window = np.hanning(n)
+    mixed = (signal - signal.mean(axis=-1, keepdims=True))*np.conj(phasor)
+
+    return 2*(mixed @ window)/window.sum()
+
+
+def lockin_stats(z, referenced=True):
+    """Amplitude, phase and their spread from the per-burst amplitudes z.
+
+    Returns (x, y, r, theta, r_sd, r_se). With a reference the bursts are
+    averaged as vectors. Without one the phase of each burst is arbitrary,
+    so only the magnitudes are averaged, and x, y and theta are NaN."""
+
+    z = np.atleast_1d(z)
+    n = len(z)
+
+    if referenced:
+        zmean = z.mean()
+        spread = np.sqrt((np.var(z.real, ddof=1) + np.var(z.imag, ddof=1))/2) if n > 1 else np.nan
+        return zmean.real, zmean.imag, np.abs(zmean), np.angle(zmean), spread, spread/np.sqrt(n)
+
+    r = np.abs(z)
+    spread = np.std(r, ddof=1) if n > 1 else np.nan
+
+    return np.nan, np.nan, r.mean(), np.nan, spread, spread/np.sqrt(n)
@@ -0,0 +1,74 @@
+# raw burst archive on a memory-mapped .npy file, next to data_NN.txt
+import os
+
+import numpy as np
+
+import acquisition
+
+
+class RawArchive:
+    """Every raw sample of a step scan in basename_raw.npy, shaped
+    (loops, steps, averages, samples, channels).
+
+    The file is preallocated with np.lib.format.open_memmap and bursts are
+    written straight into it through slot(), so the OS pages it out and RAM
+    use does not grow with the scan. Samples are float32, which keeps the
+    12-bit U12 readings exactly and halves the file. Bursts a step did not
+    take (e.g. with a target SE) are NaN; steps never measured stay zero, the
+    step log says which ones were."""
+
+    def __init__(self, basename, loops, steps, avs, quant, channels=1, resume=False):
+        self.path = basename + '_raw.npy'
+        shape = (loops, steps, avs, quant, channels)
+
+        if resume and os.path.exists(self.path):
+            self.data = np.load(self.path, mmap_mode='r+')
+            if self.data.shape != shape:
+                raise ValueError('%s holds %s, the scan needs %s' % (self.path, self.data.shape, shape))
+        else:
+            self.data = np.lib.format.open_memmap(self.path, mode='w+', dtype=np.float32, shape=shape)
+
+    def slot(self, loop, step):
+        """Writable (averages, samples, channels) view of one step, to pass
+        as out= to acquisition.burst_channels (or [..., 0] to burst)."""
+
+        return self.data[loop, step]
+
+    def flush(self):
+        self.data.flush()
+
+    def close(self):
+        self.data.flush()
+        del self.data
+
+
+def load(path):
+    """Reopen an archive read-only without reading it into memory."""
+
+    return np.load(path, mmap_mode='r')
+
+
+def restats(raw, mode=None, reject=None):
+    """Step mean and SD recomputed from an archive, one loop in memory at a
+    time. mode normalizes by the second channel as in the scan; with reject
+    (e.g. 3) bursts whose mean is more than reject SDs from the median burst
+    mean of their step are dropped. Returns two (loops, steps) arrays."""
+
+    loops, steps = raw.shape[0:2]
+    means = np.full([loops, steps], np.nan)
+    sds = np.full([loops, steps], np.nan)
+
+    for l in range(loops):
+        values = acquisition.normalize(np.asarray(raw[l], dtype=float), mode) # (steps, avs, quant)
+
+        if reject is not None:
+            bursts = np.nanmean(values, axis=2)
+            centre = np.nanmedian(bursts, axis=1, keepdims=True)
+            spread = np.nanstd(bursts, axis=1, keepdims=True)
+            outlier = np.abs(bursts - centre) > reject*spread
+            values = np.where(outlier[..., np.newaxis], np.nan, values)
+
+        means[l] = np.nanmean(values, axis=(1, 2))
+        sds[l] = np.nanstd(values, axis=(1, 2), ddof=1)
+
+    return means, sds
@@ -0,0 +1,647 @@
+# scan engine - runs the delay scan on a worker thread so the Tk main loop stays free
+import os
+import sys
+import threading
+import queue
+import time
+
+import numpy as np
+
+import acquisition
+import device_server
+import lockin
+import raw_archive
+import scan_planner
+import scan_writer
+import timing
+from appliedmotion import move_profile
+from stream import MAX_RATE as MAX_STREAM_RATE
+
+
+# phases of every step timed by ScanWorker.timer; redraws add 'ui'
+PHASES = ('move', 'settle', 'acquire', 'write')
+
+
+class ScanAborted(Exception):
+    """Raised inside the worker when the scan is aborted."""
+
+
+class ScanWorker(threading.Thread):
+    """Runs a multi-loop delay scan on a background thread.
+
+    Results are posted to self.results as tuples:
+        ('step', loop, index, position, mean, sd[, channel_means])
+        ('replay', loop, index, position, mean, sd) - resumed from the step log
+        ('loop', loop, data_mean, data_sd)
+        ('stats', loop, median_se, drift, change, mean, se) - across loops so far
+        ('converged', loop) - stopping early, followed by 'done'
+        ('done', data) / ('aborted', data) / ('error', exception)
+    where data has the same column layout as the data_NN.txt files.
+
+    Optionally steps are written to writer as they are measured (resume=True
+    skips the ones already in its log), read from a running StreamAcquisition
+    instead of bursts, and their raw bursts kept in archive (a RawArchive)."""
+
+    def __init__(self, stage, daq, params, results=None, writer=None, resume=False, stream=None, archive=None):
+        super(ScanWorker, self).__init__(daemon=True)
+
+        self.stage = stage
+        self.daq = daq
+        self.params = params
+        self.writer = writer
+        self.stream = stream
+        self.archive = archive
+        self.loopstats = acquisition.LoopStats()
+        self.completed = writer.completed() if (writer is not None and resume) else {}
+        self.results = results if results is not None else queue.Queue()
+        # move, settle, acquire and write time of every step, for points/s, ETA and basename_timing.txt
+        self.timer = timing.PhaseTimer(PHASES, params['loops']*len(positions(params)) - len(self.completed))
+
+        self._running = threading.Event() # cleared while paused
+        self._running.set()
+        self._abort = threading.Event()
+
+    def pause(self):
+        """Pause after the current step."""
+
+        self._running.clear()
+
+    def resume(self):
+        """Resume a paused scan."""
+
+        self._running.set()
+
+    def abort(self):
+        """Stop the scan after the current step."""
+
+        self._abort.set()
+        self._running.set() # wake up if paused
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def checkpoint(self):
+        """Block while paused and raise ScanAborted if abort was requested."""
+
+        self._running.wait()
+        if self._abort.is_set():
+            raise ScanAborted()
+
+    def sleep(self, seconds):
+        """time.sleep that returns early on abort."""
+
+        if self._abort.wait(seconds):
+            raise ScanAborted()
+
+    def run(self):
+
+        data = None
+        leased = False
+
+        try:
+            # no other program may move a shared stage during the scan
+            device_server.lease(self.stage)
+            leased = True
+
+            engine = fly_scan if self.params.get('mode') == 'fly' else scan
+
+            for message in engine(self.stage, self.daq, self.params, self, self.completed):
+                if message[0] == 'step':
+                    if self.writer is not None:
+                        self.writer.write(*message[1:])
+                    self.timer.lap('write')
+                    self.timer.end_step()
+                if message[0] != 'loop':
+                    self.results.put(message)
+                    continue
+
+                data = message[4]
+                self.results.put(message[:4])
+
+                # running average over the loops so far; stop once the median SE is below
+                # stop_se or stop_loops loops in a row moved it by less than stop_tolerance SEs
+                stats = self.loopstats
+                stats.add(message[2], self.params.get('stop_tolerance', 0.25))
+                self.results.put(('stats', message[1], stats.median_se, stats.drift, stats.change, stats.mean, stats.se))
+
+                if stats.converged(self.params.get('stop_se'), self.params.get('stop_loops')):
+                    self.results.put(('converged', message[1]))
+                    break
+
+            # serpentine scans end wherever the last loop did
+            self.stage.move(0)
+            self.stage.wait_until_stopped()
+        except ScanAborted:
+            self.stage.move(0)
+            final = ('aborted', data)
+        except Exception as e:
+            final = ('error', e)
+        else:
+            final = ('done', data)
+        finally:
+            if self.writer is not None:
+                self.writer.close()
+            if self.archive is not None:
+                self.archive.close()
+            if leased:
+                device_server.release(self.stage)
+
+        # only once the files and the stage are let go, so the caller may close them
+        self.results.put(final)
+
+
+def positions(params):
+    """Delay positions (ps) for a scan: params['positions'] if the scan was
+    planned on a non-uniform grid (see scan_planner), otherwise the same
+    uniform grid as the original scanCallback."""
+
+    if params.get('positions') is not None:
+        return np.asarray(params['positions'], dtype=float)
+
+    stepnumber = round((params['end'] - params['start'])/params['step']) + 1
+
+    return float(params['start']) + (params['step'] * np.array(range(0, int(stepnumber))))
+
+
+def scan(stage, daq, params, worker, completed={}):
+    """Generator running the scan; yields step and loop messages.
+
+    Loop messages carry the accumulated data array as a fifth element.
+    Steps found in completed ((loop, step) -> (mean, sd)) are not measured
+    again, only replayed. With params['serpentine'] every other loop runs
+    backwards and no loop returns to zero first; the stage's backlash
+    setting keeps both directions on the same positions."""
+
+    array = positions(params)
+    stepnumber = len(array)
+
+    data = np.transpose(array[np.newaxis])
+
+    timer = worker.timer
+    serpentine = params.get('serpentine', False)
+
+    for l in range(params['loops']):
+
+        data_sd = np.zeros([stepnumber, 1])
+        data_mean = np.zeros([stepnumber, 1])
+
+        # replay steps that an interrupted run already measured
+        todo = []
+        for x in range(stepnumber):
+            if (l, x) in completed:
+                data_mean[x], data_sd[x] = completed[(l, x)]
+                yield ('replay', l, x, array[x], data_mean[x, 0], data_sd[x, 0])
+            else:
+                todo.append(x)
+
+        # serpentine: odd loops run backwards from where the last one ended
+        if serpentine and l % 2 == 1:
+            todo.reverse()
+
+        if len(todo) > 0:
+            stage.move(array[todo[0]]*(-1))
+            stage.wait_until_stopped()
+
+        for x in todo:
+
+            worker.checkpoint()
+            timer.start()
+
+            stage.move(array[x]*(-1))
+            stage.wait_until_stopped()
+            timer.lap('move')
+            worker.sleep(params['wait']) # extra settle time
+            timer.lap('settle')
+
+            # raw bursts go straight into the archive file
+            raw = worker.archive.slot(l, x) if worker.archive is not None else None
+
+            vmean, sd, aux = measure_step(daq, worker.stream, params, raw)
+            data_mean[x], data_sd[x] = vmean, sd
+            timer.lap('acquire')
+
+            if aux is not None:
+                yield ('step', l, x, array[x], vmean, sd, aux)
+            else:
+                yield ('step', l, x, array[x], vmean, sd)
+
+        if len(todo) > 0 and not serpentine:
+            stage.move(0)
+            stage.wait_until_stopped()
+
+        data = np.concatenate((data, data_mean, data_sd), axis=1)
+
+        yield ('loop', l, data_mean, data_sd, data)
+
+
+def measure_step(daq, stream, params, raw=None):
+    """Mean, sd and channel means (None with one channel) of one step, from
+    the stream if there is one. Raw samples are kept in raw if given.
+
+    params['channels'] lists the DAQ channels, signal first; 'normalize'
+    ('ratio' or 'difference') divides or subtracts the second channel per
+    sample. params['lockin'] ('reference' for the chopper phase on the second
+    channel, or a chopper frequency in Hz) makes the mean the demodulated
+    amplitude. With params['target_se'] averaging stops once the step's SE is
+    below it, so avs is the upper limit."""
+
+    freq = params['freq']
+    quant = params['quant']
+    avs = params['avs']
+    streaming = params.get('streaming', False)
+    channels = params.get('channels', [1])
+    mode = params.get('normalize')
+    lock = params.get('lockin')
+
+    if lock is not None:
+        stats, aux = lockin_step(daq, stream, freq, quant, avs, channels, lock, out=raw)
+
+    # keep averaging only until the step is good enough
+    elif params.get('target_se') is not None:
+        stats, aux, n = averaged_step(daq, stream, freq, quant, avs, channels, mode, params['target_se'], out=raw)
+
+    # all channels in one hardware-timed pass
+    elif len(channels) > 1:
+        if stream is not None:
+            stats, aux = acquisition.stream_multi_stats(stream, quant*avs, mode, timeout=10, out=raw)
+        else:
+            stats, aux = acquisition.multi_stats(daq, freq, quant, avs, channels, mode, streaming, out=raw)
+
+    else:
+        if raw is not None:
+            raw = raw[..., 0]
+        if stream is not None:
+            stats = acquisition.stream_stats(stream, quant*avs, timeout=10, out=raw)
+        else:
+            stats = acquisition.burst_stats(daq, freq, quant, avs, channels[0], streaming, out=raw)
+
+    return stats[0], stats[1], aux if len(channels) > 1 else None
+
+
+def averaged_step(daq, stream, freq, quant, avs, channels, mode, target, out=None):
+    """Step statistics from bursts of quant samples, stopping once the
+    standard error of the burst means is below target; avs is the upper
+    limit. Bursts go into
+    out (avs, quant, channels) if given, the ones not taken are set to NaN.
+    Returns ((mean, sd, se), channel means or None, bursts taken)."""
+
+    if out is None:
+        out = np.empty([1, quant, len(channels)])
+        row = lambda i: out[0]
+    else:
+        row = lambda i: out[i]
+
+    def read(i):
+        if stream is not None:
+            voltages = row(i)
+            voltages[...] = stream.next(quant, timeout=10)
+        else:
+            voltages = acquisition.burst_channels(daq, freq, quant, 1, channels, out=row(i)[np.newaxis])[0]
+        if len(channels) > 1:
+            return acquisition.normalize(voltages, mode), voltages.mean(axis=0)
+        return voltages[:, 0]
+
+    # the SE of the burst means needs a few bursts, unless fewer are allowed
+    stats, aux, n = acquisition.average_until(read, target, avs, min(4, avs))
+    if len(out) == avs:
+        out[n:] = np.nan
+
+    return stats, aux, n
+
+
+def lockin_step(daq, stream, freq, quant, avs, channels, lock, out=None):
+    """Demodulated amplitude and its spread for one step, from the raw
+    (avs, quant, channels) buffer (out if given); also returns the channel
+    means."""
+
+    if stream is not None:
+        freq = stream.freq
+        voltages = stream.next(avs*quant, timeout=10).reshape(avs, quant, len(channels))
+        if out is not None:
+            out[...] = voltages
+    else:
+        voltages = acquisition.burst_channels(daq, freq, quant, avs, channels, out=out)
+
+    if lock == 'reference':
+        z = lockin.demodulate(voltages[..., 0], freq, reference=voltages[..., 1])
+        x, y, r, theta, sd, se = lockin.lockin_stats(z)
+    else:
+        z = lockin.demodulate(voltages[..., 0], freq, chopper=float(lock))
+        x, y, r, theta, sd, se = lockin.lockin_stats(z, referenced=False)
+
+    return (r, sd), voltages.reshape(-1, len(channels)).mean(axis=0)
+
+
+def fly_scan(stage, daq, params, worker, completed={}):
+    """Generator for a continuous scan; same messages as scan().
+
+    Each loop the stage jogs through the whole range at constant velocity
+    while the U12 streams. Sample times come from the stream rate, the stage
+    position at each sample from the trapezoidal move profile, and samples
+    are binned onto the requested ps grid. The velocity gives every bin the
+    quant*avs samples a step scan would take."""
+
+    array = positions(params)
+    stepnumber = len(array)
+
+    data = np.transpose(array[np.newaxis])
+
+    freq = worker.stream.freq if worker.stream is not None else params['freq']
+    nsamples = params['quant']*params['avs']
+    # on a non-uniform grid the finest spacing sets the velocity
+    step = np.min(np.diff(array)) if params.get('positions') is not None else params['step']
+    channels = params.get('channels', [1])
+    mode = params.get('normalize')
+
+    if params.get('lockin') is not None:
+        raise ValueError('lock-in detection needs a step scan')
+    if params.get('target_se') is not None:
+        raise ValueError('averaging to a target error needs a step scan')
+    if worker.archive is not None:
+        raise ValueError('the raw archive needs a step scan')
+
+    read = acquisition.hardware_channels(channels) # 1, 2 or 4 on the U12
+    if freq*len(read) > MAX_STREAM_RATE:
+        raise ValueError('the U12 streams at most %d samples/s, not %d Hz on %d channels'
+                         % (MAX_STREAM_RATE, freq, len(read)))
+
+    # ps/s so that one grid step takes nsamples samples, then drive units
+    exact = step*freq/nsamples/stage.ps_per_rev
+    vel = round(exact, 4)
+    if not stage.min_velocity <= vel <= stage.max_velocity:
+        raise ValueError('%g ps per %d samples at %d Hz needs %.3g rev/s, the drive runs at %g to %g; '
+                         'change the step or the samples per step' % (step, nsamples, freq, exact,
+                                                                      stage.min_velocity, stage.max_velocity))
+    ramp = (vel**2/(2*stage.ac) + vel*0.1)*stage.ps_per_rev # accelerate plus 0.1 s margin
+    first = array[0] - step/2 - ramp
+    last = array[-1] + step/2 + ramp
+
+    # bin edges halfway between grid points
+    edges = np.concatenate(([array[0] - step/2], (array[1:] + array[:-1])/2, [array[-1] + step/2]))
+
+    oldvel = stage.ve
+    timer = worker.timer
+    serpentine = params.get('serpentine', False)
+
+    for l in range(params['loops']):
+
+        if all((l, x) in completed for x in range(stepnumber)):
+            data_mean = np.array([[completed[(l, x)][0]] for x in range(stepnumber)])
+            data_sd = np.array([[completed[(l, x)][1]] for x in range(stepnumber)])
+            for x in range(stepnumber):
+                yield ('replay', l, x, array[x], data_mean[x, 0], data_sd[x, 0])
+            data = np.concatenate((data, data_mean, data_sd), axis=1)
+            yield ('loop', l, data_mean, data_sd, data)
+            continue
+
+        worker.checkpoint()
+        timer.start()
+
+        # serpentine: odd loops sweep back from where the last one ended
+        reverse = serpentine and l % 2 == 1
+        begin, end = (last, first) if reverse else (first, last)
+
+        stage.velocity(oldvel)
+        stage.move(begin*(-1))
+        stage.wait_until_stopped()
+        timer.lap('move')
+        worker.sleep(params['wait'])
+        timer.lap('settle')
+
+        # a reversing stage first takes up the backlash, the motor travels that much further
+        slack = stage.backlash if (1 if reverse else -1) != stage.direction else 0
+        distance = (last - first + slack)/stage.ps_per_rev
+
+        duration = move_profile(0, distance, vel, stage.ac, stage.de)[1]
+
+        if worker.stream is not None:
+            # sample index at the move command from the running stream
+            stream = worker.stream
+            try:
+                stage.velocity(vel)
+                lost = (stream.missed, stream.underflows)
+                first_sample = stream.index_at(time.perf_counter())
+                stage.move(end*(-1))
+                nsamples_move = int((duration + 0.2)*freq)
+                stream.wait_for(first_sample + nsamples_move, timeout=duration + 10)
+            finally:
+                stage.velocity(oldvel)
+            # a gap in the samples would put the rest of the sweep at the wrong delays
+            if (stream.missed, stream.underflows) != lost:
+                raise RuntimeError('the stream lost samples during the sweep (%d missed, %d underflows)'
+                                   % (stream.missed - lost[0], stream.underflows - lost[1]))
+            raw = stream.read(first_sample, nsamples_move)
+            t = np.arange(len(raw))/freq
+        else:
+            daq.aiStreamStart(len(read), read, freq)
+            try:
+                stage.velocity(vel)
+                tstream = time.perf_counter()
+                stage.move(end*(-1))
+                tmove = time.perf_counter() - tstream
+
+                chunks = []
+                count = 0
+                while count < (tmove + duration + 0.2)*freq:
+                    chunk = np.asarray(daq.aiStreamRead(max(int(freq/10), 1))['voltages'])[:, 0:len(channels)]
+                    chunks.append(chunk)
+                    count += len(chunk)
+            finally:
+                daq.aiStreamClear()
+                stage.velocity(oldvel)
+
+            raw = np.concatenate(chunks)
+            t = np.arange(len(raw))/freq - tmove
+
+        voltages = acquisition.normalize(raw, mode)
+        travelled = np.clip(move_profile(t, distance, vel, stage.ac, stage.de)[0]*stage.ps_per_rev - slack, 0, None)
+        pos = last - travelled if reverse else first + travelled
+
+        # vectorized binning; samples in the ramps fall outside the edges
+        index = np.digitize(pos, edges) - 1
+        inside = (index >= 0) & (index < stepnumber)
+        counts = np.bincount(index[inside], minlength=stepnumber).astype(float)
+        sums = np.bincount(index[inside], voltages[inside], minlength=stepnumber)
+        squares = np.bincount(index[inside], voltages[inside]**2, minlength=stepnumber)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums/counts
+            sds = np.sqrt(np.clip(squares - counts*means**2, 0, None)/(counts - 1))
+
+        data_mean = means[:, np.newaxis]
+        data_sd = sds[:, np.newaxis]
+
+        if len(channels) > 1:
+            aux = np.array([np.bincount(index[inside], raw[inside, k], minlength=stepnumber) for k in range(len(channels))])
+            with np.errstate(invalid='ignore', divide='ignore'):
+                aux = (aux/counts).T
+
+        # the whole sweep is charged to the first step of the loop
+        timer.lap('acquire')
+
+        for x in range(stepnumber):
+            if len(channels) > 1:
+                yield ('step', l, x, array[x], data_mean[x, 0], data_sd[x, 0], aux[x])
+            else:
+                yield ('step', l, x, array[x], data_mean[x, 0], data_sd[x, 0])
+
+        stage.wait_until_stopped()
+        if not serpentine:
+            stage.move(0)
+            stage.wait_until_stopped()
+
+        data = np.concatenate((data, data_mean, data_sd), axis=1)
+
+        yield ('loop', l, data_mean, data_sd, data)
+
+
+def save_data(basename, data):
+    """Write the summary data_NN.txt; returns False if no loop was completed."""
+
+    if data is None or data.shape[1] < 2:
+        return False
+
+    np.savetxt(basename + '.txt', data)
+
+    return True
+
+
+def layout(params):
+    """What a step log must match to be resumed with params."""
+
+    return {'positions': [round(float(p), 6) for p in positions(params)], 'loops': int(params['loops']),
+            'channels': [int(c) for c in params.get('channels', [1])]}
+
+
+def open_archive(basename, params, resume=False):
+    """RawArchive sized for a step scan with these params."""
+
+    return raw_archive.RawArchive(basename, params['loops'], len(positions(params)), params['avs'],
+                                  params['quant'], len(params.get('channels', [1])), resume=resume)
+
+
+def run_scan(stage, daq, params, basename, fmt='txt', resume=False, progress=print, raw=False):
+    """Run a scan without a GUI and block until it ends.
+
+    Steps are logged to basename_steps.txt/.h5 as they are measured and the
+    summary goes to basename.txt; with raw=True every burst also goes to
+    basename_raw.npy. Ctrl-C aborts cleanly, keeping the completed loops.
+    Returns the final message ('done', 'aborted' or 'error')."""
+
+    try:
+        writer = scan_writer.ScanWriter(basename, fmt, resume=resume, layout=layout(params))
+    except (ValueError, ImportError) as error:
+        return ('error', error) # resuming a log of another scan, or HDF5 without pytables
+    archive = open_archive(basename, params, resume) if raw else None
+    worker = ScanWorker(stage, daq, params, writer=writer, resume=resume, archive=archive)
+    worker.start()
+
+    while True:
+        try:
+            message = worker.results.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        except KeyboardInterrupt:
+            worker.abort()
+            continue
+
+        if message[0] == 'step' and progress is not None:
+            progress('loop %d step %d  %.4f ps  %.6g V  %.2f points/s  ETA %s'
+                     % (message[1:5] + (worker.timer.rate(), timing.format_eta(worker.timer.eta()))))
+
+        elif message[0] == 'stats' and progress is not None:
+            progress('loop %d  median SE %.3g V  drift %.3g V  change %.2f SE' % message[1:5])
+
+        elif message[0] == 'converged' and progress is not None:
+            progress('converged after loop %d' % message[1])
+
+        elif message[0] in ('done', 'aborted'):
+            save_data(basename, message[1])
+            worker.timer.save(basename + '_timing.txt')
+            return message
+
+        elif message[0] == 'error':
+            return message
+
+
+def main(argv=None):
+    """Command-line entry point: python scan_engine.py --start -5 --end 20 --step 0.1"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run a delay scan without the GUI.')
+    parser.add_argument('--start', type=float, help='scan start position (ps)')
+    parser.add_argument('--end', type=float, help='scan end position (ps)')
+    parser.add_argument('--step', type=float, help='scan step size (ps)')
+    parser.add_argument('--segments', help="non-uniform grid instead, e.g. '-5:0:0.5, 0:3:0.05, 10'")
+    parser.add_argument('--target-se', type=float, help='stop averaging a step below this standard error (V)')
+    parser.add_argument('--loops', type=int, default=1, help='number of loops')
+    parser.add_argument('--serpentine', action='store_true', help='run every other loop backwards, without returning to zero')
+    parser.add_argument('--backlash', type=float, default=0, help='stage backlash (ps) to compensate on reversals')
+    parser.add_argument('--stop-se', type=float, help='stop once the median SE across loops is below this (V)')
+    parser.add_argument('--stop-loops', type=int, help='stop after this many loops in a row without significant change')
+    parser.add_argument('--freq', type=int, default=400, help='DAQ frequency (400-8192 Hz)')
+    parser.add_argument('--samples', type=int, default=400, help='DAQ samples per burst')
+    parser.add_argument('--averages', type=int, default=1, help='bursts averaged per step')
+    parser.add_argument('--wait', type=float, default=1, help='settle time after each move (s)')
+    parser.add_argument('--mode', choices=['step', 'fly'], default='step')
+    parser.add_argument('--streaming', action='store_true', help='running averages instead of raw bursts')
+    parser.add_argument('--dir', default='.', help='scan directory')
+    parser.add_argument('--scan', type=int, default=1, help='scan number, written as data_NN.txt')
+    parser.add_argument('--format', choices=['txt', 'hdf5'], default='txt', help='step log format')
+    parser.add_argument('--resume', action='store_true', help='continue an interrupted scan')
+    parser.add_argument('--raw', action='store_true', help='keep every raw burst in data_NN_raw.npy')
+    parser.add_argument('--queue', help='add the scan to this queue file (see scan_queue.py) instead of running it')
+    parser.add_argument('--port', default='COM12', help='serial port of the stage')
+    parser.add_argument('--initialize', action='store_true', help='initialize the stage first')
+    parser.add_argument('--simulate', action='store_true', help='use the simulated stage and DAQ')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.segments is None and None in (args.start, args.end, args.step):
+        parser.error('give --start, --end and --step, or --segments')
+
+    params = {'start': args.start, 'end': args.end, 'step': args.step, 'loops': args.loops,
+              'freq': args.freq, 'quant': args.samples, 'avs': args.averages, 'wait': args.wait,
+              'streaming': args.streaming, 'mode': args.mode, 'target_se': args.target_se,
+              'stop_se': args.stop_se, 'stop_loops': args.stop_loops, 'serpentine': args.serpentine}
+
+    if args.segments is not None:
+        params['positions'] = scan_planner.parse_segments(args.segments)
+
+    if args.queue is not None:
+        import scan_queue
+        queue = scan_queue.ScanQueue(args.queue)
+        jobid = queue.add(params)
+        print('job %d queued, about %.0f s' % (jobid, queue.estimate(params)))
+        return 0
+
+    # hardware is only opened here, so importing this module is free
+    daq, stage, server = device_server.open_hardware(args)
+
+    if args.initialize:
+        stage.initialize()
+    stage.set_backlash(args.backlash)
+
+    basename = os.path.join(args.dir, 'data_' + "%02d" % args.scan)
+    message = run_scan(stage, daq, params, basename, args.format, args.resume,
+                       progress=None if args.quiet else print, raw=args.raw)
+
+    device_server.close_hardware(stage, server)
+
+    if message[0] == 'error':
+        print('scan failed: %s' % message[1])
+        return 1
+
+    if message[1] is None or message[1].shape[1] < 2:
+        # aborted before a loop was done, only the step log has the data
+        print('scan %s before a loop was done, steps in %s_steps.%s' % (message[0], basename,
+                                                                        'txt' if args.format == 'txt' else 'h5'))
+    else:
+        print('scan %s, written to %s.txt' % (message[0], basename))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,180 @@
+# bulk loading of scan results (data_NN.txt) and fit files, with a cache
+import functools
+import glob
+import os
+import pickle
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+SCAN = re.compile(r'data_(\d+)\.txt$')
+
+
+def scan_files(directory):
+    """data_NN.txt summaries in a scan directory, by scan number (step logs,
+    timing files and other data_NN_*.txt are left out)."""
+
+    files = {}
+    for path in glob.glob(os.path.join(directory, 'data_*.txt')):
+        match = SCAN.search(os.path.basename(path))
+        if match:
+            files[path] = int(match.group(1))
+
+    return sorted(files, key=files.get)
+
+
+def fit_files(directory, pattern='*fit*.txt'):
+    """Fit files anywhere below directory, e.g. fitdir/grating/tag/..._fit.txt."""
+
+    return sorted(glob.glob(os.path.join(directory, '**', pattern), recursive=True))
+
+
+def parse_scan(path):
+    """One data_NN.txt (delay, then mean and sd per loop) as long-format rows
+    (scan, loop, step, delay, mean, sd)."""
+
+    data = np.loadtxt(path, ndmin=2)
+    steps = len(data)
+    loops = (data.shape[1] - 1)//2
+
+    return pd.DataFrame({'scan': int(SCAN.search(os.path.basename(path)).group(1)),
+                         'loop': np.repeat(np.arange(loops), steps),
+                         'step': np.tile(np.arange(steps), loops),
+                         'delay': np.tile(data[:, 0], loops),
+                         'mean': data[:, 1::2].T.ravel(),
+                         'sd': data[:, 2::2].T.ravel()})
+
+
+def parse_fit(path, directory='.'):
+    """One fit file (a header line, then time, measured and fitted amplitude),
+    labelled with the grating and tag folders it sits in."""
+
+    data = np.loadtxt(path, skiprows=1, ndmin=2)
+    folders = os.path.relpath(os.path.dirname(path), directory).split(os.sep)
+    folders = [f for f in folders if f not in ('', '.')] + ['', '']
+
+    frame = pd.DataFrame(data[:, 0:3], columns=['time', 'expAmp', 'fitAmp'])
+    frame['grating'] = folders[0]
+    frame['tag'] = folders[1]
+    frame['file'] = os.path.basename(path)
+
+    return frame
+
+
+def read_cache(path):
+
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None # missing or broken, rebuilt
+
+
+def write_cache(path, value):
+
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def load(directory, paths, parser, name, cache=True, workers=None):
+    """Parse paths into one DataFrame, in up to workers processes (np.loadtxt
+    holds the GIL, so threads would take turns). parser has to be picklable:
+    a module-level function or a functools.partial of one. workers defaults
+    to the number of CPUs; with one, or one file to parse, it all runs here.
+
+    With cache=True the combined frame is pickled to directory/.name_cache.pkl
+    together with the modification time and size of every file, and returned
+    from there while none of them changed. The per-file frames are kept in
+    .name_files.pkl, so after a change only new or modified files are parsed
+    again."""
+
+    combinedpath = os.path.join(directory, '.%s_cache.pkl' % name)
+    filespath = os.path.join(directory, '.%s_files.pkl' % name)
+
+    stamps = {}
+    for path in paths:
+        stat = os.stat(path)
+        stamps[path] = (stat.st_mtime_ns, stat.st_size)
+    key = tuple((os.path.relpath(p, directory),) + stamps[p] for p in paths)
+
+    if cache:
+        stored = read_cache(combinedpath)
+        if stored is not None and stored[0] == key:
+            return stored[1]
+
+    stored = (read_cache(filespath) if cache else None) or {}
+
+    frames = {}
+    todo = []
+    for path in paths:
+        entry = stored.get(os.path.relpath(path, directory))
+        if entry is not None and entry[0] == stamps[path]:
+            frames[path] = entry[1]
+        else:
+            todo.append(path)
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(todo))) as pool:
+            for path, frame in zip(todo, pool.map(parser, todo, chunksize=max(len(todo)//(4*workers), 1))):
+                frames[path] = frame
+    else:
+        for path in todo:
+            frames[path] = parser(path)
+
+    combined = pd.concat([frames[p] for p in paths], ignore_index=True) if len(paths) > 0 else pd.DataFrame()
+
+    if cache:
+        write_cache(filespath, {os.path.relpath(p, directory): (stamps[p], frames[p]) for p in paths})
+        write_cache(combinedpath, (key, combined))
+
+    return combined
+
+
+def load_scans(directory, cache=True, workers=None):
+    """Every data_NN.txt in directory as one long DataFrame with columns
+    scan, loop, step, delay, mean, sd."""
+
+    return load(directory, scan_files(directory), parse_scan, 'scans', cache, workers)
+
+
+def load_fits(directory, pattern='*fit*.txt', cache=True, workers=None):
+    """Every fit file below directory as one DataFrame with columns time,
+    expAmp, fitAmp, grating, tag, file."""
+
+    return load(directory, fit_files(directory, pattern), functools.partial(parse_fit, directory=directory), 'fits',
+                cache, workers)
+
+
+def main(argv=None):
+    """python scan_loader.py D:/scans - summary of the scans in a directory"""
+
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Load every scan in a directory.')
+    parser.add_argument('directory')
+    parser.add_argument('--no-cache', action='store_true')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    scans = load_scans(args.directory, cache=not args.no_cache)
+    elapsed = time.perf_counter() - start
+
+    if len(scans) == 0:
+        print('no data_NN.txt in %s' % args.directory)
+        return 1
+
+    print(scans.groupby('scan').agg(loops=('loop', 'nunique'), steps=('step', 'nunique'),
+                                     start=('delay', 'min'), end=('delay', 'max')).to_string())
+    print('%d rows from %d scans in %.3f s' % (len(scans), scans['scan'].nunique(), elapsed))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+# non-uniform delay grids: user segments and refinement from a coarse scan
+import numpy as np
+
+
+def segmented_grid(segments):
+    """Sorted, de-duplicated positions from (start, end, step) segments."""
+
+    points = []
+    for start, end, step in segments:
+        stepnumber = round((end - start)/step) + 1
+        points.append(start + step*np.arange(int(stepnumber)))
+
+    return np.unique(np.round(np.concatenate(points), 9))
+
+
+def parse_segments(text):
+    """Positions from text like '-5:0:0.5, 0:3:0.05, 10, 20' - start:end:step
+    ranges and single points, comma separated."""
+
+    segments = []
+    singles = []
+
+    for item in text.split(','):
+        item = item.strip()
+        if item == '':
+            continue
+        if ':' in item:
+            start, end, step = (float(v) for v in item.split(':'))
+            segments.append((start, end, step))
+        else:
+            singles.append(float(item))
+
+    if len(singles) > 0:
+        segments += [(p, p, 1) for p in singles]
+
+    return segmented_grid(segments)
+
+
+def format_segments(positions):
+    """Inverse of parse_segments: runs with equal spacing become start:end:step."""
+
+    positions = np.asarray(positions)
+    items = []
+    i = 0
+
+    while i < len(positions):
+        j = i + 1
+        if j < len(positions):
+            step = positions[j] - positions[i]
+            while j + 1 < len(positions) and np.isclose(positions[j + 1] - positions[j], step):
+                j += 1
+        if j - i >= 2:
+            items.append('%g:%g:%g' % (positions[i], positions[j], step))
+            i = j + 1
+        else:
+            items.append('%g' % positions[i])
+            i += 1
+
+    return ', '.join(items)
+
+
+def refine_grid(positions, values, threshold=0.05, levels=2, minstep=None):
+    """Denser grid where a coarse scan changes quickly.
+
+    Every interval whose change exceeds threshold times the full range of
+    values is split into 2**levels pieces (never finer than minstep); flat
+    baselines keep the coarse spacing."""
+
+    positions = np.asarray(positions, dtype=float)
+    values = np.asarray(values, dtype=float)
+
+    span = np.nanmax(values) - np.nanmin(values)
+    steep = np.abs(np.diff(values)) > threshold*span
+
+    points = [positions]
+    for i in np.nonzero(steep)[0]:
+        pieces = 2**levels
+        if minstep is not None:
+            pieces = max(min(pieces, int((positions[i + 1] - positions[i])/minstep)), 1)
+        points.append(np.linspace(positions[i], positions[i + 1], pieces + 1))
+
+    return np.unique(np.round(np.concatenate(points), 9))
@@ -0,0 +1,340 @@
+# persistent queue of scans run back to back without anyone at the instrument
+import contextlib
+import json
+import os
+import socket
+import sys
+import time
+
+import numpy as np
+
+import device_server
+import scan_engine
+
+
+def _plain(value):
+    # numpy values in params (e.g. planned positions) as JSON types
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' % (value,))
+
+
+def _alive(pid):
+    # whether a process on this machine is still running
+    if os.name == 'nt':
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid) # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259 # STILL_ACTIVE
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True # someone else's, but running
+
+    return True
+
+
+class ScanQueue:
+    """Scan parameter sets waiting to run, kept in a JSON file.
+
+    Several programs may use the same file (the GUI, scan_queue.py run,
+    scan_engine.py --queue), so every change takes a lock file, reads the
+    file again, applies itself to what is there and writes it back (to a
+    temporary file, then renamed); nothing another program added, moved or
+    cancelled is overwritten. A job is a dict with 'id', 'params', 'status'
+    (pending, running, done, aborted, error or cancelled), the 'scan' number
+    it was written to and, once finished, its 'duration' in seconds. A
+    running job records the host and pid that runs it; only when that
+    process is gone was it interrupted, and it becomes pending again, to be
+    resumed from its step log.
+
+    Runtime estimates use the per-step overhead (move, settle, USB calls)
+    measured on the jobs finished so far on top of the nominal wait and
+    sampling time."""
+
+    def __init__(self, path='scan_queue.json', timeout=10):
+        self.path = path
+        self.timeout = timeout
+        self.reload()
+
+    def reload(self):
+        """Read the queue file again, e.g. after another process edited it."""
+
+        self.jobs = []
+        self.nextid = 1
+        self.overhead = 0.5 # s per step beyond wait and sampling, until measured
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                state = json.load(f)
+            self.jobs = state['jobs']
+            self.nextid = state['nextid']
+            self.overhead = state['overhead']
+
+        for job in self.jobs:
+            if job['status'] == 'running' and not self.owner_alive(job):
+                job['status'] = 'pending'
+                job['resume'] = True
+                job.pop('owner', None)
+
+    def owner_alive(self, job):
+        """Whether the program running job is still running; one on another
+        machine is assumed to be."""
+
+        owner = job.get('owner')
+        if owner is None:
+            return False
+        if owner[0] != socket.gethostname():
+            return True
+
+        return owner[1] == os.getpid() or _alive(owner[1])
+
+    @contextlib.contextmanager
+    def locked(self):
+        """Hold the queue's lock file, with the file freshly read; whatever
+        the block changes is saved when it ends."""
+
+        lockpath = self.path + '.lock'
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                fd = os.open(lockpath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except FileExistsError:
+                # a lock this old was left by a crash, changes take milliseconds
+                try:
+                    if time.time() - os.path.getmtime(lockpath) > 60:
+                        os.remove(lockpath)
+                        continue
+                except OSError:
+                    continue
+                if time.time() > deadline:
+                    raise TimeoutError('queue %s is locked (%s)' % (self.path, lockpath))
+                time.sleep(0.05)
+
+        try:
+            self.reload()
+            yield
+            self.save()
+        finally:
+            os.close(fd)
+            os.remove(lockpath)
+
+    def save(self):
+        # call through locked(), which reads the file first
+        state = {'jobs': self.jobs, 'nextid': self.nextid, 'overhead': self.overhead}
+
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(state, f, indent=1, default=_plain)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+    def add(self, params):
+        """Append a scan; returns its job id."""
+
+        with self.locked():
+            job = {'id': self.nextid, 'params': json.loads(json.dumps(params, default=_plain)), 'status': 'pending'}
+            self.jobs.append(job)
+            self.nextid += 1
+
+        return job['id']
+
+    def job(self, jobid):
+        for job in self.jobs:
+            if job['id'] == jobid:
+                return job
+        raise KeyError('no job %d in the queue' % jobid)
+
+    def pending(self):
+        return [job for job in self.jobs if job['status'] == 'pending']
+
+    def next(self):
+        """The first pending job, or None when the queue is empty."""
+
+        pending = self.pending()
+
+        return pending[0] if len(pending) > 0 else None
+
+    def cancel(self, jobid):
+        """Drop a pending job; a running one has to be aborted instead."""
+
+        with self.locked():
+            job = self.job(jobid)
+            if job['status'] != 'pending':
+                raise ValueError('job %d is %s' % (jobid, job['status']))
+
+            job['status'] = 'cancelled'
+
+    def move(self, jobid, offset):
+        """Move a pending job offset places up (negative) or down the list of
+        pending jobs."""
+
+        with self.locked():
+            pending = self.pending()
+            job = self.job(jobid)
+            if job not in pending:
+                raise ValueError('job %d is %s' % (jobid, job['status']))
+
+            target = pending[min(max(pending.index(job) + offset, 0), len(pending) - 1)]
+            i, j = self.jobs.index(job), self.jobs.index(target)
+            self.jobs[i], self.jobs[j] = self.jobs[j], self.jobs[i]
+
+    def start(self, job, scan):
+        """Claim a pending job for this program; ValueError if another one
+        took it (or it was cancelled) meanwhile. Returns the job as stored."""
+
+        with self.locked():
+            stored = self.job(job['id'])
+            if stored['status'] != 'pending':
+                raise ValueError('job %d is %s' % (job['id'], stored['status']))
+
+            stored['status'] = 'running'
+            stored['scan'] = scan
+            stored['started'] = time.time()
+            stored['owner'] = (socket.gethostname(), os.getpid())
+
+        return stored
+
+    def finish(self, job, status, loops=None):
+        """Record how a job ended; a completed run of loops loops also
+        updates the measured per-step overhead."""
+
+        with self.locked():
+            stored = self.job(job['id'])
+            stored['status'] = status
+            stored['duration'] = time.time() - stored['started']
+            stored.pop('resume', None)
+            stored.pop('owner', None)
+
+            params = stored['params']
+            if loops and params.get('target_se') is None:
+                steps = loops*len(scan_engine.positions(params))
+                measured = stored['duration']/steps - nominal_step(params)
+                self.overhead = 0.5*self.overhead + 0.5*max(measured, 0)
+
+    def estimate(self, params):
+        """Expected runtime of a scan (s) at the measured throughput. With a
+        target SE or a convergence stop this is the upper limit."""
+
+        steps = params['loops']*len(scan_engine.positions(params))
+
+        return steps*(nominal_step(params) + self.overhead)
+
+    def remaining(self):
+        """Expected time (s) to run every pending job."""
+
+        return sum(self.estimate(job['params']) for job in self.pending())
+
+
+def nominal_step(params):
+    """Settle plus sampling time of one step (s), without any overhead."""
+
+    return params['wait'] + params['avs']*params['quant']/params['freq']
+
+
+def next_scan_number(directory, start=1):
+    """First scan number from start on without a data_NN file."""
+
+    number = start
+    while any(os.path.exists(os.path.join(directory, 'data_%02d%s' % (number, end)))
+              for end in ('.txt', '_steps.txt', '_steps.h5')):
+        number += 1
+
+    return number
+
+
+def loops_done(data):
+    return 0 if data is None else (data.shape[1] - 1)//2
+
+
+def run_queue(stage, daq, queue, directory, fmt='txt', progress=print):
+    """Run pending jobs until the queue is empty. Jobs added, moved or
+    cancelled in the file meanwhile are picked up between scans."""
+
+    while True:
+        # another process may have edited the queue
+        queue.reload()
+        job = queue.next()
+        if job is None:
+            return
+
+        resume = job.get('resume', False)
+        scan = job['scan'] if resume else next_scan_number(directory)
+        try:
+            job = queue.start(job, scan)
+        except ValueError:
+            continue # taken by another runner meanwhile
+
+        if progress is not None:
+            progress('job %d: scan %02d, about %.0f s' % (job['id'], scan, queue.estimate(job['params'])))
+
+        basename = os.path.join(directory, 'data_%02d' % scan)
+        message = scan_engine.run_scan(stage, daq, job['params'], basename, fmt, resume, progress)
+
+        # a resumed run took less than its full time
+        queue.finish(job, message[0], loops_done(message[1]) if message[0] == 'done' and not resume else None)
+
+        if message[0] == 'aborted':
+            return
+
+
+def main(argv=None):
+    """Command-line entry point. Add jobs with python scan_engine.py --queue
+    scan_queue.json ..., then python scan_queue.py run --dir D:/scans"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show, edit or run the scan queue.')
+    parser.add_argument('command', choices=['list', 'run', 'cancel', 'up', 'down'])
+    parser.add_argument('job', type=int, nargs='?', help='job id for cancel, up and down')
+    parser.add_argument('--queue', default='scan_queue.json', help='queue file')
+    parser.add_argument('--dir', default='.', help='scan directory')
+    parser.add_argument('--format', choices=['txt', 'hdf5'], default='txt', help='step log format')
+    parser.add_argument('--port', default='COM12', help='serial port of the stage')
+    parser.add_argument('--simulate', action='store_true', help='use the simulated stage and DAQ')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    queue = ScanQueue(args.queue)
+
+    if args.command in ('cancel', 'up', 'down'):
+        if args.job is None:
+            parser.error('%s needs a job id' % args.command)
+        if args.command == 'cancel':
+            queue.cancel(args.job)
+        else:
+            queue.move(args.job, -1 if args.command == 'up' else 1)
+
+    if args.command == 'run':
+        daq, stage, server = device_server.open_hardware(args)
+        run_queue(stage, daq, queue, args.dir, args.format, progress=None if args.quiet else print)
+        device_server.close_hardware(stage, server)
+
+    for job in queue.jobs:
+        line = '%3d  %-9s' % (job['id'], job['status'])
+        if 'scan' in job:
+            line += '  data_%02d' % job['scan']
+        if 'duration' in job:
+            line += '  took %.0f s' % job['duration']
+        elif job['status'] == 'pending':
+            line += '  about %.0f s' % queue.estimate(job['params'])
+        print(line)
+
+    print('%d pending, about %.0f s' % (len(queue.pending()), queue.remaining()))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+# append-only, crash-safe writer for delay scans
+import json
+import os
+import time
+
+import pandas as pd
+
+COLUMNS = ['loop', 'step', 'position', 'mean', 'sd', 'timestamp']
+
+
+class ScanWriter:
+    """Writes every scan step to disk as soon as it is measured.
+
+    The step log sits next to data_NN.txt as data_NN_steps.txt (plain text,
+    flushed and fsynced per step) or data_NN_steps.h5 (chunked HDF5 table
+    through pandas, needs pytables). Multi-channel scans add the mean of
+    every channel as extra columns. With resume=True an existing log is kept
+    and completed() tells the scan which steps to skip.
+
+    layout (positions, loops and channels, see scan_engine.layout) is stored
+    in the log's header; resuming a log written for a different layout
+    raises ValueError, since its steps would be put in the wrong places."""
+
+    def __init__(self, basename, fmt='txt', resume=False, layout=None):
+        if fmt not in ('txt', 'hdf5'):
+            raise ValueError('format must be txt or hdf5')
+
+        self.fmt = fmt
+        self.path = basename + ('_steps.txt' if fmt == 'txt' else '_steps.h5')
+
+        if not resume and os.path.exists(self.path):
+            os.remove(self.path)
+
+        if fmt == 'txt':
+            new = not os.path.exists(self.path)
+            if not new:
+                drop_partial_line(self.path)
+                self.check(read_layout(self.path), layout)
+            self.file = open(self.path, 'a')
+            if new:
+                self.file.write('# ' + ' '.join(COLUMNS) + '\n')
+                if layout is not None:
+                    self.file.write('# layout ' + json.dumps(layout) + '\n')
+                self._sync()
+        else:
+            self.file = pd.HDFStore(self.path, mode='a')
+            attrs = self.file.root._v_attrs
+            if 'layout' in attrs:
+                try:
+                    self.check(json.loads(attrs.layout), layout)
+                except ValueError:
+                    self.file.close()
+                    raise
+            elif layout is not None:
+                attrs.layout = json.dumps(layout)
+                self.file.flush(fsync=True)
+
+    def check(self, stored, layout):
+        """Refuse to resume a log written for a different scan (logs from
+        before layouts were stored are taken as they are)."""
+
+        if stored is None or layout is None:
+            return
+
+        differ = [key for key in ('loops', 'channels') if stored.get(key) != layout.get(key)]
+        if (len(stored['positions']) != len(layout['positions'])
+                or any(abs(a - b) > 1e-6 for a, b in zip(stored['positions'], layout['positions']))):
+            differ.insert(0, 'positions')
+
+        if len(differ) > 0:
+            raise ValueError('%s is from a scan with different %s; not resuming it' % (self.path, ', '.join(differ)))
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def write(self, loop, step, position, vmean, sd, aux=()):
+        """Append one measured step and push it to disk."""
+
+        timestamp = time.time()
+
+        if self.fmt == 'txt':
+            self.file.write('%d %d %.6f %.10e %.10e %.6f' % (loop, step, position, vmean, sd, timestamp)
+                            + ''.join(' %.10e' % a for a in aux) + '\n')
+            self._sync()
+        else:
+            row = pd.DataFrame([[loop, step, position, vmean, sd, timestamp] + list(aux)],
+                               columns=COLUMNS + ['channel%d' % k for k in range(len(aux))])
+            row = row.astype({'loop': 'int64', 'step': 'int64'})
+            self.file.append('steps', row, format='table', index=False)
+            self.file.flush(fsync=True)
+
+    def load(self):
+        """All steps written so far as a DataFrame."""
+
+        if self.fmt == 'txt':
+            self.file.flush()
+            return read_steps(self.path)
+
+        if 'steps' not in self.file:
+            return pd.DataFrame(columns=COLUMNS)
+        return self.file.select('steps')
+
+    def completed(self):
+        """Dict of (loop, step) -> (mean, sd) for every step already on disk."""
+
+        steps = self.load()
+
+        return {(int(l), int(x)): (m, s) for l, x, m, s in
+                zip(steps['loop'], steps['step'], steps['mean'], steps['sd'])}
+
+    def close(self):
+        self.file.close()
+
+
+def read_steps(path):
+    """Read a text step log, ignoring a last line cut short by a crash."""
+
+    rows = []
+
+    with open(path) as f:
+        for line in f:
+            if line.startswith('#'):
+                continue
+            fields = line.split()
+            if len(fields) < len(COLUMNS):
+                continue
+            try:
+                rows.append([float(v) for v in fields[0:len(COLUMNS)]])
+            except ValueError:
+                continue
+
+    steps = pd.DataFrame(rows, columns=COLUMNS)
+
+    return steps.astype({'loop': 'int64', 'step': 'int64'})
+
+
+
+def read_layout(path):
+    """The layout stored in a text step log's header, or None."""
+
+    with open(path) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            if line.startswith('# layout '):
+                return json.loads(line[len('# layout '):])
+
+    return None
+
+
+def drop_partial_line(path):
+    """Cut a last line that a crash left without its newline."""
+
+    with open(path, 'rb+') as f:
+        content = f.read()
+        if len(content) > 0 and not content.endswith(b'\n'):
+            f.truncate(content.rfind(b'\n') + 1)
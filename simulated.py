@@ -0,0 +1,221 @@
+# simulated stage and DAQ backends, for running and benchmarking the scan pipeline without hardware
+import threading
+import time
+
+import numpy as np
+
+import calibration
+from appliedmotion import AppliedMotion, move_profile
+
+
+class SimulatedDrive:
+    """Stands in for the serial port of an Applied Motion drive.
+
+    Understands the SCL commands AppliedMotion sends, answers with '%' acks
+    terminated by a carriage return, takes the time a 9600 baud link takes,
+    and models moves with the trapezoidal profile of VE/AC/DE."""
+
+    def __init__(self, baudrate=9600, steps_per_rev=20000):
+        self.baudrate = baudrate
+        self.steps_per_rev = steps_per_rev
+        self.timeout = 0.5
+        self.is_open = True
+
+        self.ve = 1.0
+        self.ac = 10.0
+        self.de = 10.0
+        self.di = 0
+        self.offset = 0 # SP moves the origin
+        self.move_from = 0
+        self.move_to = 0
+        self.move_start = 0.0
+        self.move_speed = (self.ve, self.ac, self.de) # VE/AC/DE at the time of the move
+
+        self.replies = b''
+        self.lock = threading.Lock()
+
+    def position_at(self, t):
+        """Drive position (steps) at time(s) t, from the current move profile."""
+
+        distance = abs(self.move_to - self.move_from)/self.steps_per_rev
+        travelled = move_profile(np.asarray(t) - self.move_start, distance, *self.move_speed)[0]
+
+        return self.move_from + np.sign(self.move_to - self.move_from)*travelled*self.steps_per_rev - self.offset
+
+    def moving(self):
+        distance = abs(self.move_to - self.move_from)/self.steps_per_rev
+        return time.perf_counter() - self.move_start < move_profile(0, distance, *self.move_speed)[1]
+
+    def _wire(self, nbytes):
+        time.sleep(nbytes*10/self.baudrate) # 8N1, 10 bits per byte
+
+    def _execute(self, command):
+
+        code, value = command[:2], command[2:]
+
+        if code == 'SC':
+            return 'SC=%04X' % (0x0011 if self.moving() else 0x0001)
+        if code == 'IP':
+            return 'IP=%08X' % (int(round(float(self.position_at(time.perf_counter())))) & 0xFFFFFFFF)
+        if code == 'DI':
+            self.di = int(value)
+        elif code == 'FP':
+            now = time.perf_counter()
+            self.move_from = float(self.position_at(now)) + self.offset
+            self.move_to = self.di + self.offset
+            self.move_start = now
+            self.move_speed = (self.ve, self.ac, self.de)
+        elif code == 'SP':
+            self.offset = float(self.position_at(time.perf_counter())) + self.offset - float(value or 0)
+            self.move_from = self.move_to = float(value or 0) + self.offset
+        elif code == 'VE':
+            self.ve = float(value)
+        elif code == 'AC':
+            self.ac = float(value)
+        elif code == 'DE':
+            self.de = float(value)
+
+        return '%'
+
+    def write(self, data):
+        self._wire(len(data))
+        with self.lock:
+            for command in data.decode().split('\r')[:-1]:
+                self.replies += (self._execute(command) + '\r').encode()
+
+    def read_until(self, terminator=b'\r'):
+        with self.lock:
+            i = self.replies.find(terminator)
+            if i >= 0:
+                reply, self.replies = self.replies[:i + 1], self.replies[i + 1:]
+                self._wire(len(reply))
+                return reply
+        time.sleep(self.timeout)
+        return b''
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self.replies = b''
+
+    def close(self):
+        self.is_open = False
+
+    def open(self):
+        self.is_open = True
+
+
+class SimulatedAppliedMotion(AppliedMotion):
+    """AppliedMotion talking to a SimulatedDrive instead of a serial port."""
+
+    def appliedmotion_connect(self, port, read_timeout=0.5, write_timeout=2):
+        return SimulatedDrive()
+
+    def delay_at(self, t):
+        """Pump-probe delay (ps) at time(s) t; scans move to -delay."""
+
+        return -self.serial_port.position_at(t)/(20000*10/4/2.54/self.ps_per_cm)
+
+
+class SimulatedU12:
+    """Stands in for u12.U12 with synthetic signals at realistic rates.
+
+    signal='pumpprobe' gives a step-and-decay transient that follows the
+    delay of the given stage, with laser intensity noise that is common to
+    every channel (channel 0 carries the bare laser intensity, as a reference
+    photodiode would). With self.chopper set (Hz) the pump is chopped and
+    channel 2 carries the 0-5 V chopper reference.
+
+    signal='thermistor' gives the voltage of the thermistor divider used in
+    gui_thermo for a sample relaxing exponentially towards self.setpoint
+    (C); with self.thermistor_channel set it appears on that channel next to
+    the pump-probe signal. Each burst or stream read costs a fixed USB
+    overhead plus the sampling time."""
+
+    def __init__(self, signal='pumpprobe', stage=None, overhead=0.02, noise=0.002, seed=None):
+        self.signal = signal
+        self.stage = stage
+        self.overhead = overhead
+        self.noise = noise
+        self.rng = np.random.default_rng(seed)
+
+        # pump-probe transient
+        self.amplitude = 0.05
+        self.tau = 2.0 # ps
+        self.width = 0.15 # ps, pump-probe cross-correlation
+        self.chopper = None
+
+        # thermistor
+        cal = calibration.load('calibration_20240208.csv')
+        order = np.argsort(cal.temperature_table)
+        self.cal_temperature = cal.temperature_table[order]
+        self.cal_resistance = cal.resistance[order]
+        self.start = time.perf_counter()
+        self.t0 = 25.0
+        self.setpoint = 25.0
+        self.thermal_tau = 120.0 # s
+        self.thermistor_channel = None # channel that carries the thermistor in pump-probe mode
+
+        self.stream = None
+
+    def set_temperature(self, setpoint):
+        """Start relaxing from the current temperature towards a new setpoint."""
+
+        now = time.perf_counter()
+        self.t0 = self.temperature(now)
+        self.start = now
+        self.setpoint = setpoint
+
+    def temperature(self, t):
+        return self.setpoint + (self.t0 - self.setpoint)*np.exp(-(np.asarray(t) - self.start)/self.thermal_tau)
+
+    def _voltages(self, channels, t):
+        """(len(t), len(channels)) synthetic voltages at times t."""
+
+        t = np.atleast_1d(t)
+        laser = 1 + 0.01*self.rng.standard_normal(len(t))
+        out = np.empty([len(t), len(channels)])
+
+        for k, channel in enumerate(channels):
+            if self.signal == 'thermistor' or channel == self.thermistor_channel:
+                r = np.interp(self.temperature(t), self.cal_temperature, self.cal_resistance)
+                v = (25500 + r*5100*11.67e-6)/(r*(1 + 5100*8.181e-6) + 5100) # inverse of the gui_thermo formula
+            elif channel == 0:
+                v = laser
+            elif channel == 2 and self.chopper is not None:
+                v = 5.0*(np.sin(2*np.pi*self.chopper*t) > 0)
+            else:
+                delay = self.stage.delay_at(t) if self.stage is not None else np.zeros(len(t))
+                onset = 0.5*(1 + np.tanh(delay/self.width))
+                pump = 1.0 if self.chopper is None else (np.sin(2*np.pi*self.chopper*t) > 0)
+                v = laser*(0.5 + pump*self.amplitude*onset*np.exp(-np.clip(delay, 0, None)/self.tau))
+            out[:, k] = v + self.noise*self.rng.standard_normal(len(t))
+
+        return out
+
+    def aiBurst(self, numChannels, channels, scanRate, numScans, *args, **kwargs):
+        start = time.perf_counter()
+        time.sleep(self.overhead + numScans/scanRate)
+        t = start + self.overhead + np.arange(numScans)/scanRate
+        return {'voltages': self._voltages(channels[:numChannels], t), 'overVoltage': 0}
+
+    def eAnalogIn(self, channel, *args, **kwargs):
+        time.sleep(self.overhead)
+        return {'voltage': float(self._voltages([channel], time.perf_counter())[0, 0]), 'overVoltage': 0}
+
+    def aiStreamStart(self, numChannels, channels, scanRate, *args, **kwargs):
+        time.sleep(self.overhead)
+        self.stream = {'channels': channels[:numChannels], 'rate': scanRate,
+                       'start': time.perf_counter(), 'read': 0}
+
+    def aiStreamRead(self, numScans, *args, **kwargs):
+        s = self.stream
+        t = s['start'] + (s['read'] + np.arange(numScans))/s['rate']
+        wait = t[-1] - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        s['read'] += numScans
+        backlog = int(max(time.perf_counter() - t[-1], 0)*s['rate'])
+        return {'voltages': self._voltages(s['channels'], t), 'ljScanBacklog': backlog, 'overVoltage': 0}
+
+    def aiStreamClear(self, *args, **kwargs):
+        self.stream = None
@@ -0,0 +1,197 @@
+# continuous U12 stream acquisition into a fixed-size ring buffer
+import collections
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from acquisition import hardware_channels
+
+MAX_RATE = 1200 # U12 stream, samples/s over all channels
+
+
+class StreamAcquisition:
+    """Keeps a hardware-timed U12 stream running and stores it in a ring buffer.
+
+    A reader thread calls aiStreamRead in chunks and writes into a
+    preallocated (size, channels) array. Every sample has an absolute index
+    (self.count is the next one), so consumers can ask for the samples taken
+    after some moment without restarting the stream. Underflows (short
+    reads), samples lost to a full U12 buffer and read errors are counted the
+    way the old streamData loop in startscanCallback logged them; only the
+    last maxerrors messages are kept. A failing read is retried with a
+    growing pause, and after maxfailures failures in a row (e.g. the U12 was
+    unplugged) the stream gives up: running becomes False, self.failure holds
+    the exception and waiting consumers get a RuntimeError."""
+
+    def __init__(self, daq, channels=[1], freq=1200, seconds=60, chunk=None, maxbacklog=4096,
+                 maxerrors=1000, maxfailures=10):
+        self.daq = daq
+        self.channels = list(channels)
+        self.freq = freq
+        self.chunk = chunk if chunk is not None else max(int(freq/20), 1) # ~50 ms per read
+        self.maxbacklog = maxbacklog
+
+        self.size = int(seconds*freq)
+        self.buffer = np.zeros([self.size, len(self.channels)])
+        self.count = 0
+
+        self.missed = 0
+        self.underflows = 0
+        self.readerrors = 0
+        self.errors = collections.deque(maxlen=maxerrors)
+        self.maxfailures = maxfailures
+        self.failure = None
+
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """Start the hardware stream and the reader thread."""
+
+        if self.running:
+            return
+
+        read = hardware_channels(self.channels) # 1, 2 or 4 on the U12
+        self.daq.aiStreamStart(len(read), read, self.freq)
+        self.starttime = time.perf_counter()
+        self.anchor = (self.starttime, 0) # (time, index of the sample taken then)
+        self.failure = None
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Stop the reader thread and the hardware stream."""
+
+        if self.thread is None:
+            return
+
+        self.running = False
+        self.thread.join()
+        self.thread = None
+        try:
+            self.daq.aiStreamClear()
+        except Exception:
+            if self.failure is None:
+                raise # a failed stream may not clear cleanly
+
+        with self.condition:
+            self.condition.notify_all()
+
+    def _run(self):
+
+        failures = 0
+
+        while self.running:
+            try:
+                r = self.daq.aiStreamRead(self.chunk)
+                now = time.perf_counter()
+            except Exception as e:
+                self.readerrors += 1
+                self.errors.append("Errors counted: %s ; %s" % (e, datetime.now()))
+                failures += 1
+                if failures >= self.maxfailures:
+                    self.failure = e
+                    with self.condition:
+                        self.running = False
+                        self.condition.notify_all()
+                    return
+                time.sleep(min(0.05*2**failures, 1))
+                continue
+
+            failures = 0
+
+            voltages = np.asarray(r['voltages'])[:, 0:len(self.channels)]
+
+            if len(voltages) != self.chunk:
+                self.underflows += 1
+                self.errors.append("----- UNDERFLOW : %s ; %s" % (len(voltages), datetime.now()))
+
+            # the U12 drops scans once its buffer is full
+            backlog = r.get('ljScanBacklog', 0)
+            if backlog >= self.maxbacklog:
+                self.missed += backlog - self.maxbacklog + 1
+                self.errors.append("+++ Backlog %s ; %s" % (backlog, datetime.now()))
+
+            self._write(voltages)
+
+            # the scans still waiting in the U12 were taken before now
+            self.anchor = (now, self.count + min(backlog, self.maxbacklog))
+
+    def _write(self, voltages):
+
+        n = len(voltages)
+        if n > self.size:
+            voltages = voltages[-self.size:]
+            self.count += n - self.size
+            n = self.size
+
+        start = self.count % self.size
+        first = min(n, self.size - start)
+
+        self.buffer[start:start + first] = voltages[:first]
+        self.buffer[:n - first] = voltages[first:]
+
+        with self.condition:
+            self.count += n
+            self.condition.notify_all()
+
+    def rate(self):
+        """Measured samples per second since the stream started."""
+
+        if not self.running and self.count == 0:
+            return 0.0
+
+        return self.count/(time.perf_counter() - self.starttime)
+
+    def index_at(self, t):
+        """Index of the sample taken at perf_counter time t. Reads lag the
+        hardware by up to a chunk, so this is ahead of self.count. Counted
+        from the last read, so samples lost before it (missed, short reads)
+        do not shift it; samples lost after t still do."""
+
+        anchor, index = self.anchor
+
+        return index + int(round((t - anchor)*self.freq))
+
+    def read(self, start, n):
+        """Copy of the samples with absolute indices start .. start+n-1."""
+
+        if start < self.count - self.size:
+            raise IndexError('samples %d.. have already been overwritten' % start)
+        if start + n > self.count:
+            raise IndexError('samples up to %d have not been read yet' % (start + n))
+
+        index = np.arange(start, start + n) % self.size
+
+        return self.buffer[index]
+
+    def latest(self, n):
+        """The n most recent samples."""
+
+        n = min(n, self.count, self.size)
+
+        return self.read(self.count - n, n)
+
+    def wait_for(self, count, timeout=None):
+        """Block until at least count samples have been streamed."""
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.count >= count or not self.running, timeout):
+                raise TimeoutError('stream stalled at sample %d' % self.count)
+
+        if self.count < count:
+            if self.failure is not None:
+                raise RuntimeError('stream failed at sample %d: %s' % (self.count, self.failure))
+            raise RuntimeError('stream stopped at sample %d' % self.count)
+
+    def next(self, n, timeout=None):
+        """The next n samples taken from now on."""
+
+        start = self.count
+        self.wait_for(start + n, timeout)
+
+        return self.read(start, n)
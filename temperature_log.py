@@ -0,0 +1,131 @@
+# open-ended temperature logging with a fixed memory ceiling
+import collections
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+import acquisition
+import device_server
+import timing
+
+
+class TemperatureLog:
+    """Timestamped (time, voltage, temperature) samples kept in fixed-size
+    segments. Rows are appended to a text file at least every flush_interval
+    seconds; only the last keep segments stay in memory for plotting, so
+    memory does not grow however long the run. Running mean and standard
+    error are updated per sample."""
+
+    def __init__(self, path, segment=1024, keep=8, flush_interval=10):
+        self.path = path
+        self.segment = segment
+        self.flush_interval = flush_interval
+
+        self.current = np.zeros([segment, 3])
+        self.n = 0 # rows in the current segment
+        self.flushed = 0 # rows of the current segment already on disk
+        self.old = collections.deque(maxlen=keep)
+        self.lastflush = time.perf_counter()
+
+        self.stats = acquisition.RunningStats()
+
+        new = not os.path.exists(path)
+        self.file = open(path, 'a')
+        if new:
+            self.file.write('# time (s since epoch), voltage (V), temperature (C)\n')
+
+    def add(self, t, voltage, temperature):
+
+        self.current[self.n] = (t, voltage, temperature)
+        self.n += 1
+        self.stats.add(temperature)
+
+        if self.n == self.segment:
+            self.flush()
+            self.old.append(self.current)
+            self.current = np.zeros([self.segment, 3])
+            self.n = 0
+            self.flushed = 0
+        elif time.perf_counter() - self.lastflush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Append the rows not yet on disk."""
+
+        np.savetxt(self.file, self.current[self.flushed:self.n], fmt='%.3f %.6e %.4f')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.flushed = self.n
+        self.lastflush = time.perf_counter()
+
+    def recent(self):
+        """The samples still in memory, oldest first, as a (n, 3) array."""
+
+        return np.concatenate(list(self.old) + [self.current[:self.n]])
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+class TemperatureLogger(threading.Thread):
+    """Reads the thermistor every wait seconds until stopped and writes to a
+    TemperatureLog. Posts ('sample', time, temperature, mean, se) and, at the
+    end, ('stopped',) or ('error', exception) to self.results. Each reading
+    is timed by phase in self.timer, saved next to the log as _timing.txt.
+    With a device server's RemoteServer, readings come from the shared
+    stream whenever another client keeps one running."""
+
+    def __init__(self, daq, calibration, log, freq, quant, wait, channel=1, server=None):
+        super(TemperatureLogger, self).__init__(daemon=True)
+
+        self.daq = daq
+        self.calibration = calibration
+        self.log = log
+        self.freq = freq
+        self.quant = quant
+        self.wait = wait
+        self.channel = channel
+        self.server = server
+
+        self.results = queue.Queue()
+        self._stop_event = threading.Event()
+        # runs open-ended, so only the recent readings are kept for percentiles
+        self.timer = timing.PhaseTimer(('acquire', 'convert', 'write', 'wait'), keep=4096)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+
+        buffer = np.empty([1, self.quant])
+
+        try:
+            while not self._stop_event.is_set():
+                self.timer.start()
+                t = time.time()
+                if self.server is None:
+                    voltages = acquisition.burst(self.daq, self.freq, self.quant, 1, self.channel, out=buffer)
+                else:
+                    voltages = device_server.read_channel(self.daq, self.server, self.freq, self.quant, self.channel)
+                self.timer.lap('acquire')
+                temperature = np.mean(self.calibration.voltage_to_temperature(voltages))
+                self.timer.lap('convert')
+
+                self.log.add(t, voltages.mean(), temperature)
+                self.results.put(('sample', t, temperature, self.log.stats.mean, self.log.stats.se))
+                self.timer.lap('write')
+
+                self._stop_event.wait(self.wait)
+                self.timer.lap('wait')
+                self.timer.end_step()
+        except Exception as e:
+            self.results.put(('error', e))
+        else:
+            self.results.put(('stopped',))
+        finally:
+            self.log.close()
+            self.timer.save(os.path.splitext(self.log.path)[0] + '_timing.txt')
@@ -0,0 +1,311 @@
+# delay scans at a series of sample temperatures, each started once the sample has settled
+import os
+import sys
+import time
+
+import numpy as np
+
+import acquisition
+import calibration
+import device_server
+import scan_engine
+import scan_planner
+import scan_queue
+
+
+class DriftMonitor:
+    """Decides when the sample has reached thermal equilibrium.
+
+    Temperatures are added as they are read; the drift is the slope of a
+    straight line fitted to the last window seconds. The sample counts as
+    settled once a full window is in, |drift| is below threshold (C/min) and,
+    if tolerance is given, the mean of the window is within tolerance of the
+    setpoint. Fitting a whole window keeps the thermistor noise from
+    triggering on a single lucky pair of readings."""
+
+    def __init__(self, window=60, threshold=0.05, tolerance=None):
+        self.window = window
+        self.threshold = threshold
+        self.tolerance = tolerance
+        self.times = []
+        self.temperatures = []
+
+    def reset(self):
+        self.times = []
+        self.temperatures = []
+
+    def add(self, t, temperature):
+
+        self.times.append(t)
+        self.temperatures.append(temperature)
+
+        # only the window is needed
+        while len(self.times) > 2 and self.times[-1] - self.times[1] >= self.window:
+            del self.times[0]
+            del self.temperatures[0]
+
+    @property
+    def full(self):
+        return len(self.times) > 2 and self.times[-1] - self.times[0] >= self.window
+
+    @property
+    def drift(self):
+        """dT/dt over the window (C/min)."""
+
+        if len(self.times) < 3:
+            return np.nan
+
+        t = np.array(self.times) - self.times[0]
+
+        return 60*np.polyfit(t, self.temperatures, 1)[0]
+
+    @property
+    def mean(self):
+        return np.mean(self.temperatures) if len(self.temperatures) > 0 else np.nan
+
+    def settled(self, setpoint=None):
+
+        if not self.full or abs(self.drift) >= self.threshold:
+            return False
+
+        return self.tolerance is None or setpoint is None or abs(self.mean - setpoint) < self.tolerance
+
+
+def setpoints(text, branches='both'):
+    """Setpoint list (C) from text like '30:80:5, 68' (scan_planner syntax)
+    as [(setpoint, branch)], branch +1 heating and -1 cooling. 'both' heats
+    through the list and cools back down without repeating the top point,
+    to trace the hysteresis loop."""
+
+    values = scan_planner.parse_segments(text)
+
+    heating = [(T, 1) for T in values]
+    cooling = [(T, -1) for T in values[::-1]]
+
+    if branches == 'heating':
+        return heating
+    if branches == 'cooling':
+        return cooling
+
+    return heating + cooling[1:]
+
+
+def read_temperature(daq, cal, channel=1, freq=400, quant=400):
+    """Sample temperature (C) from one burst of the thermistor divider."""
+
+    voltages = acquisition.burst(daq, freq, quant, 1, channel)
+
+    return float(np.mean(cal.voltage_to_temperature(voltages)))
+
+
+def manual_setpoint(setpoint):
+    # no heater control on the computer: someone sets it by hand
+    input('Set the heater to %.2f C and press Enter ' % setpoint)
+
+
+def heater(daq):
+    """The set_temperature hook for daq: its own (e.g. the simulator's) or
+    asking at the console."""
+
+    return getattr(daq, 'set_temperature', manual_setpoint)
+
+
+def wait_for_equilibrium(daq, cal, monitor, setpoint, channel=1, interval=2, timeout=1800, progress=print):
+    """Read the thermistor every interval seconds until monitor says the
+    sample has settled at setpoint or timeout seconds passed. Returns
+    (settled, seconds waited, last temperature)."""
+
+    monitor.reset()
+    start = time.perf_counter()
+
+    while True:
+        temperature = read_temperature(daq, cal, channel)
+        elapsed = time.perf_counter() - start
+        monitor.add(elapsed, temperature)
+
+        if progress is not None:
+            progress('  %.0f s  %.2f C  drift %.3f C/min' % (elapsed, temperature, monitor.drift))
+
+        if monitor.settled(setpoint):
+            return True, elapsed, temperature
+        if elapsed > timeout:
+            return False, elapsed, temperature
+
+        time.sleep(interval)
+
+
+def save_2d(basename, delays, rows, means, errors):
+    """basename.txt in the data_NN.txt layout with one (mean, SE) column
+    pair per temperature point instead of per loop, so scan_loader and the
+    fitting scripts read it as they are; basename_temperatures.txt lists
+    the points: index, branch, setpoint, T before and after the scan (C),
+    time to settle (s), settled flag and the scan number."""
+
+    if len(rows) == 0:
+        return False
+
+    data = np.empty([len(delays), 1 + 2*len(rows)])
+    data[:, 0] = delays
+    data[:, 1::2] = np.transpose(means)
+    data[:, 2::2] = np.transpose(errors)
+
+    header = 'delay (ps), then mean and SE (V) at ' + ', '.join('%.2f C' % row[3] for row in rows)
+    np.savetxt(basename + '.txt', data, header=header)
+    np.savetxt(basename + '_temperatures.txt', np.array(rows),
+               fmt=['%d', '%d', '%.3f', '%.3f', '%.3f', '%.1f', '%d', '%d'],
+               header='index branch setpoint T_before T_after settle_s settled scan')
+
+    return True
+
+
+def load_2d(basename):
+    """(points, delays, means, errors) of a saved temperature scan, the
+    arrays (temperature points x delays)."""
+
+    data = np.loadtxt(basename + '.txt', ndmin=2)
+    points = np.loadtxt(basename + '_temperatures.txt', ndmin=2)
+
+    return points, data[:, 0], data[:, 1::2].T, data[:, 2::2].T
+
+
+def loop_average(data):
+    """Mean over the loops of a data_NN array and its SE from the spread of
+    the loops. A single loop has no SE (NaN): the sample SD over sqrt(samples)
+    is far too small, the samples of a burst being correlated."""
+
+    means = data[:, 1::2]
+    if means.shape[1] > 1:
+        return means.mean(axis=1), means.std(axis=1, ddof=1)/np.sqrt(means.shape[1])
+
+    return means[:, 0], np.full(len(means), np.nan)
+
+
+def temperature_scan(stage, daq, params, points, basename, directory, cal, channel=1, monitor=None,
+                     set_temperature=None, interval=2, timeout=1800, fmt='txt', progress=print):
+    """For every (setpoint, branch) in points: set the temperature, wait for
+    equilibrium, run a delay scan (its own data_NN files in directory) and
+    add it to the 2D dataset saved at basename after every point, so an
+    interrupted run keeps what it had. Ctrl-C while waiting or scanning
+    stops after saving. Returns the number of points done. Every point needs
+    at least 2 loops for its SE."""
+
+    if params['loops'] < 2:
+        raise ValueError('a temperature scan needs at least 2 loops per point for the SE')
+    if monitor is None:
+        monitor = DriftMonitor()
+    if set_temperature is None:
+        set_temperature = heater(daq)
+
+    delays = scan_engine.positions(params)
+    rows, means, errors = [], [], []
+
+    for k, (setpoint, branch) in enumerate(points):
+        if progress is not None:
+            progress('%d/%d: %s to %.2f C' % (k + 1, len(points), 'heating' if branch > 0 else 'cooling', setpoint))
+
+        set_temperature(setpoint)
+        try:
+            settled, waited, before = wait_for_equilibrium(daq, cal, monitor, setpoint, channel, interval, timeout, progress)
+        except KeyboardInterrupt:
+            break
+
+        if not settled and progress is not None:
+            progress('  not settled after %.0f s (drift %.3f C/min), scanning anyway' % (waited, monitor.drift))
+
+        scan = scan_queue.next_scan_number(directory)
+        message = scan_engine.run_scan(stage, daq, params, os.path.join(directory, 'data_%02d' % scan), fmt,
+                                       progress=None)
+        if message[0] == 'error':
+            raise message[1]
+        if message[1] is None or scan_queue.loops_done(message[1]) == 0:
+            break # aborted before a loop was done
+
+        after = read_temperature(daq, cal, channel)
+        mean, se = loop_average(message[1]) # NaN SE if aborted after one loop
+
+        rows.append((k, branch, setpoint, before, after, waited, settled, scan))
+        means.append(mean)
+        errors.append(se)
+        save_2d(basename, delays, rows, means, errors)
+
+        if progress is not None:
+            progress('  scan %02d at %.2f -> %.2f C' % (scan, before, after))
+
+        if message[0] == 'aborted':
+            break
+
+    return len(rows)
+
+
+def main(argv=None):
+    """python temperature_scan.py --temperatures 30:80:5 --start -2 --end 10 --step 0.1"""
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Delay scans at a series of sample temperatures.')
+    parser.add_argument('--temperatures', required=True, help="setpoints (C), e.g. '30:60:5, 60:75:1'")
+    parser.add_argument('--branches', choices=['heating', 'cooling', 'both'], default='both',
+                        help='heat through the list, cool back down, or both for the hysteresis loop')
+    parser.add_argument('--start', type=float, help='scan start position (ps)')
+    parser.add_argument('--end', type=float, help='scan end position (ps)')
+    parser.add_argument('--step', type=float, help='scan step size (ps)')
+    parser.add_argument('--segments', help="non-uniform delay grid instead, e.g. '-5:0:0.5, 0:3:0.05, 10'")
+    parser.add_argument('--loops', type=int, default=2, help='loops per delay scan, at least 2 for the SE')
+    parser.add_argument('--freq', type=int, default=400, help='DAQ frequency (400-8192 Hz)')
+    parser.add_argument('--samples', type=int, default=400, help='DAQ samples per burst')
+    parser.add_argument('--averages', type=int, default=1, help='bursts averaged per step')
+    parser.add_argument('--wait', type=float, default=1, help='settle time after each move (s)')
+    parser.add_argument('--channels', default='1', help='DAQ channels (signal, reference)')
+    parser.add_argument('--normalize', choices=['ratio', 'difference'], help='normalize by the reference channel')
+    parser.add_argument('--thermistor', type=int, default=3, help='DAQ channel of the thermistor')
+    parser.add_argument('--calibration', default='calibration_20240208.csv', help='thermistor calibration file')
+    parser.add_argument('--window', type=float, default=60, help='drift window (s)')
+    parser.add_argument('--drift', type=float, default=0.05, help='settled below this drift (C/min)')
+    parser.add_argument('--tolerance', type=float, help='and within this of the setpoint (C)')
+    parser.add_argument('--interval', type=float, default=2, help='time between thermistor readings (s)')
+    parser.add_argument('--timeout', type=float, default=1800, help='longest wait for equilibrium (s)')
+    parser.add_argument('--dir', default='.', help='output directory')
+    parser.add_argument('--name', default='tscan', help='name of the 2D dataset, numbered like the scans')
+    parser.add_argument('--format', choices=['txt', 'hdf5'], default='txt', help='step log format')
+    parser.add_argument('--port', default='COM12', help='serial port of the stage')
+    parser.add_argument('--simulate', action='store_true', help='use the simulated stage and DAQ')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.segments is None and None in (args.start, args.end, args.step):
+        parser.error('give --start, --end and --step, or --segments')
+    if args.loops < 2:
+        parser.error('--loops must be at least 2, the SE comes from the spread of the loops')
+
+    params = {'start': args.start, 'end': args.end, 'step': args.step, 'loops': args.loops,
+              'freq': args.freq, 'quant': args.samples, 'avs': args.averages, 'wait': args.wait,
+              'streaming': False, 'mode': 'step'}
+    if args.segments is not None:
+        params['positions'] = scan_planner.parse_segments(args.segments)
+
+    channels = [int(c) for c in args.channels.split(',')]
+    if len(channels) > 1 or args.normalize is not None:
+        params['channels'] = channels
+        params['normalize'] = args.normalize
+
+    daq, stage, server = device_server.open_hardware(args)
+    if args.simulate:
+        daq.thermistor_channel = args.thermistor
+
+    number = 1
+    while os.path.exists(os.path.join(args.dir, '%s_%02d.txt' % (args.name, number))):
+        number += 1
+    basename = os.path.join(args.dir, '%s_%02d' % (args.name, number))
+
+    done = temperature_scan(stage, daq, params, setpoints(args.temperatures, args.branches), basename, args.dir,
+                            calibration.load(args.calibration), args.thermistor,
+                            DriftMonitor(args.window, args.drift, args.tolerance), interval=args.interval,
+                            timeout=args.timeout, fmt=args.format, progress=None if args.quiet else print)
+    device_server.close_hardware(stage, server)
+    print('%d temperature points in %s.txt' % (done, basename))
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import acquisition
+
+
+def test_loop_stats_matches_numpy():
+    rng = np.random.default_rng(1)
+    loops = rng.normal(size=(6, 20))
+
+    stats = acquisition.LoopStats()
+    for means in loops:
+        stats.add(means)
+
+    assert stats.n == 6
+    assert stats.mean == pytest.approx(loops.mean(axis=0))
+    assert stats.sd == pytest.approx(loops.std(axis=0, ddof=1))
+    assert stats.se == pytest.approx(loops.std(axis=0, ddof=1)/np.sqrt(6))
+
+
+def test_loop_stats_drift():
+    stats = acquisition.LoopStats()
+    stats.add(np.zeros(10))
+    stats.add(np.full(10, 0.5))
+
+    assert stats.drift == pytest.approx(0.5)
+
+
+def test_hardware_channels():
+    assert acquisition.hardware_channels([1, 0, 3]) == [1, 0, 3, 3]
+    assert acquisition.hardware_channels([1, 0]) == [1, 0]
+    with pytest.raises(ValueError):
+        acquisition.hardware_channels([0, 1, 2, 3, 4])
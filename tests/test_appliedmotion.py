@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import scan_engine
+from appliedmotion import move_profile
+from simulated import SimulatedAppliedMotion, SimulatedU12
+
+
+def stage():
+    stage = SimulatedAppliedMotion('SIM')
+    stage.initialize()
+
+    return stage
+
+
+def test_backlash_overshoots_positive_moves():
+    s = stage()
+    s.set_backlash(0.5)
+
+    s.move(2.0)
+    assert s.steps == s.ps_to_steps(2.5)
+    s.wait_until_stopped()
+    assert s.position() == pytest.approx(2.0, abs=1e-3)
+
+    s.move(1.0)
+    assert s.steps == s.ps_to_steps(1.0)
+    s.wait_until_stopped()
+    assert s.position() == pytest.approx(1.0, abs=1e-3)
+
+
+def test_move_to_the_same_place_sends_nothing():
+    s = stage()
+    s.move(1.0)
+    s.wait_until_stopped()
+
+    written = []
+    write = s.serial_port.write
+    s.serial_port.write = lambda data: written.append(data) or write(data)
+    s.move(1.0)
+
+    assert written == []
+
+
+def test_move_profile():
+    t = np.linspace(0, 10, 1001)
+
+    travelled, tend = move_profile(t, 2.0, 1.0, 10, 15)
+    assert travelled[-1] == pytest.approx(2.0)
+    assert np.all(np.diff(travelled) >= 0)
+    assert tend == pytest.approx(2.0 + 0.5*(1/10 + 1/15))
+
+    # too short to reach full speed
+    assert move_profile(t, 0.01, 1.0, 10, 15)[1] < 0.1
+
+
+def test_serpentine_scan_with_backlash(tmp_path):
+    s = stage()
+    s.set_backlash(0.2)
+    daq = SimulatedU12(stage=s, overhead=0.001, seed=9)
+    params = {'start': -1.0, 'end': 1.0, 'step': 0.5, 'loops': 2, 'freq': 400, 'quant': 200, 'avs': 1,
+              'wait': 0, 'streaming': False, 'mode': 'step', 'serpentine': True}
+
+    message = scan_engine.run_scan(s, daq, params, str(tmp_path/'data_01'), progress=None)
+
+    # both directions land on the same delays, so the loops agree
+    assert message[0] == 'done'
+    assert message[1][:, 1] == pytest.approx(message[1][:, 3], abs=5*np.max(message[1][:, 2]))
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import acquisition
+import autotune
+from simulated import SimulatedU12
+
+
+def test_correlation_factor_of_white_noise():
+    rng = np.random.default_rng(3)
+    acf = autotune.autocorrelation(rng.normal(size=(8, 2048)))[0]
+
+    assert autotune.correlation_factor(acf) == pytest.approx(1, abs=0.3)
+
+
+def test_recommendation_reaches_the_target():
+    best = autotune.recommend({1024: (1e-4, 1.0, 0.0)}, 0.02, 1e-4)
+
+    assert best[4] <= 1e-4
+    assert autotune.predicted_se((1e-4, 1.0, 0.0), best[1], best[2]) == pytest.approx(best[4])
+
+
+@pytest.mark.parametrize('channels', [[1], [1, 0], [1, 0, 3]])
+def test_tune_stays_within_the_u12_limits(channels):
+    daq = SimulatedU12(overhead=0.001, seed=4)
+    freq, quant, avs, seconds, se = autotune.tune(daq, 1e-5, channels, bursts=2, freqs=(1024, 2048))[0]
+    nread = len(acquisition.hardware_channels(channels))
+
+    assert quant*nread <= autotune.MAX_SAMPLES
+    assert freq*nread <= autotune.MAX_RATE
+    assert quant < freq # under the 1 s aiBurst timeout
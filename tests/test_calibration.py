@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+import calibration
+
+
+def test_table_points_are_exact():
+    cal = calibration.load('calibration_20240208.csv')
+
+    assert cal.temperature(cal.resistance) == pytest.approx(cal.temperature_table)
+
+
+def test_monotone_and_clipped():
+    cal = calibration.load('calibration_20240208.csv')
+    r = np.geomspace(cal.resistance[0], cal.resistance[-1], 500)
+    t = cal.temperature(r)
+
+    # an NTC thermistor: colder at higher resistance, without overshoot
+    assert np.all(np.diff(t) <= 0)
+    assert cal.temperature(cal.resistance[0]/2) == pytest.approx(t[0])
+    assert cal.temperature(cal.resistance[-1]*2) == pytest.approx(t[-1])
+
+
+def test_voltage_arrays():
+    cal = calibration.load('calibration_20240208.csv')
+    voltages = np.linspace(1, 4, 7)
+
+    assert cal.voltage_to_temperature(voltages) == pytest.approx(
+        [float(cal.voltage_to_temperature(v)) for v in voltages])
+
+
+def test_load_is_cached():
+    assert calibration.load('calibration_20240208.csv') is calibration.load('calibration_20240208.csv')
@@ -0,0 +1,100 @@
+import argparse
+import threading
+
+import pytest
+
+import device_server
+from simulated import SimulatedAppliedMotion, SimulatedU12
+
+
+@pytest.fixture
+def server():
+    stage = SimulatedAppliedMotion('SIM')
+    server = device_server.DeviceServer(SimulatedU12(stage=stage, overhead=0.001), stage, ('localhost', 0))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.close()
+
+
+def client(server):
+    return device_server.connect(server.listener.address)
+
+
+def test_calls_reach_the_devices(server):
+    daq, stage, remote = client(server)
+
+    stage.set_backlash(0.5)
+    stage.move(1.0)
+
+    assert server.targets['stage'].backlash == 0.5
+    assert stage.target == 1.0
+    assert daq.aiBurst(1, [1], 400, 16)['voltages'].shape[0] == 16
+
+
+def test_lease_keeps_other_clients_off_the_stage(server):
+    daq, stage, remote = client(server)
+    other = client(server)[1]
+
+    device_server.lease(stage)
+    stage.move(1.0)
+    with pytest.raises(RuntimeError):
+        other.move(2.0)
+
+    device_server.release(stage)
+    other.move(2.0)
+
+
+def test_lease_ends_with_the_connection(server):
+    stage = client(server)[1]
+    other = client(server)[1]
+
+    device_server.lease(stage)
+    stage._client.close()
+    for attempt in range(100):
+        try:
+            other.move(2.0)
+            break
+        except RuntimeError:
+            threading.Event().wait(0.01)
+
+    assert server.lease is None
+
+
+def test_stream_stops_with_its_last_user(server):
+    a = client(server)
+    b = client(server)
+
+    stream_a = a[2].open_stream([1], 1200, 5)
+    stream_b = b[2].open_stream([1], 1200, 5)
+    with pytest.raises(RuntimeError):
+        a[0].aiBurst(1, [1], 400, 16) # no bursts between the stream reads
+
+    stream_a.stop()
+    assert stream_b.next(120, timeout=5).shape == (120, 1)
+
+    stream_b.stop()
+    assert server.streaming() is None
+
+
+def test_read_channel_uses_the_shared_stream(server):
+    daq, stage, remote = client(server)
+    assert device_server.read_channel(daq, remote, 400, 40).shape == (1, 40)
+
+    other = client(server)
+    stream = other[2].open_stream([0, 1], 1200, 5)
+
+    assert device_server.read_channel(daq, remote, 400, 40, channel=1).shape == (1, 40)
+    with pytest.raises(RuntimeError):
+        device_server.read_channel(daq, remote, 400, 40, channel=3)
+
+    stream.stop()
+
+
+def test_open_hardware_without_a_server():
+    args = argparse.Namespace(simulate=True, port='SIM')
+
+    daq, stage, server = device_server.open_hardware(args, shared=False)
+    assert server is None and isinstance(stage, SimulatedAppliedMotion)
+    device_server.close_hardware(stage, server)
+
+    assert device_server.open_hardware(args, with_stage=False, shared=False)[1] is None
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+import lockin
+import scan_engine
+from simulated import SimulatedAppliedMotion, SimulatedU12
+
+FREQ = 4096
+N = 1024
+
+
+def chopped(amplitude, phase, chopper=256, bursts=8, noise=0.0, seed=5):
+    rng = np.random.default_rng(seed)
+    t = np.arange(N)/FREQ
+    signal = 1 + amplitude*np.cos(2*np.pi*chopper*t + phase) + rng.normal(0, noise, (bursts, N))
+    # 0-5 V chopper reference, high around the signal maxima (round-off kept out of the edges)
+    reference = np.tile(5.0*(np.cos(2*np.pi*chopper*t) > 1e-9), (bursts, 1))
+
+    return signal, reference
+
+
+def test_known_chopper_frequency():
+    signal = chopped(0.01, 0.7)[0]
+
+    x, y, r, theta, sd, se = lockin.lockin_stats(lockin.demodulate(signal, FREQ, chopper=256), referenced=False)
+
+    assert r == pytest.approx(0.01, rel=0.02)
+    assert np.isnan(theta)
+
+
+def test_reference_channel_gives_the_phase():
+    signal, reference = chopped(0.01, 0.7)
+
+    x, y, r, theta, sd, se = lockin.lockin_stats(lockin.demodulate(signal, FREQ, reference=reference))
+
+    assert r == pytest.approx(0.01, rel=0.05)
+    assert theta == pytest.approx(0.7, abs=0.05)
+
+
+def test_noise_averages_down():
+    signal, reference = chopped(0.0, 0.0, bursts=64, noise=0.01)
+
+    x, y, r, theta, sd, se = lockin.lockin_stats(lockin.demodulate(signal, FREQ, reference=reference))
+
+    assert r < 3*se
+    assert se == pytest.approx(sd/8)
+
+
+def test_needs_a_reference():
+    with pytest.raises(ValueError):
+        lockin.demodulate(np.zeros((2, 16)), FREQ)
+
+
+def test_lockin_scan_on_the_simulator(tmp_path):
+    stage = SimulatedAppliedMotion('SIM')
+    stage.initialize()
+    daq = SimulatedU12(stage=stage, overhead=0.001, seed=6)
+    daq.chopper = 500
+    params = {'start': -1.0, 'end': 1.0, 'step': 1.0, 'loops': 1, 'freq': 4096, 'quant': 1024, 'avs': 2,
+              'wait': 0, 'streaming': False, 'mode': 'step', 'channels': [1, 2], 'lockin': 'reference'}
+
+    message = scan_engine.run_scan(stage, daq, params, str(tmp_path/'data_01'), progress=None)
+
+    assert message[0] == 'done'
+    assert np.all(message[1][:, 1] > 0)
+    assert message[1][2, 1] > message[1][0, 1] # pumped after time zero
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import raw_archive
+import scan_engine
+from simulated import SimulatedAppliedMotion, SimulatedU12
+
+
+def test_slots_write_through_to_the_file(tmp_path):
+    basename = str(tmp_path/'data_01')
+    archive = raw_archive.RawArchive(basename, 2, 3, 4, 16, 2)
+    archive.slot(1, 2)[...] = 0.25
+    archive.close()
+
+    raw = raw_archive.load(basename + '_raw.npy')
+    assert raw.shape == (2, 3, 4, 16, 2) and raw.dtype == np.float32
+    assert np.all(raw[1, 2] == 0.25) and np.all(raw[0] == 0)
+
+
+def test_resume_keeps_the_samples(tmp_path):
+    basename = str(tmp_path/'data_01')
+    archive = raw_archive.RawArchive(basename, 1, 2, 1, 8)
+    archive.slot(0, 0)[...] = 1
+    archive.close()
+
+    archive = raw_archive.RawArchive(basename, 1, 2, 1, 8, resume=True)
+    assert np.all(archive.slot(0, 0) == 1)
+    archive.close()
+
+    with pytest.raises(ValueError):
+        raw_archive.RawArchive(basename, 1, 3, 1, 8, resume=True)
+
+
+def test_restats_rejects_outlier_bursts():
+    rng = np.random.default_rng(7)
+    raw = rng.normal(1, 0.01, (1, 2, 10, 64, 1)).astype(np.float32)
+    raw[0, 1, 3] += 1 # one burst hit by a glitch
+
+    means, sds = raw_archive.restats(raw)
+    assert means[0, 1] == pytest.approx(1.1, abs=0.01)
+
+    means, sds = raw_archive.restats(raw, reject=3)
+    assert means[0] == pytest.approx([1, 1], abs=0.01)
+
+
+def test_scan_archive_matches_the_step_means(tmp_path):
+    stage = SimulatedAppliedMotion('SIM')
+    stage.initialize()
+    daq = SimulatedU12(stage=stage, overhead=0.001, seed=8)
+    params = {'start': -1.0, 'end': 1.0, 'step': 1.0, 'loops': 1, 'freq': 400, 'quant': 40, 'avs': 2,
+              'wait': 0, 'streaming': False, 'mode': 'step'}
+
+    message = scan_engine.run_scan(stage, daq, params, str(tmp_path/'data_01'), progress=None, raw=True)
+    means = raw_archive.restats(raw_archive.load(str(tmp_path/'data_01_raw.npy')))[0]
+
+    assert message[0] == 'done'
+    assert means[0] == pytest.approx(message[1][:, 1], abs=1e-6)
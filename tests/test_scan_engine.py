@@ -0,0 +1,179 @@
+import importlib.util
+
+import numpy as np
+import pytest
+
+import scan_engine
+import scan_writer
+from simulated import SimulatedAppliedMotion, SimulatedU12
+from stream import StreamAcquisition
+
+PARAMS = {'start': -1.0, 'end': 1.0, 'step': 0.5, 'loops': 1, 'freq': 400, 'quant': 40, 'avs': 1, 'wait': 0,
+          'streaming': False, 'mode': 'step'}
+
+
+def hardware(daq=SimulatedU12):
+    stage = SimulatedAppliedMotion('SIM')
+    stage.initialize()
+
+    return stage, daq(stage=stage, overhead=0.001, seed=1)
+
+
+def test_fly_scan(tmp_path):
+    stage, daq = hardware()
+    velocity = stage.ve
+
+    message = scan_engine.run_scan(stage, daq, dict(PARAMS, mode='fly'), str(tmp_path/'data_01'), progress=None)
+
+    assert message[0] == 'done'
+    assert message[1].shape == (5, 3)
+    assert np.all(np.isfinite(message[1][:, 1]))
+    assert stage.ve == velocity
+
+
+def test_fly_scan_too_slow_for_the_drive(tmp_path):
+    stage, daq = hardware()
+    params = dict(PARAMS, start=0, end=0.05, step=0.01, quant=400, avs=10, mode='fly')
+
+    message = scan_engine.run_scan(stage, daq, params, str(tmp_path/'data_01'), progress=None)
+
+    assert message[0] == 'error' and isinstance(message[1], ValueError)
+
+
+def test_fly_scan_over_the_stream_rate(tmp_path):
+    stage, daq = hardware()
+    params = dict(PARAMS, freq=400, channels=[1, 0, 3], mode='fly') # read as 4 channels
+
+    message = scan_engine.run_scan(stage, daq, params, str(tmp_path/'data_01'), progress=None)
+
+    assert message[0] == 'error' and 'samples/s' in str(message[1])
+
+
+class FailingU12(SimulatedU12):
+
+    def aiStreamRead(self, numScans, *args, **kwargs):
+        raise IOError('unplugged')
+
+
+def test_fly_scan_restores_the_velocity(tmp_path):
+    stage, daq = hardware(FailingU12)
+    velocity = stage.ve
+
+    message = scan_engine.run_scan(stage, daq, dict(PARAMS, mode='fly'), str(tmp_path/'data_01'), progress=None)
+
+    assert message[0] == 'error'
+    assert stage.ve == velocity
+
+
+class OverflowingU12(SimulatedU12):
+
+    def aiStreamRead(self, numScans, *args, **kwargs):
+        reply = super(OverflowingU12, self).aiStreamRead(numScans, *args, **kwargs)
+        reply['ljScanBacklog'] = 5 # over the stream's maxbacklog, so scans are dropped
+
+        return reply
+
+
+def finish(worker):
+    """Run a ScanWorker to the end; its last message."""
+
+    worker.start()
+    worker.join(60)
+    messages = []
+    while not worker.results.empty():
+        messages.append(worker.results.get())
+
+    return messages[-1]
+
+
+def test_fly_scan_on_a_stream_that_loses_samples():
+    stage, daq = hardware(OverflowingU12)
+    stream = StreamAcquisition(daq, [1], 400, maxbacklog=4)
+    stream.start()
+
+    message = finish(scan_engine.ScanWorker(stage, daq, dict(PARAMS, mode='fly'), stream=stream))
+    stream.stop()
+
+    assert message[0] == 'error' and 'lost samples' in str(message[1])
+
+
+def test_fly_scan_on_a_running_stream():
+    stage, daq = hardware()
+    stream = StreamAcquisition(daq, [1], 400)
+    stream.start()
+
+    message = finish(scan_engine.ScanWorker(stage, daq, dict(PARAMS, mode='fly'), stream=stream))
+    stream.stop()
+
+    assert message[0] == 'done'
+    assert np.all(np.isfinite(message[1][:, 1]))
+
+
+def test_step_scan():
+    stage, daq = hardware()
+    params = dict(PARAMS, loops=2)
+
+    worker = scan_engine.ScanWorker(stage, daq, params)
+    message = finish(worker)
+
+    assert message[0] == 'done'
+    assert message[1].shape == (5, 5) # delay, then mean and sd per loop
+    assert list(message[1][:, 0]) == list(scan_engine.positions(params))
+    assert worker.timer.steps == 10
+    assert stage.target == 0 # back at zero
+
+
+def test_step_scan_messages():
+    stage, daq = hardware()
+
+    worker = scan_engine.ScanWorker(stage, daq, PARAMS)
+    worker.start()
+    worker.join(60)
+    kinds = [message[0] for message in list(worker.results.queue)]
+
+    assert kinds == ['step']*5 + ['loop', 'stats', 'done']
+
+
+def test_abort():
+    stage, daq = hardware()
+
+    worker = scan_engine.ScanWorker(stage, daq, dict(PARAMS, loops=100))
+    worker.start()
+    assert worker.results.get(timeout=10)[0] == 'step'
+    worker.abort()
+    worker.join(10)
+    messages = list(worker.results.queue)
+
+    assert not worker.is_alive()
+    assert messages[-1][0] == 'aborted'
+
+
+def test_resume_replays_the_logged_steps(tmp_path):
+    stage, daq = hardware()
+    basename = str(tmp_path/'data_01')
+    params = dict(PARAMS, loops=2)
+
+    writer = scan_writer.ScanWriter(basename, layout=scan_engine.layout(params))
+    for x, position in enumerate(scan_engine.positions(params)):
+        writer.write(0, x, position, 0.5 + x, 0.01)
+    writer.close()
+
+    writer = scan_writer.ScanWriter(basename, resume=True, layout=scan_engine.layout(params))
+    worker = scan_engine.ScanWorker(stage, daq, params, writer=writer, resume=True)
+    message = finish(worker)
+    replayed = [m for m in list(worker.results.queue) if m[0] == 'replay']
+
+    assert message[0] == 'done'
+    assert worker.timer.steps == 5 # only the second loop was measured
+    assert list(message[1][:, 1]) == [0.5 + x for x in range(5)]
+    assert len(scan_writer.read_steps(basename + '_steps.txt')) == 10
+
+
+def test_run_scan_without_pytables(tmp_path):
+    if importlib.util.find_spec('tables') is not None:
+        pytest.skip('pytables is installed')
+    stage, daq = hardware()
+
+    message = scan_engine.run_scan(stage, daq, PARAMS, str(tmp_path/'data_01'), 'hdf5', progress=None)
+
+    assert message[0] == 'error' and isinstance(message[1], ImportError)
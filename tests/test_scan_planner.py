@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+import scan_planner
+
+
+def test_ranges_and_points():
+    positions = scan_planner.parse_segments('-1:0:0.5, 0:0.2:0.1, 5')
+
+    assert positions == pytest.approx([-1, -0.5, 0, 0.1, 0.2, 5])
+
+
+def test_sorted_without_repeats():
+    positions = scan_planner.parse_segments('3, 0:1:0.5, 1, ,0.5')
+
+    assert positions == pytest.approx([0, 0.5, 1, 3])
+    assert np.all(np.diff(positions) > 0)
+
+
+def test_format_round_trip():
+    positions = scan_planner.parse_segments('-5:0:0.5, 0:3:0.05, 10')
+
+    assert scan_planner.parse_segments(scan_planner.format_segments(positions)) == pytest.approx(positions)
@@ -0,0 +1,57 @@
+import pytest
+
+import scan_queue
+
+PARAMS = {'start': 0, 'end': 1, 'step': 0.5, 'loops': 1, 'freq': 400, 'quant': 400, 'avs': 1, 'wait': 0}
+
+
+def test_first_in_first_out(tmp_path):
+    queue = scan_queue.ScanQueue(str(tmp_path/'queue.json'))
+    ids = [queue.add(dict(PARAMS, loops=n)) for n in (1, 2, 3)]
+
+    assert [job['id'] for job in queue.pending()] == ids
+    assert queue.next()['id'] == ids[0]
+
+
+def test_move_and_cancel(tmp_path):
+    queue = scan_queue.ScanQueue(str(tmp_path/'queue.json'))
+    a, b, c = (queue.add(PARAMS) for n in range(3))
+
+    queue.move(c, -1)
+    assert [job['id'] for job in queue.pending()] == [a, c, b]
+    queue.move(a, 1)
+    assert [job['id'] for job in queue.pending()] == [c, a, b]
+    queue.move(b, 1) # already last
+    assert [job['id'] for job in queue.pending()] == [c, a, b]
+
+    queue.cancel(a)
+    assert [job['id'] for job in queue.pending()] == [c, b]
+
+
+def test_started_jobs_leave_the_queue(tmp_path):
+    path = str(tmp_path/'queue.json')
+    queue = scan_queue.ScanQueue(path)
+    a, b = queue.add(PARAMS), queue.add(PARAMS)
+
+    job = queue.start(queue.next(), 1)
+    assert queue.next()['id'] == b
+    with pytest.raises(ValueError):
+        queue.start(job, 2)
+
+    # seen the same way by another program, which cannot take it either
+    other = scan_queue.ScanQueue(path)
+    assert other.next()['id'] == b
+    with pytest.raises(ValueError):
+        other.cancel(a)
+
+    queue.finish(job, 'done', 1)
+    assert queue.job(a)['status'] == 'done'
+
+
+def test_order_survives_reload(tmp_path):
+    path = str(tmp_path/'queue.json')
+    queue = scan_queue.ScanQueue(path)
+    a, b = queue.add(PARAMS), queue.add(PARAMS)
+    queue.move(b, -1)
+
+    assert [job['id'] for job in scan_queue.ScanQueue(path).pending()] == [b, a]
@@ -0,0 +1,65 @@
+import os
+
+import pytest
+
+import scan_writer
+
+LAYOUT = {'positions': [0.0, 0.5, 1.0], 'loops': 2, 'channels': [1]}
+
+
+def test_resume_keeps_steps(tmp_path):
+    basename = str(tmp_path/'data_01')
+
+    writer = scan_writer.ScanWriter(basename, layout=LAYOUT)
+    writer.write(0, 0, 0.0, 0.5, 0.01)
+    writer.write(0, 1, 0.5, 0.6, 0.02)
+    writer.close()
+
+    writer = scan_writer.ScanWriter(basename, resume=True, layout=LAYOUT)
+    completed = writer.completed()
+    writer.close()
+
+    assert sorted(completed) == [(0, 0), (0, 1)]
+    assert completed[(0, 1)] == pytest.approx((0.6, 0.02))
+
+
+def test_no_resume_starts_over(tmp_path):
+    basename = str(tmp_path/'data_01')
+
+    writer = scan_writer.ScanWriter(basename, layout=LAYOUT)
+    writer.write(0, 0, 0.0, 0.5, 0.01)
+    writer.close()
+
+    writer = scan_writer.ScanWriter(basename, layout=LAYOUT)
+    assert writer.completed() == {}
+    writer.close()
+
+
+def test_resume_drops_partial_line(tmp_path):
+    basename = str(tmp_path/'data_01')
+
+    writer = scan_writer.ScanWriter(basename, layout=LAYOUT)
+    writer.write(0, 0, 0.0, 0.5, 0.01)
+    writer.close()
+    with open(writer.path, 'a') as f:
+        f.write('0 1 0.5 0.6') # cut short by a crash
+
+    writer = scan_writer.ScanWriter(basename, resume=True, layout=LAYOUT)
+    writer.write(0, 1, 0.5, 0.6, 0.02)
+    steps = writer.load()
+    writer.close()
+
+    assert list(steps['step']) == [0, 1]
+
+
+@pytest.mark.parametrize('change', [{'positions': [0.0, 0.5]}, {'loops': 3}, {'channels': [1, 0]}])
+def test_resume_refuses_other_layout(tmp_path, change):
+    basename = str(tmp_path/'data_01')
+
+    writer = scan_writer.ScanWriter(basename, layout=LAYOUT)
+    writer.write(0, 0, 0.0, 0.5, 0.01)
+    writer.close()
+
+    with pytest.raises(ValueError):
+        scan_writer.ScanWriter(basename, resume=True, layout=dict(LAYOUT, **change))
+    assert os.path.exists(writer.path)
@@ -0,0 +1,94 @@
+import time
+
+import numpy as np
+import pytest
+
+from simulated import SimulatedU12
+from stream import StreamAcquisition
+
+
+class FakeU12:
+    """Stream reads of a counting signal, with a chosen backlog and failures."""
+
+    def __init__(self, backlog=0, failures=0):
+        self.backlog = backlog
+        self.failures = failures
+        self.started = None
+        self.next = 0
+
+    def aiStreamStart(self, numChannels, channels, scanRate, *args, **kwargs):
+        self.started = (numChannels, list(channels), scanRate)
+
+    def aiStreamRead(self, numScans, *args, **kwargs):
+        time.sleep(0.005)
+        if self.failures > 0:
+            self.failures -= 1
+            raise IOError('read failed')
+
+        voltages = np.repeat(np.arange(self.next, self.next + numScans, dtype=float)[:, np.newaxis], 4, axis=1)
+        self.next += numScans
+
+        return {'voltages': voltages, 'ljScanBacklog': self.backlog}
+
+    def aiStreamClear(self, *args, **kwargs):
+        pass
+
+
+def test_ring_buffer_keeps_the_latest_samples():
+    stream = StreamAcquisition(FakeU12(), [1], freq=100, seconds=1, chunk=30)
+    stream.start()
+    stream.wait_for(250, timeout=5)
+    stream.stop()
+
+    count = stream.count
+    assert list(stream.latest(5)[:, 0]) == list(range(count - 5, count))
+    assert list(stream.read(count - 100, 100)[:, 0]) == list(range(count - 100, count)) # wraps around
+    with pytest.raises(IndexError):
+        stream.read(count - 101, 1)
+    with pytest.raises(IndexError):
+        stream.read(count, 1)
+
+
+def test_three_channels_stream_as_four():
+    daq = FakeU12()
+    stream = StreamAcquisition(daq, [1, 0, 3], freq=100, seconds=1, chunk=10)
+    stream.start()
+    samples = stream.next(10, timeout=5)
+    stream.stop()
+
+    assert daq.started[0:2] == (4, [1, 0, 3, 3])
+    assert samples.shape == (10, 3)
+
+
+def test_index_at_follows_the_backlog():
+    stream = StreamAcquisition(FakeU12(backlog=500), [1], freq=100, seconds=10, chunk=10)
+    stream.start()
+    stream.wait_for(30, timeout=5)
+    index = stream.index_at(time.perf_counter())
+    count = stream.count
+    stream.stop()
+
+    # the U12 already holds the backlog beyond what was read
+    assert count + 500 - 10 <= index <= count + 500 + 20
+
+
+def test_gives_up_after_repeated_failures():
+    stream = StreamAcquisition(FakeU12(failures=100), [1], freq=100, seconds=1, chunk=10, maxfailures=3)
+    stream.start()
+
+    with pytest.raises(RuntimeError):
+        stream.wait_for(10, timeout=5)
+    assert not stream.running
+    assert stream.readerrors == 3
+    assert isinstance(stream.failure, IOError)
+    stream.stop()
+
+
+def test_simulated_rate():
+    stream = StreamAcquisition(SimulatedU12(overhead=0.001), [1], freq=1200, seconds=2)
+    stream.start()
+    stream.wait_for(600, timeout=5)
+    stream.stop()
+
+    assert stream.rate() == pytest.approx(1200, rel=0.2)
+    assert stream.missed == 0
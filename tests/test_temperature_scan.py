@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import calibration
+import temperature_scan
+from simulated import SimulatedAppliedMotion, SimulatedU12
+
+
+def test_drift_monitor_waits_for_a_full_flat_window():
+    monitor = temperature_scan.DriftMonitor(window=60, threshold=0.05, tolerance=0.5)
+    for t in range(0, 60, 2):
+        monitor.add(t, 30 + 0.01*t) # 0.6 C/min
+
+    assert not monitor.full
+    monitor.add(62, 30.62)
+    assert monitor.full
+    assert monitor.drift == pytest.approx(0.6)
+    assert not monitor.settled()
+
+    monitor.reset()
+    for t in range(0, 64, 2):
+        monitor.add(t, 40.0)
+    assert monitor.settled(40.2)
+    assert not monitor.settled(41) # flat, but not at the setpoint
+
+
+def test_setpoints_trace_the_hysteresis_loop():
+    assert temperature_scan.setpoints('30:40:5') == [(30, 1), (35, 1), (40, 1), (35, -1), (30, -1)]
+    assert temperature_scan.setpoints('30:40:5', 'cooling') == [(40, -1), (35, -1), (30, -1)]
+
+
+def test_loop_average():
+    data = np.array([[0.0, 1.0, 0.1, 3.0, 0.1],
+                     [1.0, 2.0, 0.1, 2.0, 0.1]])
+
+    mean, se = temperature_scan.loop_average(data)
+    assert mean == pytest.approx([2, 2])
+    assert se == pytest.approx([1, 0])
+
+    # one loop: no SE rather than sd/sqrt(samples)
+    mean, se = temperature_scan.loop_average(data[:, 0:3])
+    assert mean == pytest.approx([1, 2])
+    assert np.all(np.isnan(se))
+
+
+def test_temperature_scan_on_the_simulator(tmp_path, monkeypatch):
+    # 0.1 s thermistor bursts instead of 1 s
+    read_temperature = temperature_scan.read_temperature
+    monkeypatch.setattr(temperature_scan, 'read_temperature',
+                        lambda daq, cal, channel=1: read_temperature(daq, cal, channel, quant=40))
+    stage = SimulatedAppliedMotion('SIM')
+    stage.initialize()
+    daq = SimulatedU12(stage=stage, overhead=0.001, seed=10)
+    daq.thermistor_channel = 3
+    daq.thermal_tau = 0.01 # settles at once
+    params = {'start': -1.0, 'end': 1.0, 'step': 1.0, 'loops': 2, 'freq': 400, 'quant': 40, 'avs': 1,
+              'wait': 0, 'streaming': False, 'mode': 'step'}
+    monitor = temperature_scan.DriftMonitor(window=0.3, threshold=10)
+
+    done = temperature_scan.temperature_scan(stage, daq, params, [(30, 1), (35, 1)], str(tmp_path/'tscan_01'),
+                                             str(tmp_path), calibration.load('calibration_20240208.csv'), 3,
+                                             monitor, interval=0.05, progress=None)
+    points, delays, means, errors = temperature_scan.load_2d(str(tmp_path/'tscan_01'))
+
+    assert done == 2
+    assert list(delays) == [-1, 0, 1]
+    assert means.shape == (2, 3) and np.all(np.isfinite(errors))
+    assert points[:, 3] == pytest.approx([30, 35], abs=1)
+
+    with pytest.raises(ValueError):
+        temperature_scan.temperature_scan(stage, daq, dict(params, loops=1), [(30, 1)], str(tmp_path/'tscan_02'),
+                                          str(tmp_path), calibration.load('calibration_20240208.csv'))
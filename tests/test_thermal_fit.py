@@ -0,0 +1,27 @@
+import numpy as np
+
+import thermal_fit
+
+
+def test_recovers_equilibrium():
+    rng = np.random.default_rng(2)
+    fit = thermal_fit.ExponentialFit()
+    t = np.arange(0, 600, 2.0)
+    for ti, T in zip(t, 60 - 30*np.exp(-t/120) + rng.normal(0, 0.02, len(t))):
+        fit.add(ti, T)
+
+    tinf, se, tau = fit.solve()
+
+    assert abs(tinf - 60) < 5*se
+    assert se < 0.1
+    assert fit.tau_range[0] < 120 < fit.tau_range[1]
+    assert fit.converged(0.1)
+
+
+def test_straight_line_is_unknown():
+    fit = thermal_fit.ExponentialFit()
+    for ti in range(20):
+        fit.add(float(ti), 30 + 0.01*ti)
+
+    assert np.isinf(fit.solve()[1])
+    assert not fit.converged(1)
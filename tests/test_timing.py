@@ -0,0 +1,16 @@
+import numpy as np
+
+import timing
+
+
+def test_format_eta():
+    assert timing.format_eta(np.nan) == '--'
+    assert timing.format_eta(0) == '0:00:00'
+    assert timing.format_eta(3725.6) == '1:02:05'
+
+
+def test_eta_before_there_is_a_rate():
+    timer = timing.PhaseTimer(['read'], total=10)
+
+    assert np.isnan(timer.eta())
+    assert timing.format_eta(timer.eta()) == '--'
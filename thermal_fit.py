@@ -0,0 +1,118 @@
+# online fit of an exponential approach to equilibrium, T(t) = Tinf + A*exp(-t/tau)
+import numpy as np
+
+
+class ExponentialFit:
+    """Refits T(t) = Tinf + A*exp(-t/tau) as every reading arrives.
+
+    For a fixed tau the model is linear in Tinf and A, so a bank of tau
+    candidates (log-spaced, taus in s) each keeps the running sums of a
+    two-parameter least-squares fit; a new reading updates them all in
+    O(len(taus)) and nothing is refitted from scratch. The best tau is the
+    candidate with the smallest residual sum of squares.
+
+    The minimum is refined with a parabola in log(tau) through the best
+    candidate and its neighbours. Uncertainties come from that profile: the
+    taus whose residuals are within one noise variance of the minimum form
+    the 1-sigma range of tau, and the change of Tinf across it is added in
+    quadrature to the SE of Tinf at fixed tau. A best tau on the edge of the
+    bank (e.g. still a straight line) leaves Tinf unknown, with an infinite
+    SE."""
+
+    def __init__(self, taus=None):
+        self.taus = np.geomspace(1, 1e4, 400) if taus is None else np.asarray(taus, dtype=float)
+
+        self.n = 0
+        self.t0 = None
+        self.T0 = None # readings are stored relative to the first, against round-off
+
+        # sums of 1, e, e^2, T, e*T and T^2 with e = exp(-t/tau)
+        self.se1 = np.zeros(len(self.taus))
+        self.se2 = np.zeros(len(self.taus))
+        self.sT = 0.0
+        self.seT = np.zeros(len(self.taus))
+        self.sT2 = 0.0
+
+        self.tinf = np.nan
+        self.tinf_se = np.inf
+        self.amplitude = np.nan
+        self.tau = np.nan
+        self.tau_range = (np.nan, np.nan)
+        self.noise = np.nan
+
+    def add(self, t, temperature):
+
+        if self.n == 0:
+            self.t0 = t
+            self.T0 = temperature
+
+        e = np.exp(-(t - self.t0)/self.taus)
+        T = temperature - self.T0
+
+        self.n += 1
+        self.se1 += e
+        self.se2 += e*e
+        self.sT += T
+        self.seT += e*T
+        self.sT2 += T*T
+
+    def solve(self):
+        """Update tinf, tinf_se, amplitude, tau, tau_range and noise; returns
+        (tinf, tinf_se, tau)."""
+
+        if self.n < 4:
+            return self.tinf, self.tinf_se, self.tau
+
+        # 2x2 normal equations per tau
+        det = self.n*self.se2 - self.se1**2
+        ok = det > 1e-12*self.n*self.se2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tinf = (self.se2*self.sT - self.se1*self.seT)/det
+            amplitude = (self.n*self.seT - self.se1*self.sT)/det
+            sse = self.sT2 - tinf*self.sT - amplitude*self.seT
+        sse = np.where(ok, np.maximum(sse, 0), np.inf)
+
+        best = np.argmin(sse)
+
+        self.tau = self.taus[best]
+        self.tinf = tinf[best] + self.T0
+        self.amplitude = amplitude[best]
+        self.noise = np.sqrt(sse[best]/(self.n - 3))
+        self.tau_range = (self.taus[0], self.taus[-1])
+        self.tinf_se = np.inf
+
+        if best == 0 or best == len(self.taus) - 1 or not np.all(ok[best - 1:best + 2]):
+            return self.tinf, self.tinf_se, self.tau
+
+        # parabola in log(tau) through the best candidate and its neighbours
+        u = np.log(self.taus[best - 1:best + 2])
+        curve = np.polyfit(u, sse[best - 1:best + 2], 2)
+        if curve[0] <= 0:
+            return self.tinf, self.tinf_se, self.tau
+        ubest = np.clip(-curve[1]/(2*curve[0]), u[0], u[2])
+        variance = max(np.polyval(curve, ubest), 0)/(self.n - 3)
+        half = np.sqrt(variance/curve[0]) # where the residuals grow by one noise variance
+
+        line = np.polyfit(u, tinf[best - 1:best + 2], 2)
+        self.tau = np.exp(ubest)
+        self.tinf = np.polyval(line, ubest) + self.T0
+        self.amplitude = np.polyval(np.polyfit(u, amplitude[best - 1:best + 2], 2), ubest)
+        self.noise = np.sqrt(variance)
+        self.tau_range = (np.exp(ubest - half), np.exp(ubest + half))
+
+        if self.tau_range[0] > self.taus[0] and self.tau_range[1] < self.taus[-1]:
+            conditional = variance*self.se2[best]/det[best]
+            spread = np.polyval(np.polyder(line), ubest)*half
+            self.tinf_se = np.sqrt(conditional + spread**2)
+
+        return self.tinf, self.tinf_se, self.tau
+
+    def converged(self, target_se, min_readings=10):
+        """True once Tinf is known to better than target_se."""
+
+        return self.n >= min_readings and self.tinf_se < target_se
+
+    def predict(self, t):
+        """Fitted temperature at time(s) t."""
+
+        return self.tinf + self.amplitude*np.exp(-(np.asarray(t) - self.t0)/self.tau)
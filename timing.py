@@ -0,0 +1,128 @@
+# per-step phase timing for the scan and temperature loops
+import collections
+import time
+
+import numpy as np
+
+
+def format_eta(seconds):
+    """h:mm:ss, or -- before there is a rate."""
+
+    if not np.isfinite(seconds):
+        return '--'
+
+    return '%d:%02d:%02d' % (seconds//3600, seconds%3600//60, seconds%60)
+
+
+class PhaseTimer:
+    """Wall time of every phase of every step.
+
+    lap(phase) charges the time since the previous lap (or since start())
+    to phase; end_step() closes the step's row. Phases that do not happen
+    once per step, like redraws on the GUI thread, are recorded separately
+    with add(). total is the number of steps expected, for the ETA.
+
+    Counts, means and maxima run over every step, but only the last keep
+    rows (and keep values per extra phase) are held for the percentiles and
+    the saved table, so an open-ended logger stays within fixed memory."""
+
+    def __init__(self, phases, total=None, keep=10000):
+        self.phases = list(phases)
+        self.total = total
+
+        self.steps = 0
+        self.sums = {}
+        self.maxima = {}
+        self.counts = {}
+        self.rows = collections.deque(maxlen=keep) # phase durations of the most recent steps
+        self.current = np.zeros(len(self.phases))
+        self.other = {}
+        self.keep = keep
+        self.ends = collections.deque(maxlen=100) # perf_counter at the end of recent steps
+        self.last = time.perf_counter()
+        self.started = self.last
+        self.finished = None
+
+    def start(self):
+        """Start timing a step."""
+
+        self.last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.current[self.phases.index(phase)] += now - self.last
+        self.last = now
+
+    def _count(self, phase, seconds):
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+        self.sums[phase] = self.sums.get(phase, 0.0) + seconds
+        self.maxima[phase] = max(self.maxima.get(phase, 0.0), seconds)
+
+    def end_step(self):
+        for phase, seconds in zip(self.phases, self.current):
+            self._count(phase, seconds)
+        self._count('step', self.current.sum())
+
+        self.rows.append(self.current)
+        self.current = np.zeros(len(self.phases))
+        self.steps += 1
+        self.finished = time.perf_counter()
+        self.ends.append(self.finished)
+
+    def add(self, phase, seconds):
+        self._count(phase, seconds)
+        self.other.setdefault(phase, collections.deque(maxlen=self.keep)).append(seconds)
+
+    def rate(self, window=20):
+        """Steps per second over the last window steps."""
+
+        ends = list(self.ends)[-window - 1:]
+        if len(ends) < 2:
+            return len(ends)/(time.perf_counter() - self.started) if len(ends) > 0 else 0.0
+
+        return (len(ends) - 1)/(ends[-1] - ends[0])
+
+    def eta(self):
+        """Seconds until total steps are done at the current rate."""
+
+        rate = self.rate()
+        if self.total is None or rate == 0:
+            return np.nan
+
+        return max(self.total - self.steps, 0)/rate
+
+    def summary(self):
+        """Phase -> (count, mean, median, p90, p99, max) in seconds; count,
+        mean and max over every step, the percentiles over the recent ones."""
+
+        table = {}
+        columns = [(phase, np.array([row[k] for row in self.rows])) for k, phase in enumerate(self.phases)]
+        columns += [(phase, np.array(values)) for phase, values in self.other.items()]
+        if len(self.rows) > 0:
+            columns.append(('step', np.array([row.sum() for row in self.rows])))
+
+        for phase, values in columns:
+            if len(values) == 0:
+                continue
+            count = self.counts[phase]
+            table[phase] = (count, self.sums[phase]/count, np.median(values),
+                            np.percentile(values, 90), np.percentile(values, 99), self.maxima[phase])
+
+        return table
+
+    def save(self, path):
+        """Percentiles per phase as comment lines, then one row of phase
+        durations (s) per step (the most recent keep steps)."""
+
+        with open(path, 'w') as f:
+            elapsed = (self.finished if self.finished is not None else time.perf_counter()) - self.started
+            f.write('# %d steps in %.1f s, %.3f steps/s\n' % (self.steps, elapsed,
+                                                            self.steps/elapsed if elapsed > 0 else 0))
+            f.write('# phase count mean median p90 p99 max (ms)\n')
+            for phase, stats in self.summary().items():
+                f.write('# %s %d' % (phase, stats[0]) + ''.join(' %.2f' % (1000*v) for v in stats[1:]) + '\n')
+            if self.steps > len(self.rows):
+                f.write('# last %d steps\n' % len(self.rows))
+            f.write('# ' + ' '.join(self.phases) + '\n')
+            if len(self.rows) > 0:
+                np.savetxt(f, np.array(self.rows), fmt='%.6f')